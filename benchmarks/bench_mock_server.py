@@ -0,0 +1,104 @@
+# end-to-end throughput benchmark of id_engine_coi.main against the local mock server
+# runs the complete pipeline for different concurrency settings and reports sequences per second
+#
+# usage: python benchmarks/bench_mock_server.py --sequences 200 --concurrency 5 20 50 --latency 0.2
+import argparse, datetime, json, shutil, sys, time, warnings
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mock_bold_server import MockBoldServer, default_config
+
+
+# function to write a fasta file with random sequences
+def write_fasta(fasta_path, n_sequences, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = np.array(list("ACGT"))
+
+    with open(fasta_path, "w") as fasta:
+        for idx in range(n_sequences):
+            fasta.write(
+                ">seq_{}\n{}\n".format(idx + 1, "".join(rng.choice(bases, 313)))
+            )
+
+
+# function to run the identification engine once against the mock server
+# the concurrency is the maximum query size, which is also the number of parallel downloads
+def run_pipeline(server, project_directory, n_sequences, concurrency):
+    from boldigger2 import id_engine_coi, urls
+
+    urls.configure(server.url)
+    id_engine_coi.max_query_size = concurrency
+    id_engine_coi.min_query_size = min(id_engine_coi.min_query_size, concurrency)
+    # do not wait minutes for the mock server
+    id_engine_coi.bad_response_wait = 1
+
+    shutil.rmtree(project_directory, ignore_errors=True)
+    project_directory.mkdir(parents=True)
+    fasta_path = project_directory.joinpath("mock.fasta")
+    write_fasta(fasta_path, n_sequences)
+
+    start = time.perf_counter()
+    id_engine_coi.main(
+        fasta_path,
+        username="mock",
+        password="mock",
+        thresholds=[97, 95, 90, 85, 50],
+        output_formats=["none"],
+    )
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput benchmark of boldigger2 against a local mock server."
+    )
+    parser.add_argument("--sequences", type=int, default=100)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[5, 20, 50])
+    parser.add_argument("--output", default="bench_mock_server.json")
+    parser.add_argument("--workdir", default="bench_projects/mock_server")
+    for key, value in default_config.items():
+        parser.add_argument("--{}".format(key), type=type(value), default=value)
+    arguments = vars(parser.parse_args())
+
+    n_sequences = arguments.pop("sequences")
+    concurrency_settings = arguments.pop("concurrency")
+    output = arguments.pop("output")
+    workdir = Path(arguments.pop("workdir"))
+
+    warnings.simplefilter("ignore")
+    results = {"server_config": arguments, "results": []}
+
+    for concurrency in concurrency_settings:
+        with MockBoldServer(**arguments) as server:
+            wall_time = run_pipeline(
+                server,
+                workdir.joinpath("concurrency_{}".format(concurrency)),
+                n_sequences,
+                concurrency,
+            )
+            result = {
+                "concurrency": concurrency,
+                "sequences": n_sequences,
+                "wall_time_s": round(wall_time, 3),
+                "sequences_per_second": round(n_sequences / wall_time, 3),
+                "requests": dict(server.request_counts),
+            }
+
+        results["results"].append(result)
+        print(
+            "{}: Concurrency {}: {} sequences per second.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"),
+                concurrency,
+                result["sequences_per_second"],
+            )
+        )
+
+        with open(output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# local stand-in for the parts of boldsystems.org that boldigger2 talks to
+# implements the login, the identification request, the result pages and the specimen api
+# can be started in-process (MockBoldServer) or as a subprocess:
+#
+# python benchmarks/mock_bold_server.py --port 8080 --latency 0.2 --broken_rate 0.01
+#
+# point boldigger2 to the server with boldigger2.urls.configure("http://127.0.0.1:8080")
+# or by setting the environment variables BOLDIGGER2_V4_URL, BOLDIGGER2_V4_RESULT_URL
+# and BOLDIGGER2_API_URL before starting boldigger2
+import argparse, hashlib, json, random, sys, threading, time, uuid
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from string import Template
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import synthetic_data
+
+template_directory = Path(__file__).parent.joinpath("mock_templates")
+
+# default behaviour of the server, every value can be changed per instance
+default_config = {
+    # mean latency per request in seconds, the actual latency is drawn from an exponential distribution
+    "latency": 0.0,
+    # latency of the identification request per submitted sequence
+    "latency_per_sequence": 0.0,
+    # fraction of requests that hang for timeout_delay seconds
+    "timeout_rate": 0.0,
+    "timeout_delay": 65.0,
+    # maximum number of requests per second and endpoint, 0 disables the rate limit
+    "rate_limit": 0,
+    # fraction of result pages that are broken records (kohana_error) or no matches
+    "broken_rate": 0.0,
+    "nomatch_rate": 0.0,
+    # fraction of identification requests that return one download link too few
+    "short_links_rate": 0.0,
+    "hits_per_page": 100,
+    "seed": 0,
+}
+
+
+# function to load a template from the template directory
+def load_template(name):
+    return Template(template_directory.joinpath(name).read_text())
+
+
+class MockBoldServer:
+    def __init__(self, host="127.0.0.1", port=0, **config):
+        self.config = dict(default_config, **config)
+        self.templates = {
+            name: load_template("{}.html".format(name))
+            for name in [
+                "home",
+                "ids_response",
+                "ids_response_row",
+                "result_page",
+                "result_page_row",
+                "nomatch_page",
+                "broken_page",
+            ]
+        }
+        self.taxonomy = synthetic_data.generate_taxonomy(
+            500, np.random.default_rng(self.config["seed"])
+        )
+        self.random = random.Random(self.config["seed"])
+        self.lock = threading.Lock()
+        # token -> (sequence id, search database, sequence) of all submitted sequences
+        self.results = {}
+        # endpoint -> timestamps of the requests during the last second
+        self.request_times = {}
+        # endpoint -> number of requests, can be used to check the load on the server
+        self.request_counts = {}
+
+        handler = type("MockBoldHandler", (MockBoldHandler,), {"mock": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    # start the server in a background thread
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # function to simulate latency and timeouts
+    def delay(self, n_sequences=0):
+        with self.lock:
+            hang = self.random.random() < self.config["timeout_rate"]
+            latency = (
+                self.random.expovariate(1 / self.config["latency"])
+                if self.config["latency"]
+                else 0
+            )
+
+        if hang:
+            time.sleep(self.config["timeout_delay"])
+
+        time.sleep(latency + n_sequences * self.config["latency_per_sequence"])
+
+    # function to check the rate limit of an endpoint, returns True if the request is allowed
+    def allow_request(self, endpoint):
+        now = time.monotonic()
+
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+            if not self.config["rate_limit"]:
+                return True
+
+            recent = [t for t in self.request_times.get(endpoint, []) if now - t < 1]
+            allowed = len(recent) < self.config["rate_limit"]
+            if allowed:
+                recent.append(now)
+            self.request_times[endpoint] = recent
+
+        return allowed
+
+    # function to render the login state on the home page
+    def render_home(self, logged_in):
+        if logged_in:
+            return self.templates["home"].substitute(
+                login_target="Logout", login_text="Log out"
+            )
+        else:
+            return self.templates["home"].substitute(
+                login_target="Login", login_text="Log in"
+            )
+
+    # function to register the submitted sequences and return the download links
+    def render_ids_response(self, sequences, searchdb):
+        rows = []
+
+        with self.lock:
+            for sequence_id, sequence in sequences:
+                token = uuid.uuid4().hex
+                self.results[token] = (sequence_id, searchdb, sequence)
+                rows.append(
+                    self.templates["ids_response_row"].substitute(
+                        sequence_id=sequence_id,
+                        result_path="/index.php/IDS_IdentificationRequest/results?token={}".format(
+                            token
+                        ),
+                    )
+                )
+
+            # drop the last link to simulate an insufficient number of download links
+            if rows and self.random.random() < self.config["short_links_rate"]:
+                rows = rows[:-1]
+
+        return self.templates["ids_response"].substitute(rows="\n".join(rows))
+
+    # function to render the top 100 hits page of a token
+    # the hits only depend on the sequence id, the database and the sequence, so repeated requests are identical
+    def render_result_page(self, token):
+        sequence_id, searchdb, sequence = self.results[token]
+        digest = hashlib.sha1(
+            "{}{}{}".format(sequence_id, searchdb, sequence).encode()
+        ).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+        with self.lock:
+            outcome = self.random.random()
+
+        if outcome < self.config["broken_rate"]:
+            return self.templates["broken_page"].substitute()
+        elif outcome < self.config["broken_rate"] + self.config["nomatch_rate"]:
+            return self.templates["nomatch_page"].substitute(
+                sequence_id=sequence_id, searchdb=searchdb
+            )
+
+        n_hits = self.config["hits_per_page"]
+        hits = self.taxonomy.iloc[rng.integers(0, len(self.taxonomy), n_hits)]
+        similarities = np.sort(rng.uniform(80, 100, n_hits))[::-1]
+        statuses = rng.choice(
+            ["Published", "Private", "Early-Release"], n_hits, p=[0.7, 0.2, 0.1]
+        )
+
+        rows = []
+        for (_, hit), similarity, status in zip(
+            hits.iterrows(), similarities, statuses
+        ):
+            if status == "Published":
+                process_id = "MOCK{:06d}-24".format(rng.integers(0, 100000))
+                status_cell = '<a class="publicrecord" id="{}">Published</a>'.format(
+                    process_id
+                )
+            else:
+                status_cell = status
+
+            rows.append(
+                self.templates["result_page_row"].substitute(
+                    Subspecies="",
+                    Similarity="{:.2f}".format(similarity),
+                    status_cell=status_cell,
+                    **hit.to_dict(),
+                )
+            )
+
+        table_class = (
+            "table resultsTable noborder"
+            if searchdb == "COX1_SPECIES"
+            else "resultsTable noborder"
+        )
+
+        return self.templates["result_page"].substitute(
+            sequence_id=sequence_id,
+            searchdb=searchdb,
+            summary=hits["Phylum"].iloc[0],
+            table_class=table_class,
+            rows="\n".join(rows),
+        )
+
+    # function to render the specimen api response for a list of process ids
+    def render_specimen_json(self, process_ids):
+        records = {}
+
+        for process_id in process_ids:
+            record_id = int(hashlib.sha1(process_id.encode()).hexdigest()[:6], 16)
+            records[process_id] = {
+                "processid": process_id,
+                "record_id": str(record_id),
+                "bin_uri": "BOLD:AAA{:04d}".format(record_id % 10000),
+                "specimen_identifiers": {"institution_storing": "Mock Institution"},
+                "specimen_desc": {"sex": "", "lifestage": "adult"},
+                "collection_event": {"country": "Germany"},
+                "taxonomy": {
+                    "identification_provided_by": "Mock Identifier",
+                    "identification_method": "BOLD ID Engine",
+                },
+            }
+
+        return json.dumps({"bold_records": {"records": records}})
+
+
+class MockBoldHandler(BaseHTTPRequestHandler):
+    # set by MockBoldServer when the handler class is created
+    mock = None
+
+    # keep the server quiet
+    def log_message(self, format, *args):
+        pass
+
+    def send_text(self, text, status=200, content_type="text/html", headers={}):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "{}; charset=utf-8".format(content_type))
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return parse_qs(self.rfile.read(length).decode())
+
+    def logged_in(self):
+        return "PHPSESSID=mock" in self.headers.get("Cookie", "")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        form = self.read_form()
+
+        if not self.mock.allow_request(path):
+            self.mock.delay()
+            return self.send_text("Too many requests", status=503)
+
+        if path == "/index.php/Login":
+            self.mock.delay()
+            self.send_text(
+                self.mock.render_home(logged_in=True),
+                headers={"Set-Cookie": "PHPSESSID=mock; Path=/"},
+            )
+        elif path == "/index.php/IDS_IdentificationRequest":
+            # every header line is followed by the sequence
+            sequences = []
+            for line in form.get("sequence", [""])[0].splitlines():
+                if line.startswith(">"):
+                    sequences.append([line[1:].strip(), ""])
+                elif sequences:
+                    sequences[-1][1] += line.strip()
+
+            self.mock.delay(len(sequences))
+            self.send_text(
+                self.mock.render_ids_response(
+                    sequences, form.get("searchdb", ["COX1"])[0]
+                )
+            )
+        else:
+            self.send_text("Not found", status=404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == "/index.php/API_Public/specimen":
+            self.mock.delay()
+            if not self.mock.allow_request(url.path):
+                return self.send_text(
+                    "You have exceeded the number of allowed calls.",
+                    content_type="text/plain",
+                )
+            process_ids = query.get("ids", [""])[0].split("|")
+            return self.send_text(
+                self.mock.render_specimen_json(process_ids),
+                content_type="application/json",
+            )
+
+        if not self.mock.allow_request(url.path):
+            self.mock.delay()
+            return self.send_text("Too many requests", status=429)
+
+        self.mock.delay()
+
+        if url.path in ["", "/", "/index.php"]:
+            self.send_text(self.mock.render_home(self.logged_in()))
+        elif url.path == "/index.php/MAS_Management_UserConsole":
+            # logged out sessions are redirected to the login page
+            if self.logged_in():
+                self.send_text(self.mock.render_home(logged_in=True))
+            else:
+                self.send_text("", status=302, headers={"Location": "/index.php/Login"})
+        elif url.path == "/index.php/IDS_IdentificationRequest/results":
+            token = query.get("token", [""])[0]
+            if token in self.mock.results:
+                self.send_text(self.mock.render_result_page(token))
+            else:
+                self.send_text(self.mock.templates["broken_page"].substitute())
+        else:
+            self.send_text("Not found", status=404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of boldsystems.org.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    for key, value in default_config.items():
+        parser.add_argument("--{}".format(key), type=type(value), default=value)
+    arguments = vars(parser.parse_args())
+
+    server = MockBoldServer(arguments.pop("host"), arguments.pop("port"), **arguments)
+    print("Mock BOLD server running on {}".format(server.url), flush=True)
+
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# offline benchmark suite for the post download stages of boldigger2
+# generates synthetic projects, runs every stage in a fresh process and records
+# wall time, cpu time and peak memory to a json file
+#
+# usage: python benchmarks/run_benchmarks.py --sizes 1000 10000 --output bench.json
+import argparse, datetime, json, multiprocessing, platform, shutil, sys
+import threading, time, tracemalloc, warnings
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import synthetic_data
+
+# resource only exists on posix systems, the memory is reported as unavailable elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# stages in the order they run in the pipeline, every stage depends on the output of the previous ones
+stages = [
+    "read_and_order",
+    "data_already_downloaded",
+    "add_additional_data",
+    "read_clean_data",
+    "digger_hit_main",
+    "excel_converter",
+]
+
+default_sizes = [1000, 10000, 100000]
+thresholds = [97, 95, 90, 85, 50]
+
+
+# function to prepare the inputs of a stage without timing them
+# returns a function that runs the stage
+def prepare_stage(stage, fasta_path, hdf_name_top_100_hits):
+    from boldigger2 import additional_data_download, digger_hit, id_engine_coi
+
+    read_fasta = id_engine_coi.read_fasta
+
+    if stage == "read_and_order":
+        return lambda: additional_data_download.read_and_order(
+            fasta_path, hdf_name_top_100_hits, read_fasta
+        )
+
+    top_100_hits, process_ids = additional_data_download.read_and_order(
+        fasta_path, hdf_name_top_100_hits, read_fasta
+    )
+
+    if stage == "data_already_downloaded":
+        return lambda: list(
+            additional_data_download.data_already_downloaded(
+                process_ids, hdf_name_top_100_hits
+            )
+        )
+    elif stage == "add_additional_data":
+        return lambda: additional_data_download.add_additional_data(
+            hdf_name_top_100_hits, top_100_hits, process_ids
+        )
+
+    # later stages need the top 100 hits with additional data
+    if not additional_data_download.additional_data_present(hdf_name_top_100_hits):
+        additional_data_download.add_additional_data(
+            hdf_name_top_100_hits, top_100_hits, process_ids
+        )
+
+    if stage == "read_clean_data":
+        return lambda: digger_hit.read_clean_data(hdf_name_top_100_hits)
+    elif stage == "digger_hit_main":
+        return lambda: digger_hit.main(
+            hdf_name_top_100_hits,
+            fasta_path.parent,
+            fasta_path.stem,
+            thresholds,
+            output_formats=["none"],
+        )
+    elif stage == "excel_converter":
+        return lambda: additional_data_download.excel_converter(
+            hdf_name_top_100_hits, output_formats=["xlsx"]
+        )
+
+
+# function to read the current resident set size in bytes, only available on linux
+# returns None if the memory cannot be measured on this system
+def current_rss():
+    if resource is None:
+        return None
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# function to sample the resident set size in the background while a stage runs
+def sample_rss(samples, stop_event):
+    while not stop_event.is_set():
+        samples.append(current_rss())
+        stop_event.wait(0.01)
+
+
+# function to run a single stage in a child process, the measurements are put into the queue
+# tracemalloc slows down allocation heavy stages a lot, so it is optional
+def run_stage(stage, fasta_path, hdf_name_top_100_hits, trace_memory, queue):
+    warnings.simplefilter("ignore")
+    run = prepare_stage(stage, fasta_path, hdf_name_top_100_hits)
+
+    rss_before = current_rss()
+    samples, stop_event = [rss_before], threading.Event()
+    sampler = threading.Thread(target=sample_rss, args=(samples, stop_event))
+    sampler.start()
+
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    run()
+
+    wall_time, cpu_time = (
+        time.perf_counter() - wall_start,
+        time.process_time() - cpu_start,
+    )
+    stop_event.set()
+    sampler.join()
+
+    result = {
+        "wall_time_s": round(wall_time, 4),
+        "cpu_time_s": round(cpu_time, 4),
+        "peak_rss_mb": None,
+        "peak_rss_growth_mb": None,
+        "max_rss_children_mb": None,
+    }
+
+    if resource is not None:
+        # child processes (e.g. parallel excel parts) are reported separately
+        # ru_maxrss is reported in kilobytes on linux
+        rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+        result["peak_rss_mb"] = round(max(samples) / 1024**2, 2)
+        result["peak_rss_growth_mb"] = round((max(samples) - rss_before) / 1024**2, 2)
+        result["max_rss_children_mb"] = round(rss_children / 1024, 2)
+
+    if trace_memory:
+        result["peak_traced_mb"] = round(
+            tracemalloc.get_traced_memory()[1] / 1024**2, 2
+        )
+        tracemalloc.stop()
+
+    queue.put(result)
+
+
+# function to run a stage in a fresh process so memory measurements do not influence each other
+def measure_stage(stage, fasta_path, hdf_name_top_100_hits, timeout, trace_memory):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(
+        target=run_stage,
+        args=(stage, fasta_path, hdf_name_top_100_hits, trace_memory, queue),
+    )
+    process.start()
+    process.join(timeout)
+
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {"status": "timeout"}
+    elif process.exitcode != 0:
+        return {"status": "failed", "exitcode": process.exitcode}
+    else:
+        return dict(status="ok", **queue.get())
+
+
+# function to collect some information about the environment for the result file
+def environment_info():
+    try:
+        package_version = version("boldigger2")
+    except PackageNotFoundError:
+        package_version = ""
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "boldigger2": package_version,
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks for the post download stages of boldigger2."
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=default_sizes)
+    parser.add_argument("--stages", nargs="+", choices=stages, default=stages)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--workdir", default="bench_projects")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--timeout", type=float, default=3600, help="Timeout per stage in seconds."
+    )
+    parser.add_argument(
+        "--skew", type=float, default=1.1, help="Zipf exponent of the taxonomy."
+    )
+    parser.add_argument("--nomatch_rate", type=float, default=0.02)
+    parser.add_argument("--broken_rate", type=float, default=0.005)
+    parser.add_argument("--process_id_reuse", type=float, default=0.8)
+    parser.add_argument(
+        "--trace_memory",
+        action="store_true",
+        help="Also record the peak memory traced by tracemalloc. Slows down the stages.",
+    )
+    arguments = parser.parse_args()
+
+    results = {"environment": environment_info(), "results": []}
+
+    for n_otus in arguments.sizes:
+        project_directory = Path(arguments.workdir).joinpath("otus_{}".format(n_otus))
+        shutil.rmtree(project_directory, ignore_errors=True)
+
+        print(
+            "{}: Generating synthetic project with {} OTUs.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), n_otus
+            )
+        )
+        fasta_path, hdf_name_top_100_hits = synthetic_data.write_project(
+            project_directory,
+            n_otus,
+            seed=arguments.seed,
+            skew=arguments.skew,
+            nomatch_rate=arguments.nomatch_rate,
+            broken_rate=arguments.broken_rate,
+            process_id_reuse=arguments.process_id_reuse,
+        )
+
+        for stage in stages:
+            if stage not in arguments.stages:
+                continue
+
+            result = measure_stage(
+                stage,
+                fasta_path,
+                hdf_name_top_100_hits,
+                arguments.timeout,
+                arguments.trace_memory,
+            )
+            result.update({"stage": stage, "n_otus": n_otus})
+            results["results"].append(result)
+
+            print(
+                "{}: {} with {} OTUs: {}".format(
+                    datetime.datetime.now().strftime("%H:%M:%S"),
+                    stage,
+                    n_otus,
+                    result,
+                )
+            )
+
+            # write after every stage, so partial results survive long runs
+            with open(arguments.output, "w") as output:
+                json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
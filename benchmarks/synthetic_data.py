@@ -0,0 +1,307 @@
+import datetime, string
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+# columns of the top 100 hits as they are written by id_engine_coi.as_request
+hit_columns = [
+    "ID",
+    "Phylum",
+    "Class",
+    "Order",
+    "Family",
+    "Genus",
+    "Species",
+    "Subspecies",
+    "Similarity",
+    "Status",
+    "Process_ID",
+    "database",
+    "request_date",
+]
+
+# same column sizes as used by id_engine_coi.as_request
+hit_item_sizes = {
+    "ID": 100,
+    "Phylum": 80,
+    "Class": 80,
+    "Order": 80,
+    "Family": 80,
+    "Genus": 80,
+    "Species": 80,
+    "Subspecies": 80,
+    "Status": 15,
+    "Process_ID": 25,
+    "database": 20,
+    "request_date": 30,
+}
+
+# same column sizes as used by additional_data_download.json_response_to_dataframe
+additional_data_item_sizes = {
+    "processid": 30,
+    "record_id": 10,
+    "bin_uri": 15,
+    "institution_storing": 150,
+    "sex": 8,
+    "lifestage": 80,
+    "country": 80,
+    "identification_provided_by": 80,
+    "identification_method": 150,
+}
+
+
+# function to generate a pronounceable name without digits from an integer
+def int_to_name(number, suffix=""):
+    letters = string.ascii_lowercase
+    name = ""
+    number = number + 26
+
+    while number:
+        number, remainder = divmod(number, 26)
+        name = letters[remainder] + name
+
+    return name.capitalize() + suffix
+
+
+# function to generate a taxonomic tree with n_species species
+# returns a dataframe with one line per species
+def generate_taxonomy(n_species, rng):
+    # every level splits into a few children, so the tree looks like a real one
+    n_genera = max(1, n_species // 4)
+    n_families = max(1, n_genera // 5)
+    n_orders = max(1, n_families // 6)
+    n_classes = max(1, n_orders // 5)
+    n_phyla = max(1, n_classes // 3)
+
+    genus = rng.integers(0, n_genera, n_species)
+    family = rng.integers(0, n_families, n_genera)[genus]
+    order = rng.integers(0, n_orders, n_families)[family]
+    clss = rng.integers(0, n_classes, n_orders)[order]
+    phylum = rng.integers(0, n_phyla, n_classes)[clss]
+
+    taxonomy = pd.DataFrame(
+        {
+            "Phylum": [int_to_name(i, "poda") for i in phylum],
+            "Class": [int_to_name(i, "ida") for i in clss],
+            "Order": [int_to_name(i, "ptera") for i in order],
+            "Family": [int_to_name(i, "idae") for i in family],
+            "Genus": [int_to_name(i, "us") for i in genus],
+        }
+    )
+    taxonomy["Species"] = (
+        taxonomy["Genus"]
+        + " "
+        + [int_to_name(i).lower() + "ensis" for i in range(n_species)]
+    )
+
+    return taxonomy
+
+
+# function to generate a realistic top 100 hits table
+# n_otus: number of sequences
+# skew: zipf exponent of the species abundance, higher values lead to fewer distinct names
+# nomatch_rate / broken_rate: fraction of OTUs returning NoMatch / BrokenRecord
+# process_id_reuse: fraction of published hits that share a process id with another hit
+# invalid_name_rate: fraction of species names containing specials, e.g. "sp. 1"
+# all_records_rate: fraction of OTUs that are also queried against the all records database
+def generate_top_100_hits(
+    n_otus,
+    seed=0,
+    hits_per_otu=100,
+    n_species=None,
+    skew=1.1,
+    nomatch_rate=0.02,
+    broken_rate=0.005,
+    process_id_reuse=0.8,
+    invalid_name_rate=0.05,
+    all_records_rate=0.3,
+):
+    rng = np.random.default_rng(seed)
+
+    if n_species is None:
+        n_species = max(50, n_otus // 2)
+
+    taxonomy = generate_taxonomy(n_species, rng)
+
+    # skewed species abundance
+    species_weights = 1 / np.arange(1, n_species + 1) ** skew
+    species_weights = species_weights / species_weights.sum()
+
+    otu_ids = np.array(["OTU_{}".format(i + 1) for i in range(n_otus)], dtype=object)
+
+    # decide for every OTU if it is a nomatch, broken record or real hit
+    otu_state = rng.choice(
+        ["hit", "NoMatch", "BrokenRecord"],
+        size=n_otus,
+        p=[1 - nomatch_rate - broken_rate, nomatch_rate, broken_rate],
+    )
+
+    # the request date is equal for all hits of the same response
+    request_date = datetime.datetime(2024, 1, 1).strftime("%Y-%m-%d %X")
+
+    # every OTU has a true species
+    true_species = rng.choice(n_species, size=n_otus, p=species_weights)
+
+    tables = []
+
+    for database in ["species", "all_records"]:
+        if database == "species":
+            otus = np.flatnonzero(otu_state == "hit")
+        else:
+            otus = np.flatnonzero(otu_state == "hit")
+            otus = otus[rng.random(len(otus)) < all_records_rate]
+
+        n_hits = len(otus) * hits_per_otu
+        hit_otus = np.repeat(otus, hits_per_otu)
+
+        # hits are either the true species of the OTU or a random one
+        hit_species = np.where(
+            rng.random(n_hits) < 0.6,
+            true_species[hit_otus],
+            rng.choice(n_species, size=n_hits, p=species_weights),
+        )
+        hits = taxonomy.iloc[hit_species].reset_index(drop=True)
+
+        # the all records database also contains hits without species names
+        if database == "all_records":
+            hits.loc[rng.random(n_hits) < 0.3, "Species"] = ""
+
+        # add some names with specials that have to be cleaned
+        invalid = rng.random(n_hits) < invalid_name_rate
+        hits.loc[invalid, "Species"] = (
+            hits.loc[invalid, "Genus"]
+            + " sp. "
+            + (rng.integers(1, 20, invalid.sum()).astype(str))
+        )
+
+        # similarity decreases from the top hit of every OTU
+        top_similarity = rng.uniform(80, 100, n_otus)[hit_otus]
+        decrease = rng.exponential(0.2, (len(otus), hits_per_otu)).cumsum(axis=1)
+        hits["Similarity"] = np.clip(top_similarity - decrease.ravel(), 70, 100).round(
+            2
+        )
+
+        hits["Status"] = rng.choice(
+            ["Published", "Private", "Early-Release"], size=n_hits, p=[0.7, 0.2, 0.1]
+        )
+
+        # published hits share process ids depending on the reuse rate
+        published = hits["Status"] == "Published"
+        pool_size = max(1, int(published.sum() * (1 - process_id_reuse)))
+        process_ids = rng.integers(0, pool_size, published.sum())
+        hits["Process_ID"] = ""
+        hits.loc[published, "Process_ID"] = [
+            "{}{:05d}-24".format(int_to_name(i % 500).upper()[:4], i)
+            for i in process_ids
+        ]
+
+        hits.insert(0, "ID", otu_ids[hit_otus])
+        hits.insert(7, "Subspecies", "")
+        hits["database"] = database
+        hits["request_date"] = request_date
+
+        # responses arrive in random order, the hits of one response stay together
+        order = np.repeat(rng.permutation(len(otus)), hits_per_otu)
+        tables.append(hits.iloc[np.argsort(order, kind="stable")])
+
+    # nomatches and broken records are represented by a single line
+    for state in ["NoMatch", "BrokenRecord"]:
+        otus = np.flatnonzero(otu_state == state)
+        no_hits = pd.DataFrame(
+            [[otu] + [state] * 7 + [0.0] + [""] * 2 for otu in otu_ids[otus]],
+            columns=hit_columns[:-2],
+        )
+        no_hits["database"] = "species"
+        no_hits["request_date"] = request_date
+        tables.append(no_hits)
+
+    top_100_hits = pd.concat(tables, axis=0).reset_index(drop=True)[hit_columns]
+
+    return otu_ids, top_100_hits
+
+
+# function to generate the additional data for all process ids of a top 100 hits table
+def generate_additional_data(top_100_hits, seed=0):
+    rng = np.random.default_rng(seed)
+
+    process_ids = top_100_hits["Process_ID"].replace("", np.nan).dropna().unique()
+    n_ids = len(process_ids)
+
+    additional_data = pd.DataFrame(
+        {
+            "processid": process_ids,
+            "record_id": rng.integers(1000000, 9999999, n_ids).astype(str),
+            "bin_uri": [
+                "BOLD:{}".format(int_to_name(i).upper().rjust(7, "A"))
+                for i in rng.integers(0, n_ids // 3 + 1, n_ids)
+            ],
+            "institution_storing": rng.choice(
+                ["Centre for Biodiversity Genomics", "Mined from GenBank, NCBI", ""],
+                n_ids,
+            ),
+            "sex": rng.choice(["", "male", "female"], n_ids),
+            "lifestage": rng.choice(["", "adult", "larva"], n_ids),
+            "country": rng.choice(["Germany", "Canada", "Costa Rica", ""], n_ids),
+            "identification_provided_by": rng.choice(["", "Paul Hebert"], n_ids),
+            "identification_method": rng.choice(
+                ["BOLD ID Engine", "Morphology", "Tree based identification", ""],
+                n_ids,
+            ),
+        }
+    )
+
+    return additional_data
+
+
+# function to write a synthetic project to disk
+# writes a fasta file and the top 100 hits hdf storage in the same layout as boldigger2 does
+# returns the fasta path and the hdf name
+def write_project(
+    directory, n_otus, seed=0, with_additional_data=True, **generator_arguments
+):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    otu_ids, top_100_hits = generate_top_100_hits(
+        n_otus, seed=seed, **generator_arguments
+    )
+
+    # write random sequences, the content does not matter for the offline stages
+    rng = np.random.default_rng(seed)
+    fasta_path = directory.joinpath("synthetic_{}.fasta".format(n_otus))
+    bases = np.array(list("ACGT"))
+
+    with open(fasta_path, "w") as fasta:
+        for otu in otu_ids:
+            fasta.write(">{}\n{}\n".format(otu, "".join(rng.choice(bases, 313))))
+
+    hdf_name_top_100_hits = directory.joinpath(
+        "{}_top_100_hits.h5.lz".format(fasta_path.stem)
+    )
+
+    with pd.HDFStore(
+        hdf_name_top_100_hits, mode="w", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        hdf_output.append(
+            "top_100_hits_unsorted",
+            top_100_hits,
+            format="t",
+            data_columns=True,
+            min_itemsize=hit_item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+        )
+
+        # with additional data present the download stage has nothing left to do
+        if with_additional_data:
+            hdf_output.append(
+                "additional_data",
+                generate_additional_data(top_100_hits, seed=seed),
+                format="t",
+                data_columns=True,
+                min_itemsize=additional_data_item_sizes,
+                complib="blosc:blosclz",
+                complevel=9,
+            )
+
+    return fasta_path, hdf_name_top_100_hits
@@ -1,10 +1,10 @@
 import argparse, sys, datetime
-from boldigger2 import id_engine_coi
 from importlib.metadata import version
+from pathlib import Path
 
 
-# main function for the command line interface
-def main():
+# function to parse the command line arguments and run the requested function
+def run_command():
     # initialize the parse and display default behavior if called without arguments
     formatter = lambda prog: argparse.HelpFormatter(prog, max_help_position=35)
     # define the parser
@@ -24,10 +24,11 @@ def main():
         "identify", help="Run the COI identification engine."
     )
 
-    # add the only argument (fasta path)
+    # add the fasta paths, several files or directories are identified in one batch
     parser_identify.add_argument(
         "fasta_file",
-        help="Path to the fasta file or fasta file in current working directory.",
+        nargs="+",
+        help="Path to the fasta file or fasta file in current working directory. Several fasta files or directories with fasta files are identified in one batch that shares the login and the requests to BOLD.",
     )
 
     # add the optional argument username
@@ -52,6 +53,355 @@ def main():
         help="BOLD password",
     )
 
+    # add the optional argument output formats
+    parser_identify.add_argument(
+        "-output_formats",
+        nargs="+",
+        choices=["xlsx", "parquet", "csv", "top_100_parquet", "none"],
+        default=["xlsx", "parquet"],
+        help="Output formats for the top 100 hits and the identification result. The top 100 hits are only saved to parquet with top_100_parquet. Use none to skip the export.",
+    )
+
+    # add the optional argument for a prometheus textfile
+    parser_identify.add_argument(
+        "-metrics_textfile",
+        default=None,
+        help="Path to a textfile that is updated with metrics in prometheus format during the run.",
+    )
+
+    # add the optional argument for a local proxy list
+    parser_identify.add_argument(
+        "-proxy_list",
+        default=None,
+        help="Path to a file with one proxy per line that is used for the additional data download instead of public proxy lists.",
+    )
+
+    # add the optional argument for a memory budget
+    parser_identify.add_argument(
+        "-memory_budget",
+        type=int,
+        default=None,
+        help="Memory budget in MB for ordering the hits, adding the additional data and selecting the top hits. The hits are processed in chunks that fit into the budget.",
+    )
+
+    # add the optional argument for a local reference library
+    parser_identify.add_argument(
+        "-reference_library",
+        default=None,
+        help="Path to a reference library built with build-reference. The sequences are searched locally instead of on BOLD, no login needed.",
+    )
+
+    # add the optional argument to cluster near-identical sequences
+    parser_identify.add_argument(
+        "-cluster_identity",
+        type=float,
+        default=None,
+        help="Cluster sequences with at least this identity in %% (e.g. 99.5) and only query one representative per cluster. Ambiguity codes match the bases they stand for.",
+    )
+
+    # add the optional argument to validate the clusters
+    parser_identify.add_argument(
+        "-cluster_validation",
+        type=int,
+        default=0,
+        help="Number of cluster members that are queried as well, to check if they get the same top hit as their representative.",
+    )
+
+    # add the optional argument to identify only one shard of the sequences
+    parser_identify.add_argument(
+        "-shard",
+        default=None,
+        help="Only identify shard i of N of the sequences, given as i/N, e.g. 2/4. Every node identifies one shard, merge combines them afterwards.",
+    )
+
+    # add the optional argument to profile the run
+    parser_identify.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile all stages and save the profiles in the project folder.",
+    )
+
+    # add the optional argument to trace all requests
+    parser_identify.add_argument(
+        "--trace",
+        action="store_true",
+        help="Save a trace of all requests that can be opened in chrome://tracing or ui.perfetto.dev.",
+    )
+
+    # add the optional argument to emit the top hits while the run is going
+    parser_identify.add_argument(
+        "--online",
+        action="store_true",
+        help="Write the top hit of every sequence as soon as its data is complete.",
+    )
+
+    # add the optional argument to archive the raw responses
+    parser_identify.add_argument(
+        "--archive",
+        action="store_true",
+        help="Keep the raw responses of BOLD compressed in the project folder, so the project can be parsed again with reparse.",
+    )
+
+    # add the reclassify parser
+    parser_reclassify = subparsers.add_parser(
+        "reclassify",
+        help="Select the top hits of a finished project again, e.g. with new thresholds. Needs no login.",
+    )
+
+    # add the only argument (project storage path)
+    parser_reclassify.add_argument(
+        "project_file",
+        help="Path to the top 100 hits storage of a finished project (FASTA_NAME_top_100_hits.h5.lz).",
+    )
+
+    # add the optional argument thresholds
+    parser_reclassify.add_argument(
+        "-thresholds",
+        nargs="+",
+        type=int,
+        help="Thresholds for species, genus, family, order and class.",
+    )
+
+    # add the optional argument output formats
+    parser_reclassify.add_argument(
+        "-output_formats",
+        nargs="+",
+        choices=["xlsx", "parquet", "csv", "top_100_parquet", "none"],
+        default=["xlsx", "parquet"],
+        help="Output formats for the identification result.",
+    )
+
+    # add the sweep parser
+    parser_sweep = subparsers.add_parser(
+        "sweep",
+        help="Select the top hits of a finished project for many threshold sets at once. Needs no login.",
+    )
+
+    # add the only argument (project storage path)
+    parser_sweep.add_argument(
+        "project_file",
+        help="Path to the top 100 hits storage of a finished project (FASTA_NAME_top_100_hits.h5.lz).",
+    )
+
+    # add the threshold sets, missing thresholds of a set are replaced by the defaults
+    parser_sweep.add_argument(
+        "-threshold_sets",
+        nargs="+",
+        required=True,
+        help="Threshold sets as comma separated thresholds for species, genus, family, order and class, e.g. 97,95,90,85,50 99,97,90,85,50.",
+    )
+
+    # add the optional argument output formats
+    parser_sweep.add_argument(
+        "-output_formats",
+        nargs="+",
+        choices=["xlsx", "parquet", "csv", "top_100_parquet", "none"],
+        default=["parquet"],
+        help="Output formats for the threshold sweep.",
+    )
+
+    # add the reparse parser
+    parser_reparse = subparsers.add_parser(
+        "reparse",
+        help="Parse the archived raw responses of a project again without downloading anything. Needs no login.",
+    )
+
+    # add the only argument (fasta path)
+    parser_reparse.add_argument(
+        "fasta_file",
+        help="Path to the fasta file of a project that was identified with --archive.",
+    )
+
+    # add the optional argument thresholds
+    parser_reparse.add_argument(
+        "-thresholds",
+        nargs="+",
+        type=int,
+        help="Thresholds for species, genus, family, order and class.",
+    )
+
+    # add the optional argument output formats
+    parser_reparse.add_argument(
+        "-output_formats",
+        nargs="+",
+        choices=["xlsx", "parquet", "csv", "top_100_parquet", "none"],
+        default=["xlsx", "parquet"],
+        help="Output formats for the top 100 hits and the identification result. The top 100 hits are only saved to parquet with top_100_parquet.",
+    )
+
+    # add the optional argument to profile the run
+    parser_reparse.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile all stages and save the profiles in the project folder.",
+    )
+
+    # add the merge parser
+    parser_merge = subparsers.add_parser(
+        "merge",
+        help="Merge the shards of a fasta file into one project and select the top hits. Needs no login.",
+    )
+
+    # add the only argument (fasta path)
+    parser_merge.add_argument(
+        "fasta_file",
+        help="Path to the fasta file that was identified in shards.",
+    )
+
+    # add the optional argument for the shard stores
+    parser_merge.add_argument(
+        "-shard_stores",
+        nargs="+",
+        default=None,
+        help="Paths to the shard stores (FASTA_NAME_shard_i_of_N_top_100_hits.h5.lz). Defaults to all shard stores next to the fasta file.",
+    )
+
+    # add the optional argument thresholds
+    parser_merge.add_argument(
+        "-thresholds",
+        nargs="+",
+        type=int,
+        help="Thresholds for species, genus, family, order and class.",
+    )
+
+    # add the optional argument output formats
+    parser_merge.add_argument(
+        "-output_formats",
+        nargs="+",
+        choices=["xlsx", "parquet", "csv", "top_100_parquet", "none"],
+        default=["xlsx", "parquet"],
+        help="Output formats for the top 100 hits and the identification result. The top 100 hits are only saved to parquet with top_100_parquet.",
+    )
+
+    # add the optional argument for a memory budget
+    parser_merge.add_argument(
+        "-memory_budget",
+        type=int,
+        default=None,
+        help="Memory budget in MB for merging, ordering the hits, adding the additional data and selecting the top hits.",
+    )
+
+    # add the optional argument to profile the run
+    parser_merge.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile all stages and save the profiles next to the fasta file.",
+    )
+
+    # add the index parser
+    parser_index = subparsers.add_parser(
+        "index",
+        help="Register finished projects in the results warehouse, so they can be queried together. Needs no login.",
+    )
+
+    # add the projects
+    parser_index.add_argument(
+        "project_files",
+        nargs="+",
+        help="Paths to project storages (FASTA_NAME_top_100_hits.h5.lz) or directories that are searched for them recursively.",
+    )
+
+    # add the optional argument for the warehouse
+    parser_index.add_argument(
+        "-warehouse",
+        default=None,
+        help="Directory of the warehouse. Defaults to a folder next to the cached login.",
+    )
+
+    # add the optional argument thresholds
+    parser_index.add_argument(
+        "-thresholds",
+        nargs="+",
+        type=int,
+        help="Thresholds for species, genus, family, order and class, only used for projects without a parquet identification result.",
+    )
+
+    # add the query parser
+    parser_query = subparsers.add_parser(
+        "query",
+        help="Query the top hits of all projects in the results warehouse. Needs no login.",
+    )
+
+    # add the optional argument for the warehouse
+    parser_query.add_argument(
+        "-warehouse",
+        default=None,
+        help="Directory of the warehouse. Defaults to a folder next to the cached login.",
+    )
+
+    # add the indexed lookups
+    parser_query.add_argument(
+        "-ids", nargs="+", default=None, help="Sequence IDs to look up."
+    )
+    parser_query.add_argument(
+        "-taxa",
+        nargs="+",
+        default=None,
+        help="Taxa of any level to look up, e.g. a genus. Top hits matching any ID, taxon or BIN are returned.",
+    )
+    parser_query.add_argument(
+        "-bins", nargs="+", default=None, help="BINs to look up, e.g. BOLD:AAA1234."
+    )
+
+    # add the filters
+    parser_query.add_argument(
+        "-projects",
+        nargs="+",
+        default=None,
+        help="Only query these projects (names of the fasta files).",
+    )
+    parser_query.add_argument(
+        "-min_similarity",
+        type=float,
+        default=None,
+        help="Only return top hits with at least this similarity.",
+    )
+
+    # add the projection
+    parser_query.add_argument(
+        "-columns", nargs="+", default=None, help="Columns to return."
+    )
+
+    # add the optional argument for the output
+    parser_query.add_argument(
+        "-output",
+        default=None,
+        help="Save the result as parquet or csv (by file extension) instead of printing it.",
+    )
+
+    # add the build reference parser
+    parser_build_reference = subparsers.add_parser(
+        "build-reference",
+        help="Build a local reference library that identify can search instead of BOLD.",
+    )
+
+    # add the reference sequences
+    parser_build_reference.add_argument(
+        "fasta_file",
+        help="Path to the reference sequences, the headers start with the process id (e.g. processid|taxon|marker).",
+    )
+
+    # add the metadata of the references
+    parser_build_reference.add_argument(
+        "metadata_file",
+        help="Path to a table (tsv, csv or parquet) with processid, taxonomy and optionally status, bin_uri and the other additional data, e.g. a BOLD data package.",
+    )
+
+    # add the optional argument for the output directory
+    parser_build_reference.add_argument(
+        "-output",
+        default=None,
+        help="Directory of the reference library. Defaults to FASTA_NAME_reference_library next to the fasta file.",
+    )
+
+    # add the optional argument for the k-mer size
+    parser_build_reference.add_argument(
+        "-kmer_size",
+        type=int,
+        default=12,
+        help="Length of the k-mers in the index (1 - 16).",
+    )
+
     # add version control NEEDS TO BE UPDATED
     parser.add_argument("--version", action="version", version=version("boldigger2"))
 
@@ -66,6 +416,7 @@ def main():
     # only use the threshold provided by the user replace the rest with defaults
     default_thresholds = [97, 95, 90, 85, 50]
     thresholds = []
+    arguments.thresholds = getattr(arguments, "thresholds", None)
 
     for i in range(5):
         try:
@@ -83,14 +434,185 @@ def main():
             )
         )
 
+    # a shard is given as i/N
+    if getattr(arguments, "shard", None):
+        try:
+            shard_index, shard_count = (
+                int(value) for value in arguments.shard.split("/")
+            )
+        except ValueError:
+            parser_identify.error("invalid shard: {}".format(arguments.shard))
+
+        if not 1 <= shard_index <= shard_count:
+            parser_identify.error("invalid shard: {}".format(arguments.shard))
+
+        arguments.shard = (shard_index, shard_count)
+
     # run the identification engine
-    if arguments.function == "identify":
-        id_engine_coi.main(
+    # the engine is imported here, so the heavy dependencies are only loaded if it actually runs
+    if arguments.function == "identify" and (
+        len(arguments.fasta_file) > 1 or Path(arguments.fasta_file[0]).is_dir()
+    ):
+        if arguments.online:
+            parser_identify.error("--online needs a single fasta file")
+        if arguments.shard:
+            parser_identify.error("-shard needs a single fasta file")
+
+        from boldigger2 import batch
+
+        batch.main(
             arguments.fasta_file,
             username=arguments.username,
             password=arguments.password,
             thresholds=thresholds,
+            output_formats=arguments.output_formats,
+            metrics_textfile=arguments.metrics_textfile,
+            profile=arguments.profile,
+            trace=arguments.trace,
+            proxy_list=arguments.proxy_list,
+            memory_budget=arguments.memory_budget,
+            reference_library=arguments.reference_library,
+            cluster_identity=arguments.cluster_identity,
+            cluster_validation=arguments.cluster_validation,
+            archive_responses=arguments.archive,
+        )
+    elif arguments.function == "identify":
+        from boldigger2 import id_engine_coi
+
+        id_engine_coi.main(
+            arguments.fasta_file[0],
+            username=arguments.username,
+            password=arguments.password,
+            thresholds=thresholds,
+            output_formats=arguments.output_formats,
+            metrics_textfile=arguments.metrics_textfile,
+            profile=arguments.profile,
+            trace=arguments.trace,
+            proxy_list=arguments.proxy_list,
+            online=arguments.online,
+            memory_budget=arguments.memory_budget,
+            reference_library=arguments.reference_library,
+            cluster_identity=arguments.cluster_identity,
+            cluster_validation=arguments.cluster_validation,
+            archive_responses=arguments.archive,
+            shard=arguments.shard,
+        )
+
+    # merge the shards of a fasta file
+    if arguments.function == "merge":
+        from boldigger2 import id_engine_coi, sharding
+
+        sharding.merge(
+            arguments.fasta_file,
+            id_engine_coi.read_fasta,
+            shard_stores=arguments.shard_stores,
+            thresholds=thresholds,
+            output_formats=arguments.output_formats,
+            memory_budget=arguments.memory_budget,
+            profile=arguments.profile,
+        )
+
+    # parse the archived responses of a project again
+    if arguments.function == "reparse":
+        from boldigger2 import id_engine_coi
+
+        id_engine_coi.reparse(
+            arguments.fasta_file,
+            thresholds=thresholds,
+            output_formats=arguments.output_formats,
+            profile=arguments.profile,
+        )
+
+    # select the top hits again from the stored top 100 hits
+    if arguments.function == "reclassify":
+        from boldigger2 import digger_hit
+
+        digger_hit.reclassify(
+            arguments.project_file,
+            thresholds,
+            output_formats=arguments.output_formats,
+        )
+
+    # register finished projects in the warehouse
+    if arguments.function == "index":
+        from boldigger2 import warehouse
+
+        warehouse.register(
+            arguments.project_files,
+            warehouse=arguments.warehouse,
+            thresholds=thresholds,
+        )
+
+    # query the warehouse
+    if arguments.function == "query":
+        from boldigger2 import warehouse
+        import pyarrow.compute as pc
+
+        result = warehouse.query(
+            warehouse=arguments.warehouse,
+            ids=arguments.ids,
+            taxa=arguments.taxa,
+            bins=arguments.bins,
+            projects=arguments.projects,
+            filter=(
+                pc.field("Similarity") >= arguments.min_similarity
+                if arguments.min_similarity is not None
+                else None
+            ),
+            columns=arguments.columns,
         )
+        warehouse.save_query(result, arguments.output)
+
+    # build a local reference library
+    if arguments.function == "build-reference":
+        from boldigger2 import local_engine
+
+        local_engine.build(
+            arguments.fasta_file,
+            arguments.metadata_file,
+            library_path=arguments.output,
+            kmer_size=arguments.kmer_size,
+        )
+
+    if arguments.function == "sweep":
+        from boldigger2 import digger_hit
+
+        threshold_sets = []
+
+        for threshold_set in arguments.threshold_sets:
+            try:
+                threshold_set = [
+                    int(threshold)
+                    for threshold in threshold_set.split(",")
+                    if threshold
+                ]
+            except ValueError:
+                parser_sweep.error("invalid threshold set: {}".format(threshold_set))
+
+            threshold_sets.append(
+                threshold_set[:5] + default_thresholds[len(threshold_set) :]
+            )
+
+        digger_hit.sweep(
+            arguments.project_file,
+            threshold_sets,
+            output_formats=arguments.output_formats,
+        )
+
+
+# main function for the command line interface
+# invalid sequences, failed logins and projects that are not ready for a function are reported without a traceback
+def main():
+    from boldigger2.exceptions import InvalidSequenceError, LoginError, ProjectError
+
+    try:
+        run_command()
+    except (InvalidSequenceError, LoginError, ProjectError) as error:
+        for problem in str(error).split("\n"):
+            print(
+                "{}: {}".format(datetime.datetime.now().strftime("%H:%M:%S"), problem)
+            )
+        sys.exit()
 
 
 # run only if called as a top level script
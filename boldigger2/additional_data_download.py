@@ -1,32 +1,75 @@
-import more_itertools, requests_html, datetime, time, json
+import more_itertools, requests_html, datetime, time, json, queue, threading
 import pandas as pd
 import numpy as np
+from contextlib import nullcontext
 from pathlib import Path
 from tqdm import tqdm
+from boldigger2 import export, urls, metrics, tracing, journal
+from boldigger2 import proxy_pool, archive, messages, in_memory
 from boldigger2.exceptions import APIOverload
 from boldigger2.exceptions import ProxyNotWorking
 from requests.exceptions import ReadTimeout
 from requests.exceptions import ChunkedEncodingError
 from requests.exceptions import ProxyError
 from requests.exceptions import ConnectTimeout
-from fp.fp import FreeProxy
-from fp.errors import FreeProxyException
-from fp.errors import FreeProxyException
 from json.decoder import JSONDecodeError
+from concurrent.futures import ThreadPoolExecutor
 from urllib3.exceptions import ReadTimeoutError
 
-
-# function to sort the hdf dataframe according to the order in the fasta file
+# the specimen data is downloaded in several threads, only one of them may write to the hdf storage
+hdf_lock = threading.Lock()
+
+# set size limits for the columns of the ordered hits
+hit_item_sizes = {
+    "ID": 100,
+    "Phylum": 80,
+    "Class": 80,
+    "Order": 80,
+    "Family": 80,
+    "Genus": 80,
+    "Species": 80,
+    "Subspecies": 80,
+    "Status": 15,
+    "Process_ID": 25,
+    "database": 20,
+    "request_date": 30,
+}
+
+# set size limits for the columns of the additional data
+additional_data_item_sizes = {
+    "processid": 30,
+    "record_id": 10,
+    "bin_uri": 15,
+    "institution_storing": 150,
+    "sex": 8,
+    "lifestage": 80,
+    "country": 80,
+    "identification_provided_by": 80,
+    "identification_method": 150,
+}
+
+# rows of a chunk are held in memory about this many times while the chunk is processed
+chunk_copies = 4
+
+# columns of the additional data table
+additional_data_columns = [
+    "processid",
+    "record_id",
+    "bin_uri",
+    "institution_storing",
+    "sex",
+    "lifestage",
+    "country",
+    "identification_provided_by",
+    "identification_method",
+]
+
+
+# function to sort the top 100 hits according to the order of the ids
 # also removes duplicate entries from malformed requests in the previous step
-def read_and_order(fasta_path, hdf_name_top_100_hits, read_fasta):
-    # read in the fasta
-    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
-
-    # the keys are in perfect order, use those to order the hdf file
-    sorter = {name: idx for idx, name in enumerate(fasta_dict.keys())}
-
-    # read the hdf data that needs to be sorted
-    top_100_hits = pd.read_hdf(hdf_name_top_100_hits, key="top_100_hits_unsorted")
+def order_top_100_hits(top_100_hits, ids):
+    # the ids are in perfect order, use those to order the hits
+    sorter = {name: idx for idx, name in enumerate(ids)}
 
     # remove duplicate entries from malformed responses here
     # generate a unique id
@@ -57,7 +100,7 @@ def read_and_order(fasta_path, hdf_name_top_100_hits, read_fasta):
     top_100_hits.index.name = "index"
 
     # sort the results, remove the sorter, reset the index
-    top_100_hits = (
+    return (
         top_100_hits.sort_values(
             by=["sorter", "database", "index"],
             ascending=[True, False, True],
@@ -66,36 +109,45 @@ def read_and_order(fasta_path, hdf_name_top_100_hits, read_fasta):
         .reset_index(drop=True)
     )
 
-    # add the sorted dataframe to the original hdf storage
-    # add the results to the hdf storage
-    # set size limits for the columns
-    item_sizes = {
-        "ID": 100,
-        "Phylum": 80,
-        "Class": 80,
-        "Order": 80,
-        "Family": 80,
-        "Genus": 80,
-        "Species": 80,
-        "Subspecies": 80,
-        "Status": 15,
-        "Process_ID": 25,
-        "database": 20,
-        "request_date": 30,
-    }
 
+# function to return the non empty process ids of the hits, indexed like the hits
+def non_empty_process_ids(top_100_hits):
+    with pd.option_context("future.no_silent_downcasting", True):
+        return top_100_hits["Process_ID"].replace("", np.nan).dropna()
+
+
+# function to sort the hdf dataframe according to the order in the fasta file
+# also removes duplicate entries from malformed requests in the previous step
+def read_and_order(fasta_path, hdf_name_top_100_hits, read_fasta):
+    # read in the fasta
+    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+
+    # read the hdf data that needs to be sorted and sort it in the order of the fasta file
+    top_100_hits = order_top_100_hits(
+        pd.read_hdf(hdf_name_top_100_hits, key="top_100_hits_unsorted"),
+        fasta_dict.keys(),
+    )
+
+    # add the sorted dataframe to the original hdf storage
     # only have to write the results once
-    try:
-        pd.read_hdf(hdf_name_top_100_hits, key="top_100_hits_sorted")
+    state = journal.load_state(hdf_name_top_100_hits)
+
+    if journal.complete(state, "top_100_hits_sorted", len(top_100_hits.index)):
         # give user output
-        print(
+        messages.write(
             "{}: Hits are already ordered from a previous run.".format(
                 datetime.datetime.now().strftime("%H:%M:%S")
             )
         )
-    except KeyError:
+    else:
+        # a chunked run may have been interrupted, the table is written again in one piece
+        if journal.committed(state, "top_100_hits_sorted"):
+            journal.discard(hdf_name_top_100_hits, "top_100_hits_sorted")
+
         # append results to hdf
-        with pd.HDFStore(
+        with metrics.hdf_append(
+            "top_100_hits_sorted", len(top_100_hits.index)
+        ), pd.HDFStore(
             hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
         ) as hdf_output:
             hdf_output.append(
@@ -103,34 +155,202 @@ def read_and_order(fasta_path, hdf_name_top_100_hits, read_fasta):
                 top_100_hits,
                 format="t",
                 data_columns=True,
-                min_itemsize=item_sizes,
+                min_itemsize=hit_item_sizes,
                 complib="blosc:blosclz",
                 complevel=9,
             )
+            nrows = hdf_output.get_storer("top_100_hits_sorted").nrows
+
+        journal.record(
+            hdf_name_top_100_hits,
+            "checkpoint",
+            key="top_100_hits_sorted",
+            nrows=nrows,
+        )
 
-        print(
+        messages.write(
             "{}: Hits ordered successfully.".format(
                 datetime.datetime.now().strftime("%H:%M:%S")
             )
         )
 
     # drop process IDs that are empty
-    with pd.option_context("future.no_silent_downcasting", True):
-        process_ids = top_100_hits["Process_ID"].replace("", np.nan).dropna()
+    process_ids = non_empty_process_ids(top_100_hits)
 
     # return process ids
     return top_100_hits, process_ids
 
 
+# function to estimate the memory of one row of a table from a sample of its first rows
+def row_memory(hdf_name_top_100_hits, key, sample_size=1000):
+    sample = pd.read_hdf(hdf_name_top_100_hits, key=key, stop=sample_size)
+
+    return max(1, sample.memory_usage(deep=True).sum() / max(1, len(sample.index)))
+
+
+# function to turn a memory budget in MB into the number of rows of a table that are processed at once
+def chunk_rows(hdf_name_top_100_hits, key, memory_budget):
+    row_size = row_memory(hdf_name_top_100_hits, key) * chunk_copies
+
+    return max(1000, int(memory_budget * 1024 * 1024 / row_size))
+
+
+# function to compute the order of the unsorted hits without loading the whole table
+# only the ID, database and request date are read chunk by chunk
+# returns the row numbers of the hits in the order read_and_order sorts them, duplicate responses are left out
+def ordering_plan(hdf_name_top_100_hits, sorter, rows_per_chunk):
+    nrows = journal.load_state(hdf_name_top_100_hits)["nrows"].get(
+        "top_100_hits_unsorted", 0
+    )
+    # first request date per ID and database, later responses are duplicates from malformed requests
+    first_requests = {}
+    positions, databases, rows = [], [], []
+
+    for start in range(0, nrows, rows_per_chunk):
+        stop = min(start + rows_per_chunk, nrows)
+        chunk = pd.read_hdf(
+            hdf_name_top_100_hits,
+            key="top_100_hits_unsorted",
+            columns=["ID", "database", "request_date"],
+            start=start,
+            stop=stop,
+        )
+
+        for id, database, request_date in chunk.drop_duplicates(
+            subset=["ID", "database"]
+        ).itertuples(index=False):
+            first_requests.setdefault((id, database), request_date)
+
+        first_request = [
+            first_requests[key] for key in zip(chunk["ID"], chunk["database"])
+        ]
+        kept = (chunk["request_date"] == first_request).to_numpy()
+
+        # IDs that are not in the fasta file are sorted to the end
+        positions.append(
+            chunk["ID"].map(sorter).fillna(len(sorter)).to_numpy(dtype=np.int64)[kept]
+        )
+        databases.append(chunk["database"].to_numpy(dtype=object)[kept])
+        rows.append(np.arange(start, stop)[kept])
+
+    if not rows:
+        return np.array([], dtype=np.int64)
+
+    positions, databases, rows = (
+        np.concatenate(positions),
+        np.concatenate(databases),
+        np.concatenate(rows),
+    )
+
+    # sort by the fasta order, the database in descending order and the order of the download
+    database_rank = pd.Series(databases).rank(method="dense", ascending=False)
+
+    return rows[np.lexsort((rows, database_rank.to_numpy(), positions))]
+
+
+# function to order the hits chunk by chunk with bounded memory, resumes after the last written chunk
+# returns the process ids of all hits
+def read_and_order_chunked(
+    fasta_path, hdf_name_top_100_hits, read_fasta, rows_per_chunk
+):
+    # read in the fasta, the keys are in perfect order
+    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+    sorter = {name: idx for idx, name in enumerate(fasta_dict.keys())}
+
+    ordered_rows = ordering_plan(hdf_name_top_100_hits, sorter, rows_per_chunk)
+
+    state = journal.load_state(hdf_name_top_100_hits)
+    done = state["nrows"].get("top_100_hits_sorted", 0)
+
+    if done == len(ordered_rows) and done:
+        # give user output
+        messages.write(
+            "{}: Hits are already ordered from a previous run.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+    else:
+        # the table does not belong to the current hits, write it again
+        if done > len(ordered_rows):
+            journal.discard(hdf_name_top_100_hits, "top_100_hits_sorted")
+            done = 0
+
+        for start in tqdm(
+            range(done, len(ordered_rows), rows_per_chunk),
+            desc="Ordering hits",
+            disable=not messages.enabled,
+        ):
+            chunk_positions = ordered_rows[start : start + rows_per_chunk]
+            coordinates = np.sort(chunk_positions)
+
+            # read the rows of the chunk in storage order and bring them into the final order
+            chunk = pd.read_hdf(
+                hdf_name_top_100_hits, key="top_100_hits_unsorted", where=coordinates
+            )
+            chunk.index = coordinates
+            chunk = chunk.loc[chunk_positions]
+            chunk.index = pd.RangeIndex(start, start + len(chunk_positions))
+
+            with metrics.hdf_append(
+                "top_100_hits_sorted", len(chunk.index)
+            ), pd.HDFStore(
+                hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+            ) as hdf_output:
+                # the indexes of the data columns are created once after the last chunk
+                hdf_output.append(
+                    "top_100_hits_sorted",
+                    chunk,
+                    format="t",
+                    data_columns=True,
+                    min_itemsize=hit_item_sizes,
+                    complib="blosc:blosclz",
+                    complevel=9,
+                    index=False,
+                )
+                nrows = hdf_output.get_storer("top_100_hits_sorted").nrows
+
+            journal.record(
+                hdf_name_top_100_hits,
+                "checkpoint",
+                key="top_100_hits_sorted",
+                nrows=nrows,
+            )
+
+        with pd.HDFStore(hdf_name_top_100_hits, mode="a") as hdf_output:
+            hdf_output.create_table_index("top_100_hits_sorted")
+
+        messages.write(
+            "{}: Hits ordered successfully.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+
+    # collect the process ids chunk by chunk, empty process ids are dropped
+    process_ids = []
+
+    for start in range(0, len(ordered_rows), rows_per_chunk):
+        chunk = pd.read_hdf(
+            hdf_name_top_100_hits,
+            key="top_100_hits_sorted",
+            columns=["Process_ID"],
+            start=start,
+            stop=start + rows_per_chunk,
+        )
+        process_ids.append(chunk["Process_ID"].loc[chunk["Process_ID"] != ""].unique())
+
+    return pd.Series(np.concatenate(process_ids + [[]]), dtype=object)
+
+
 # function to check if for any of the process IDs the additional data has already been downloaded
 # also removes duplicate entries from the process ids to prepare the download
 # split the data up into managable batches of 100 processids
 def data_already_downloaded(process_ids, hdf_name_top_100_hits):
-    # check if the hdf storage already contains additional data
-    try:
-        already_downloaded = pd.read_hdf(hdf_name_top_100_hits, key="additional_data")
-        already_downloaded = already_downloaded["processid"]
-    except:
+    # check if the journal already contains additional data
+    state = journal.load_state(hdf_name_top_100_hits)
+
+    if state is not None:
+        already_downloaded = journal.ids_in_stage(state, "metadata")
+    else:
         already_downloaded = []
 
     # filter all ids that are already have been downloaded
@@ -144,22 +364,22 @@ def data_already_downloaded(process_ids, hdf_name_top_100_hits):
 
 # function to generate an API download link from a batch of process ids
 def generate_download_link(process_id_batch):
-    url = "http://www.boldsystems.org/index.php/API_Public/specimen?ids={}&format=json".format(
-        "|".join(process_id_batch)
+    url = "{}/index.php/API_Public/specimen?ids={}&format=json".format(
+        urls.api_url, "|".join(process_id_batch)
     )
 
     return url
 
 
-# function to parse the xml returned by the BOLD api into a dataframe
-def json_response_to_dataframe(response, process_id_batch, hdf_name_top_100_hits):
-    if "You have exceeded" in response.text:
+# function to parse the json returned by the BOLD api into a dataframe
+def parse_specimen_data(text, process_id_batch):
+    if "You have exceeded" in text:
         raise APIOverload
-    if "REMOTE_ADDR" in response.text:
+    if "REMOTE_ADDR" in text:
         raise ProxyNotWorking
 
     # load the json response
-    response_data = json.loads(response.text)["bold_records"]["records"]
+    response_data = json.loads(text)["bold_records"]["records"]
 
     # collect all results of one process id batch here
     process_id_batch_results = []
@@ -202,142 +422,208 @@ def json_response_to_dataframe(response, process_id_batch, hdf_name_top_100_hits
         )
 
     # generate a dataframe
-    process_id_batch_results = pd.DataFrame(
-        process_id_batch_results,
-        columns=[
-            "processid",
-            "record_id",
-            "bin_uri",
-            "institution_storing",
-            "sex",
-            "lifestage",
-            "country",
-            "identification_provided_by",
-            "identification_method",
-        ],
-    )
+    return pd.DataFrame(process_id_batch_results, columns=additional_data_columns)
+
+
+# function to append the additional data of a batch of process ids to the hdf storage and the journal
+def save_additional_data(
+    process_id_batch_results, process_id_batch, hdf_name_top_100_hits
+):
+    # append results to hdf, the checkpoint is written while holding the lock to keep the order of appends
+    with hdf_lock:
+        with metrics.hdf_append(
+            "additional_data", len(process_id_batch_results.index)
+        ), pd.HDFStore(
+            hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+        ) as hdf_output:
+            hdf_output.append(
+                "additional_data",
+                process_id_batch_results,
+                format="t",
+                data_columns=True,
+                min_itemsize=additional_data_item_sizes,
+                complib="blosc:blosclz",
+                complevel=9,
+            )
+            nrows = hdf_output.get_storer("additional_data").nrows
+
+        journal.record(
+            hdf_name_top_100_hits,
+            "metadata",
+            key="additional_data",
+            nrows=nrows,
+            ids=process_id_batch,
+        )
 
-    # append the data to a new key in the hdf storage
-    item_sizes = {
-        "processid": 30,
-        "record_id": 10,
-        "bin_uri": 15,
-        "institution_storing": 150,
-        "sex": 8,
-        "lifestage": 80,
-        "country": 80,
-        "identification_provided_by": 80,
-        "identification_method": 150,
-    }
 
-    # append results to hdf
-    with pd.HDFStore(
-        hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
-    ) as hdf_output:
-        hdf_output.append(
-            "additional_data",
-            process_id_batch_results,
-            format="t",
-            data_columns=True,
-            min_itemsize=item_sizes,
-            complib="blosc:blosclz",
-            complevel=9,
+# function to parse the response of the BOLD api and save it to the hdf storage
+# in a batch run a dict of project storage -> needed process ids is passed instead of a single storage,
+# every storage receives the rows of the process ids it needs
+# an in-memory project only keeps the rows, there is no storage, journal or archive
+def json_response_to_dataframe(response, process_id_batch, hdf_name_top_100_hits):
+    process_id_batch_results = parse_specimen_data(response.text, process_id_batch)
+
+    if isinstance(hdf_name_top_100_hits, in_memory.Project):
+        hdf_name_top_100_hits.add_additional_data(
+            process_id_batch_results, process_id_batch
+        )
+        return
+
+    request_date = pd.Timestamp.now().strftime("%Y-%m-%d %X")
+
+    if isinstance(hdf_name_top_100_hits, dict):
+        storages = hdf_name_top_100_hits
+    else:
+        storages = {hdf_name_top_100_hits: None}
+
+    for hdf_name, needed_ids in storages.items():
+        if needed_ids is None:
+            needed = [True] * len(process_id_batch)
+        else:
+            needed = [id in needed_ids for id in process_id_batch]
+
+        if not any(needed):
+            continue
+
+        # keep the raw response, so the data can be parsed again without downloading it
+        archive.store(
+            hdf_name,
+            archive.specimen_data,
+            response.text,
+            ids=list(process_id_batch),
+            request_date=request_date,
+        )
+
+        save_additional_data(
+            process_id_batch_results.loc[needed].reset_index(drop=True),
+            [id for id, keep in zip(process_id_batch, needed) if keep],
+            hdf_name,
         )
 
 
-# function to generate a new proxy
-def fresh_proxy():
+# function to download one batch of process ids, retries with the best available connection of the pool
+def download_batch(session, id_batch, pool, hdf_name_top_100_hits):
+    # create a url for the id batch
+    url = generate_download_link(id_batch)
+
+    # run until getting a valid response
     while True:
+        connection = pool.acquire()
+        outcome = "broken"
+
         try:
-            proxy = FreeProxy(https=True, rand=True).get()
-            tqdm.write(
-                "{}: Proxy set to {}.".format(
-                    datetime.datetime.now().strftime("%H:%M:%S"), proxy
+            start = time.perf_counter()
+            with tracing.span(
+                "GET specimen api",
+                "http",
+                ids=len(id_batch),
+                proxy=connection.address,
+            ):
+                response = session.get(
+                    url, timeout=60, proxies=connection.requests_proxies
+                )
+            latency = time.perf_counter() - start
+            # parse the response
+            with tracing.span("parse specimen json", "parse"):
+                json_response_to_dataframe(response, id_batch, hdf_name_top_100_hits)
+            outcome = "success"
+            return
+        except (
+            ReadTimeout,
+            ConnectTimeout,
+            ChunkedEncodingError,
+            ConnectionError,
+            ReadTimeoutError,
+        ):
+            metrics.record_timeout(url)
+            messages.write(
+                "{}: Read timed out, retrying.".format(
+                    datetime.datetime.now().strftime("%H:%M:%S")
+                )
+            )
+            outcome = "timeout"
+        except APIOverload:
+            messages.write(
+                "{}: API overloaded. Switching proxy.".format(
+                    datetime.datetime.now().strftime("%H:%M:%S")
                 )
             )
-            return proxy
-        except FreeProxyException:
-            tqdm.write(
-                "{}: No proxy available, waiting.".format(
+            outcome = "overload"
+        except (ProxyError, ProxyNotWorking):
+            outcome = "broken"
+        except JSONDecodeError:
+            messages.write(
+                "{}: Malformed response. Switching proxy.".format(
                     datetime.datetime.now().strftime("%H:%M:%S")
                 )
             )
-            time.sleep(60)
-            return ""
+            outcome = "broken"
+        finally:
+            pool.release(connection, outcome, latency if outcome == "success" else None)
 
 
-def download_data(process_ids_to_download, hdf_name_top_100_hits):
+# function to download batches from the queue until it is empty, runs in a worker thread
+def download_worker(batch_queue, pool, hdf_name_top_100_hits, progress_bar):
     with requests_html.HTMLSession() as session:
-        # create a proxy for later
-        proxy = ""
-        for id_batch in tqdm(
-            list(process_ids_to_download), desc="Downloading additional data"
-        ):
-            # create a url for the id batch
-            url = generate_download_link(id_batch)
-
-            # define a timeout counter so set a fresh proxy from time to time
-            timeout_counter = 0
-            # run until getting a valid response
-            while True:
-                try:
-                    # as long as the original IP is working, use this one
-                    if not proxy:
-                        response = session.get(url, timeout=60)
-                    else:
-                        response = session.get(
-                            url, timeout=60, proxies={"http": proxy, "https": proxy}
-                        )
-                    # parse the response
-                    json_response_to_dataframe(
-                        response, id_batch, hdf_name_top_100_hits
-                    )
-                    break
-                except (
-                    ReadTimeout,
-                    ConnectTimeout,
-                    ChunkedEncodingError,
-                    ConnectionError,
-                    ReadTimeoutError,
-                ):
-                    tqdm.write(
-                        "{}: Read timed out, retrying.".format(
-                            datetime.datetime.now().strftime("%H:%M:%S")
-                        )
-                    )
-                    timeout_counter += 1
-                    if timeout_counter >= 10:
-                        proxy = fresh_proxy()
-                        timeout_counter = 0
-                    continue
-                except APIOverload:
-                    tqdm.write(
-                        "{}: API overloaded. Switching proxy.".format(
-                            datetime.datetime.now().strftime("%H:%M:%S")
-                        )
-                    )
-                    # set ip adress via a proxy
-                    proxy = fresh_proxy()
-                    continue
-                except (ProxyError, ProxyNotWorking):
-                    # set ip adress via a proxy
-                    proxy = fresh_proxy()
-                    continue
-                except JSONDecodeError:
-                    tqdm.write(
-                        "{}: Malformed response. Switching proxy.".format(
-                            datetime.datetime.now().strftime("%H:%M:%S")
-                        )
-                    )
-                    # set ip adress via a proxy
-                    proxy = fresh_proxy()
-                    continue
+        metrics.instrument_session(session)
+        while True:
+            try:
+                id_batch = batch_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            download_batch(session, id_batch, pool, hdf_name_top_100_hits)
+            progress_bar.update(1)
+
+
+# function to download the additional data for all batches
+# the batches are downloaded concurrently with the direct connection and all healthy proxies of the pool
+# a running pool can be passed in to reuse it for several downloads, it is not closed afterwards
+def download_data(
+    process_ids_to_download, hdf_name_top_100_hits, proxy_source=None, pool=None
+):
+    id_batches = list(process_ids_to_download)
+
+    if not id_batches:
+        return
+
+    batch_queue = queue.Queue()
+    for id_batch in id_batches:
+        batch_queue.put(id_batch)
+
+    # validate the proxies against a small request to the specimen api
+    if pool is None:
+        pool = proxy_pool.ProxyPool(source=proxy_source or proxy_pool.free_proxy_source)
+        pool_context = pool.start(generate_download_link(id_batches[0][:1]))
+    else:
+        pool_context = nullcontext(pool)
+
+    with pool_context, tqdm(
+        total=len(id_batches),
+        desc="Downloading additional data",
+        disable=not messages.enabled,
+    ) as progress_bar, ThreadPoolExecutor(
+        max_workers=min(len(id_batches), pool.max_connections())
+    ) as executor:
+        workers = [
+            executor.submit(
+                download_worker,
+                batch_queue,
+                pool,
+                hdf_name_top_100_hits,
+                progress_bar,
+            )
+            for _ in range(min(len(id_batches), pool.max_connections()))
+        ]
 
+        # raise errors of the workers
+        for worker in workers:
+            worker.result()
 
-# function to add the additional data to the top 100 hits
-def add_additional_data(hdf_name_top_100_hits, top_100_hits, process_ids):
-    # load the additional data downloaded
-    additional_data = pd.read_hdf(hdf_name_top_100_hits, key="additional_data")
+
+# function to join the downloaded additional data to the top 100 hits via the process ids
+# process_ids holds the non empty process ids of the hits, indexed like the hits
+def join_additional_data(top_100_hits, process_ids, additional_data):
     # transform additional data to dict, retain the column names
     additional_data = additional_data.to_dict("tight")
     column_names = additional_data["columns"][1:]
@@ -363,11 +649,27 @@ def add_additional_data(hdf_name_top_100_hits, top_100_hits, process_ids):
     ]
 
     # merge the additional data and the top 100 hits on index
-    top_100_hits = pd.concat([top_100_hits, additional_data], axis=1)
+    return pd.concat([top_100_hits, additional_data], axis=1)
+
+
+# function to add the additional data to the top 100 hits
+def add_additional_data(hdf_name_top_100_hits, top_100_hits, process_ids):
+    # load the additional data downloaded
+    additional_data = pd.read_hdf(hdf_name_top_100_hits, key="additional_data")
+
+    top_100_hits = join_additional_data(top_100_hits, process_ids, additional_data)
+
+    # a chunked run may have been interrupted, the table is written again in one piece
+    if journal.committed(
+        journal.load_state(hdf_name_top_100_hits), "top_100_hits_additional_data"
+    ):
+        journal.discard(hdf_name_top_100_hits, "top_100_hits_additional_data")
 
     # add the top 100 hits with additional data to the hdf storage
     # in this case we can infer the size of the columns since we won't append to this file anymore
-    with pd.HDFStore(
+    with metrics.hdf_append(
+        "top_100_hits_additional_data", len(top_100_hits.index)
+    ), pd.HDFStore(
         hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
     ) as hdf_output:
         hdf_output.append(
@@ -378,86 +680,213 @@ def add_additional_data(hdf_name_top_100_hits, top_100_hits, process_ids):
             complib="blosc:blosclz",
             complevel=9,
         )
+        nrows = hdf_output.get_storer("top_100_hits_additional_data").nrows
+
+    journal.record(
+        hdf_name_top_100_hits,
+        "checkpoint",
+        key="top_100_hits_additional_data",
+        nrows=nrows,
+    )
+
+
+# function to add the additional data to the top 100 hits chunk by chunk with bounded memory
+# only the process id column of the additional data is held in memory, resumes after the last written chunk
+def add_additional_data_chunked(hdf_name_top_100_hits, rows_per_chunk):
+    state = journal.load_state(hdf_name_top_100_hits)
+    nrows = state["nrows"]["top_100_hits_sorted"]
+    done = state["nrows"].get("top_100_hits_additional_data", 0)
+
+    if done > nrows:
+        journal.discard(hdf_name_top_100_hits, "top_100_hits_additional_data")
+        done = 0
+
+    # row of every process id in the additional data, like in add_additional_data the last download wins
+    processid_rows = pd.read_hdf(
+        hdf_name_top_100_hits,
+        key="additional_data",
+        columns=["processid"],
+        stop=state["nrows"].get("additional_data", 0),
+    )["processid"]
+    processid_rows = pd.Series(
+        np.arange(len(processid_rows.index)), index=processid_rows.to_numpy()
+    )
+    processid_rows = processid_rows.loc[~processid_rows.index.duplicated(keep="last")]
+
+    # the process id of the additional data is not part of the joined table
+    item_sizes = {
+        **hit_item_sizes,
+        **additional_data_item_sizes,
+        "specimen_page_url": 120,
+    }
+    item_sizes.pop("processid")
+
+    for start in tqdm(
+        range(done, nrows, rows_per_chunk),
+        desc="Adding additional data",
+        disable=not messages.enabled,
+    ):
+        top_100_hits = pd.read_hdf(
+            hdf_name_top_100_hits,
+            key="top_100_hits_sorted",
+            start=start,
+            stop=min(start + rows_per_chunk, nrows),
+        )
+        top_100_hits.index = pd.RangeIndex(start, start + len(top_100_hits.index))
+
+        # drop process IDs that are empty
+        process_ids = non_empty_process_ids(top_100_hits)
+
+        # only read the additional data of the process ids in this chunk
+        coordinates = np.sort(processid_rows.loc[process_ids.unique()].to_numpy())
+
+        if len(coordinates):
+            additional_data = pd.read_hdf(
+                hdf_name_top_100_hits, key="additional_data", where=coordinates
+            )
+        else:
+            additional_data = pd.DataFrame(columns=additional_data_columns)
+
+        top_100_hits = join_additional_data(top_100_hits, process_ids, additional_data)
+
+        with metrics.hdf_append(
+            "top_100_hits_additional_data", len(top_100_hits.index)
+        ), pd.HDFStore(
+            hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+        ) as hdf_output:
+            # the indexes of the data columns are created once after the last chunk
+            hdf_output.append(
+                "top_100_hits_additional_data",
+                top_100_hits,
+                format="t",
+                data_columns=True,
+                min_itemsize=item_sizes,
+                complib="blosc:blosclz",
+                complevel=9,
+                index=False,
+            )
+            written = hdf_output.get_storer("top_100_hits_additional_data").nrows
+
+        journal.record(
+            hdf_name_top_100_hits,
+            "checkpoint",
+            key="top_100_hits_additional_data",
+            nrows=written,
+        )
+
+    with pd.HDFStore(hdf_name_top_100_hits, mode="a") as hdf_output:
+        hdf_output.create_table_index("top_100_hits_additional_data")
+
 
+# function to export the top 100 hits with additional data to the selected output formats
+# parquet is only written if top_100_parquet is selected
+def excel_converter(
+    hdf_name_top_100_hits, output_formats=export.default_output_formats
+):
+    # generate a savename without the hdf suffixes
+    savename_stem = Path(hdf_name_top_100_hits).with_suffix("").with_suffix("")
 
-def excel_converter(hdf_name_top_100_hits):
-    top_100_hits = pd.read_hdf(
-        hdf_name_top_100_hits, key="top_100_hits_additional_data"
+    export.export_hdf_table(
+        hdf_name_top_100_hits,
+        "top_100_hits_additional_data",
+        savename_stem,
+        export.top_100_formats(output_formats),
     )
 
-    # split the dataframe by 1.000.000 entries
-    idx_parts = more_itertools.chunked(top_100_hits.index, 1000000)
 
-    # generate an excel savename
-    excel_savename = Path(hdf_name_top_100_hits).with_suffix("").with_suffix("")
+# function to check if the top 100 hits with additional data have been written completely
+# they are complete once they have as many rows as the ordered hits
+def additional_data_complete(hdf_name_top_100_hits):
+    state = journal.load_state(hdf_name_top_100_hits)
 
-    for idx, idx_part in enumerate(idx_parts):
-        excel_savename = "{}_part_{}.xlsx".format(excel_savename, idx)
-        top_100_hits.iloc[idx_part].to_excel(excel_savename, index=False)
+    return state is not None and journal.complete(
+        state,
+        "top_100_hits_additional_data",
+        state["nrows"].get("top_100_hits_sorted"),
+    )
 
 
 # function to check if the additional data has already been downloaded
 # download can be skipped if that is the case --> returns True
 def additional_data_present(hdf_name_top_100_hits):
-    try:
-        pd.read_hdf(hdf_name_top_100_hits, key="top_100_hits_additional_data")
+    if additional_data_complete(hdf_name_top_100_hits):
         # give user output
-        print(
+        messages.write(
             "{}: Additional data has already been downloaded.".format(
                 datetime.datetime.now().strftime("%H:%M:%S")
             )
         )
 
         return True
-    except KeyError:
+    else:
         # if no additional data can be found return False
         return False
 
 
 # main function to run the additional data download
-def main(fasta_path, hdf_name_top_100_hits, read_fasta):
+def main(
+    fasta_path,
+    hdf_name_top_100_hits,
+    read_fasta,
+    output_formats=export.default_output_formats,
+    proxy_list=None,
+    memory_budget=None,
+):
     # give user output
-    print(
+    messages.write(
         "{}: Trying to order the top 100 hits.".format(
             datetime.datetime.now().strftime("%H:%M:%S")
         )
     )
 
     # read and sort the hdf file according to the order in the fasta file
-    top_100_hits, process_ids = read_and_order(
-        fasta_path, hdf_name_top_100_hits, read_fasta
-    )
-
-    # check if some of the ids have already been downloaded
-    process_ids_to_download = data_already_downloaded(
-        process_ids, hdf_name_top_100_hits
-    )
+    # with a memory budget in MB the hits are processed in chunks that fit into the budget
+    with metrics.stage("ordering"):
+        if memory_budget:
+            rows_per_chunk = chunk_rows(
+                hdf_name_top_100_hits, "top_100_hits_unsorted", memory_budget
+            )
+            process_ids = read_and_order_chunked(
+                fasta_path, hdf_name_top_100_hits, read_fasta, rows_per_chunk
+            )
+        else:
+            top_100_hits, process_ids = read_and_order(
+                fasta_path, hdf_name_top_100_hits, read_fasta
+            )
 
     # skip the download if the data is already present
-    if not additional_data_present(hdf_name_top_100_hits):
-        # download the data
-        download_data(process_ids_to_download, hdf_name_top_100_hits)
+    with metrics.stage("additional_data"):
+        if not additional_data_present(hdf_name_top_100_hits):
+            # check if some of the ids have already been downloaded
+            process_ids_to_download = data_already_downloaded(
+                process_ids, hdf_name_top_100_hits
+            )
 
-        # add the metadata to the top 100 hits, push to a new hdf table
-        top_100_hits = add_additional_data(
-            hdf_name_top_100_hits, top_100_hits, process_ids
-        )
+            # download the data, proxies are taken from the proxy list if provided
+            download_data(
+                process_ids_to_download,
+                hdf_name_top_100_hits,
+                proxy_source=(
+                    proxy_pool.file_proxy_source(proxy_list) if proxy_list else None
+                ),
+            )
+
+            # add the metadata to the top 100 hits, push to a new hdf table
+            if memory_budget:
+                add_additional_data_chunked(hdf_name_top_100_hits, rows_per_chunk)
+            else:
+                add_additional_data(hdf_name_top_100_hits, top_100_hits, process_ids)
 
     # give user output
-    print(
+    messages.write(
         "{}: Additional data successfully downloaded and saved.".format(
             datetime.datetime.now().strftime("%H:%M:%S")
         )
     )
 
-    print(
-        "{}: Saving top 100 hits to excel, this may take a while.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
-        )
-    )
-
     # run the excel converter in the end
-    excel_converter(hdf_name_top_100_hits)
+    with metrics.stage("export"):
+        excel_converter(hdf_name_top_100_hits, output_formats)
 
 
 # run only if called as a toplevel script
@@ -0,0 +1,220 @@
+import asyncio, functools, threading, more_itertools
+import pandas as pd
+from pathlib import Path
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from boldigger2 import id_engine_coi, additional_data_download, digger_hit, login
+from boldigger2 import local_engine, id_summary, proxy_pool, in_memory, messages
+from boldigger2 import metrics, profiling, tracing
+from boldigger2.exceptions import InvalidSequenceError
+
+# thresholds for species, genus, family, order and class, missing thresholds are replaced by these
+default_thresholds = [97, 95, 90, 85, 50]
+
+# metrics, traces and profiles are module level state, so only one identification runs at a time
+run_lock = threading.Lock()
+
+
+# function to turn sequences into a list of SeqRecords
+# accepts a mapping of id -> sequence or an iterable of (id, sequence) pairs or SeqRecords
+# sequences can be strings, Seq or SeqRecord objects
+def sequence_records(sequences):
+    if hasattr(sequences, "items"):
+        sequences = sequences.items()
+
+    records = []
+
+    for item in sequences:
+        if isinstance(item, SeqRecord):
+            records.append(item)
+            continue
+
+        id, sequence = item
+        if isinstance(sequence, SeqRecord):
+            sequence = sequence.seq
+
+        records.append(SeqRecord(Seq(str(sequence)), id=str(id), description=""))
+
+    return records
+
+
+# function to check the sequences before anything is sent to BOLD, raises an InvalidSequenceError
+def validate_records(records):
+    problems = []
+    seen_ids = set()
+
+    for record in records:
+        if not record.id or len(record.id.split()) != 1:
+            problems.append(
+                "Sequence id {!r} is empty or contains whitespace.".format(record.id)
+            )
+        elif record.id[:99] in seen_ids:
+            problems.append("Sequence id {} is not unique.".format(record.id[:99]))
+        seen_ids.add(record.id[:99])
+
+    problems += id_engine_coi.invalid_sequences(
+        {record.id[:99]: record for record in records}
+    )
+
+    if not records:
+        problems.append("No sequences provided.")
+
+    if problems:
+        raise InvalidSequenceError("\n".join(problems))
+
+
+# function to identify sequences without writing anything to disk
+# the stages collect the hits and the additional data in an in-memory project instead of a project storage
+# returns the top 100 hits with additional data and the top hits as dataframes
+def identify_in_memory(
+    records, username, password, thresholds, proxy_list, reference_library
+):
+    fasta_dict = {record.id[:99]: record for record in records}
+    project = in_memory.Project()
+    query_size = id_engine_coi.min_query_size
+
+    # nothing of the run is kept, so there is nothing to trace or profile
+    metrics.reset()
+    tracing.disable()
+    profiling.disable()
+
+    # a local reference library is searched without BOLD, no login needed
+    if reference_library is None:
+        session, username, password = login.bold_login(
+            username=username, password=password, interactive=False
+        )
+
+    for database in ["species", "all_records"]:
+        # only IDs without a valid species level hit are searched in the all records database
+        if database == "all_records":
+            valid_ids = id_summary.valid_species_ids(
+                id_summary.summarize(project.top_100_hits()), thresholds
+            )
+            queue = {id: seq for (id, seq) in fasta_dict.items() if id not in valid_ids}
+        else:
+            queue = dict(fasta_dict)
+
+        if reference_library is not None:
+            local_engine.search(reference_library, queue, project, database)
+            continue
+
+        if database == "all_records":
+            session, username, password = login.ensure_login(
+                session, username=username, password=password, interactive=False
+            )
+
+        session, username, password, query_size = id_engine_coi.download_queue(
+            session,
+            queue,
+            {id: (id, project) for id in queue},
+            database,
+            query_size,
+            username=username,
+            password=password,
+            interactive=False,
+        )
+
+    top_100_hits = additional_data_download.order_top_100_hits(
+        project.top_100_hits(), fasta_dict.keys()
+    )
+    process_ids = additional_data_download.non_empty_process_ids(top_100_hits)
+
+    # the additional data of a reference library with metadata is present already
+    missing_process_ids = process_ids.loc[~process_ids.isin(project.process_ids)]
+    additional_data_download.download_data(
+        more_itertools.chunked(missing_process_ids.unique(), 100),
+        project,
+        proxy_source=proxy_pool.file_proxy_source(proxy_list) if proxy_list else None,
+    )
+
+    top_100_hits = additional_data_download.join_additional_data(
+        top_100_hits,
+        process_ids,
+        project.additional_data_table(additional_data_download.additional_data_columns),
+    )
+
+    # select the top hits like a project run, the threshold inputs come from the hits themselves
+    top_hits = digger_hit.select_top_hits(
+        digger_hit.clean_hits(top_100_hits[digger_hit.top_hit_columns].copy(), None),
+        thresholds,
+        id_summary.threshold_inputs(id_summary.summarize(top_100_hits)).to_dict(
+            "index"
+        ),
+        progress=False,
+    )
+
+    return top_100_hits, top_hits
+
+
+# function to identify sequences without a fasta file and without user interaction
+# returns the top 100 hits with additional data and the top hits as dataframes
+# without a project directory nothing is written to disk, the whole run stays in memory
+# with a project directory the run is persisted there and can be resumed like a command line run
+# nothing is printed unless quiet is False
+def identify(
+    sequences,
+    username="",
+    password="",
+    thresholds=default_thresholds,
+    project_directory=None,
+    name="boldigger2",
+    output_formats=["none"],
+    proxy_list=None,
+    reference_library=None,
+    quiet=True,
+):
+    records = sequence_records(sequences)
+    validate_records(records)
+
+    # fill missing thresholds with the defaults
+    thresholds = list(thresholds)[:5] + default_thresholds[len(thresholds) :]
+
+    with run_lock:
+        if quiet:
+            messages.disable()
+
+        try:
+            if project_directory is None:
+                return identify_in_memory(
+                    records,
+                    username,
+                    password,
+                    thresholds,
+                    proxy_list,
+                    reference_library,
+                )
+
+            Path(project_directory).mkdir(parents=True, exist_ok=True)
+            fasta_path = Path(project_directory).joinpath("{}.fasta".format(name))
+            SeqIO.write(records, fasta_path, "fasta")
+
+            top_hits = id_engine_coi.main(
+                fasta_path,
+                username=username,
+                password=password,
+                thresholds=thresholds,
+                output_formats=output_formats,
+                proxy_list=proxy_list,
+                interactive=False,
+                reference_library=reference_library,
+            )
+
+            top_100_hits = pd.read_hdf(
+                Path(project_directory).joinpath("{}_top_100_hits.h5.lz".format(name)),
+                key="top_100_hits_additional_data",
+            )
+
+            return top_100_hits, top_hits
+        finally:
+            messages.enable()
+
+
+# async variant of identify that can be awaited inside a running event loop
+# the identification runs in a worker thread, which has its own event loop for the downloads
+async def identify_async(sequences, **kwargs):
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(
+        None, functools.partial(identify, sequences, **kwargs)
+    )
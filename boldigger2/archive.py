@@ -0,0 +1,136 @@
+import hashlib, json, os, threading
+import pyarrow as pa
+from pathlib import Path
+
+# the archive is disabled until enable is called
+enabled = False
+
+# specimen data is downloaded in several threads, only one of them may write to the index at once
+lock = threading.Lock()
+
+# archive directories whose index has been repaired by this process
+repaired = set()
+
+# zstd compression level of the archived responses
+compression_level = 9
+
+# kinds of archived responses
+result_page = "result_page"
+specimen_data = "specimen_data"
+
+
+# function to return the archive directory that belongs to a project storage
+def project_archive(hdf_name_top_100_hits):
+    hdf_name_top_100_hits = Path(hdf_name_top_100_hits)
+    fasta_name = hdf_name_top_100_hits.with_suffix("").with_suffix("").name
+    fasta_name = fasta_name.removesuffix("_top_100_hits")
+
+    return hdf_name_top_100_hits.with_name("{}_raw_responses".format(fasta_name))
+
+
+# function to enable the archive, all parsed responses are stored next to their project storage from now on
+def enable():
+    global enabled
+
+    enabled = True
+
+
+# function to disable the archive
+def disable():
+    global enabled
+
+    enabled = False
+
+
+# function to return the path of an archived response by its content hash
+def object_path(directory, content_hash):
+    return Path(directory).joinpath(
+        "objects", content_hash[:2], "{}.zst".format(content_hash[2:])
+    )
+
+
+# function to cut off an incomplete last line of the index, so new entries start on a fresh line
+def repair(directory):
+    try:
+        with open(Path(directory).joinpath("index.jsonl"), "rb+") as index:
+            content = index.read()
+            if content and not content.endswith(b"\n"):
+                index.truncate(content.rfind(b"\n") + 1)
+    except FileNotFoundError:
+        pass
+
+
+# function to add a response to the archive
+# the response is stored once per content as a zstd frame named by its sha256 hash,
+# the object is synced to disk before the index line that points to it is written, so the index never points to a missing object
+def store(hdf_name_top_100_hits, kind, text, **key):
+    if not enabled:
+        return
+
+    archive_directory = project_archive(hdf_name_top_100_hits)
+    content = text.encode()
+    content_hash = hashlib.sha256(content).hexdigest()
+    savename = object_path(archive_directory, content_hash)
+
+    if not savename.is_file():
+        savename.parent.mkdir(parents=True, exist_ok=True)
+        compressed = pa.Codec("zstd", compression_level=compression_level).compress(
+            content, asbytes=True
+        )
+        temporary = "{}.{}.tmp".format(savename, threading.get_ident())
+        with open(temporary, "wb") as output:
+            output.write(compressed)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, savename)
+
+    entry = dict(kind=kind, hash=content_hash, size=len(content))
+    entry.update(key)
+    line = json.dumps(entry) + "\n"
+
+    with lock:
+        # an interrupted write may have left a torn line, it is cut off before the first append
+        if archive_directory not in repaired:
+            repair(archive_directory)
+            repaired.add(archive_directory)
+
+        with open(archive_directory.joinpath("index.jsonl"), "a") as index:
+            index.write(line)
+            index.flush()
+            os.fsync(index.fileno())
+
+
+# function to read the index of an archive, optionally only the entries of one kind
+# a torn last line of an interrupted write is ignored
+def read_index(directory, kind=None):
+    entries = []
+
+    try:
+        index = open(Path(directory).joinpath("index.jsonl"))
+    except FileNotFoundError:
+        return entries
+
+    with index:
+        for line in index:
+            if not line.endswith("\n"):
+                break
+
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+
+            if kind is None or entry["kind"] == kind:
+                entries.append(entry)
+
+    return entries
+
+
+# function to load an archived response
+def load(directory, entry):
+    with open(object_path(directory, entry["hash"]), "rb") as archived:
+        content = pa.Codec("zstd").decompress(
+            archived.read(), decompressed_size=entry["size"], asbytes=True
+        )
+
+    return content.decode()
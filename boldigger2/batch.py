@@ -0,0 +1,328 @@
+import datetime, more_itertools
+import pandas as pd
+from pathlib import Path
+from boldigger2 import id_engine_coi, additional_data_download, digger_hit, clustering
+from boldigger2 import login, export, metrics, profiling, tracing, journal, archive
+from boldigger2 import proxy_pool, id_summary, messages
+from boldigger2.exceptions import ProjectError
+
+# file extensions of the fasta files that are collected from a directory
+fasta_extensions = [".fasta", ".fas", ".fa", ".fna"]
+
+# name of the metrics, profiles and traces of a batch run, saved next to the first fasta file
+batch_name = "boldigger2_batch"
+
+
+# function to collect the fasta files of a batch run, directories are searched for fasta files (not recursively)
+def fasta_files(paths):
+    files = []
+
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(
+                file
+                for file in path.iterdir()
+                if file.is_file() and file.suffix.lower() in fasta_extensions
+            )
+        else:
+            files.append(path)
+
+    # every file is identified only once
+    return list(dict.fromkeys(file.resolve() for file in files))
+
+
+# function to read the fasta file of a project and bring its storage back to the last checkpoint
+# returns a dict with the paths of the project and its cluster membership
+def open_project(fasta_path, cluster_identity=None, cluster_validation=0):
+    fasta_dict, fasta_name, project_directory = id_engine_coi.read_fasta(fasta_path)
+
+    # generate a name for the top hits hdf file
+    hdf_name_top_100_hits = project_directory.joinpath(
+        "{}_top_100_hits.h5.lz".format(fasta_name)
+    )
+
+    # remove rows of writes that were interrupted in a previous run
+    journal.recover(hdf_name_top_100_hits)
+
+    # cluster near-identical sequences, only one representative per cluster is queried
+    if cluster_identity:
+        with metrics.stage("clustering"):
+            clusters = clustering.cluster_sequences(
+                fasta_dict, cluster_identity, validation_size=cluster_validation
+            )
+    else:
+        clusters = None
+
+    clustering.save_clusters(hdf_name_top_100_hits, clusters)
+
+    return dict(
+        fasta_path=fasta_path,
+        fasta_name=fasta_name,
+        project_directory=project_directory,
+        hdf_name=hdf_name_top_100_hits,
+        clusters=clusters,
+    )
+
+
+# function to collect the sequences of all projects that still have to be downloaded from a database
+# stored download links of a previous run are downloaded first
+# returns the queue and the routes for id_engine_coi.download_queue, the keys are (project index, id)
+def pending_sequences(projects, database, thresholds):
+    queue, routes = {}, {}
+
+    for index, project in enumerate(projects):
+        fasta_dict, _, _ = id_engine_coi.read_fasta(project["fasta_path"])
+        fasta_dict = clustering.queried_sequences(fasta_dict, project["clusters"])
+
+        # only sequences without a valid species level hit are searched in the all records database
+        if database == "all_records":
+            fasta_dict = id_engine_coi.check_valid_species_records(
+                fasta_dict, project["hdf_name"], thresholds=thresholds
+            )
+
+        fasta_dict = id_engine_coi.check_already_downloaded(
+            fasta_dict, project["hdf_name"], database
+        )
+        fasta_dict = id_engine_coi.download_stored_links(
+            fasta_dict, project["hdf_name"], database
+        )
+
+        for id, record in fasta_dict.items():
+            queue[(index, id)] = record
+            routes[(index, id)] = (id, project["hdf_name"])
+
+    return queue, routes
+
+
+# function to download the additional data of all projects at once
+# process ids that are needed by several projects are downloaded once and saved to all of them
+def download_shared_additional_data(projects, proxy_list=None):
+    storages = {}
+
+    for project in projects:
+        # projects without any process id, e.g. only NoMatch results, are not read at all
+        if not id_summary.load(project["hdf_name"])["process_ids"].sum():
+            continue
+
+        state = journal.load_state(project["hdf_name"])
+        process_ids = pd.read_hdf(
+            project["hdf_name"],
+            key="top_100_hits_unsorted",
+            columns=["Process_ID"],
+            stop=state["nrows"]["top_100_hits_unsorted"],
+        )["Process_ID"]
+        process_ids = set(process_ids.loc[process_ids != ""]) - journal.ids_in_stage(
+            state, "metadata"
+        )
+
+        if process_ids:
+            storages[project["hdf_name"]] = process_ids
+
+    process_ids = pd.Series(
+        [id for needed_ids in storages.values() for id in needed_ids], dtype=object
+    )
+    unique_process_ids = process_ids.unique()
+
+    # give user output
+    messages.write(
+        "{}: Downloading the additional data of {} process ids for {} projects, {} requests saved by sharing them.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(unique_process_ids),
+            len(storages),
+            len(process_ids.index) - len(unique_process_ids),
+        )
+    )
+
+    with metrics.stage("additional_data"):
+        additional_data_download.download_data(
+            more_itertools.chunked(unique_process_ids, 100),
+            storages,
+            proxy_source=(
+                proxy_pool.file_proxy_source(proxy_list) if proxy_list else None
+            ),
+        )
+
+
+# main function to identify many fasta files with one login and one scheduler
+# the sequences of all files share the requests to BOLD, every file still gets its own project outputs
+# returns a dict of fasta name -> top hits
+def main(
+    fasta_paths,
+    username="",
+    password="",
+    thresholds=[],
+    output_formats=export.default_output_formats,
+    metrics_textfile=None,
+    profile=False,
+    trace=False,
+    proxy_list=None,
+    interactive=True,
+    memory_budget=None,
+    reference_library=None,
+    cluster_identity=None,
+    cluster_validation=0,
+    archive_responses=False,
+):
+    fasta_paths = fasta_files(fasta_paths)
+
+    if not fasta_paths:
+        raise ProjectError("No fasta files found.")
+
+    # give user output
+    messages.write(
+        "{}: Identifying {} fasta files in one batch.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"), len(fasta_paths)
+        )
+    )
+
+    # files with the same name in one folder would share their project storage
+    project_files = {}
+    for fasta_path in fasta_paths:
+        project_files.setdefault(fasta_path.with_suffix(""), []).append(fasta_path.name)
+
+    duplicates = [names for names in project_files.values() if len(names) > 1]
+
+    if duplicates:
+        raise ProjectError(
+            "\n".join(
+                "{} would share one project, rename all but one of them.".format(
+                    ", ".join(names)
+                )
+                for names in duplicates
+            )
+        )
+
+    # a local reference library needs no scheduler, the library is only loaded once for all files
+    # every file is profiled and traced in its own project folder
+    if reference_library is not None:
+        return {
+            fasta_path.stem: id_engine_coi.main(
+                fasta_path,
+                thresholds=thresholds,
+                output_formats=output_formats,
+                metrics_textfile=metrics_textfile,
+                profile=profile,
+                trace=trace,
+                proxy_list=proxy_list,
+                interactive=interactive,
+                memory_budget=memory_budget,
+                reference_library=reference_library,
+                cluster_identity=cluster_identity,
+                cluster_validation=cluster_validation,
+                archive_responses=archive_responses,
+            )
+            for fasta_path in fasta_paths
+        }
+
+    # start collecting metrics for this run
+    metrics.reset(metrics_textfile)
+    batch_directory = fasta_paths[0].parent
+
+    # trace all requests if requested
+    if trace:
+        tracing.enable()
+    else:
+        tracing.disable()
+
+    # profile all stages if requested, profiles are saved next to the first fasta file
+    if profile:
+        profiling.enable(batch_directory.joinpath("{}_profile".format(batch_name)))
+    else:
+        profiling.disable()
+
+    # keep the raw responses next to the project storages if requested
+    if archive_responses:
+        archive.enable()
+    else:
+        archive.disable()
+
+    # read all fasta files first, so invalid sequences are reported before anything is sent to BOLD
+    projects = [
+        open_project(fasta_path, cluster_identity, cluster_validation)
+        for fasta_path in fasta_paths
+    ]
+
+    # log in to BOLD once for all files, initialize the query size
+    session, username, password = login.bold_login(
+        username=username, password=password, interactive=interactive
+    )
+    query_size = id_engine_coi.min_query_size
+
+    for database, description in [
+        ("species", "species level"),
+        ("all_records", "all records"),
+    ]:
+        # the same session serves both databases
+        session, username, password = login.ensure_login(
+            session, username=username, password=password, interactive=interactive
+        )
+
+        # give user output
+        messages.write(
+            "{}: Starting to download from the {} database.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), description
+            )
+        )
+
+        queue, routes = pending_sequences(projects, database, thresholds)
+
+        # the query size carries over, so the second database starts with full requests
+        session, username, password, query_size = id_engine_coi.download_queue(
+            session,
+            queue,
+            routes,
+            database,
+            query_size,
+            username=username,
+            password=password,
+            interactive=interactive,
+        )
+
+    # give user output
+    messages.write(
+        "{}: All records top 100 records successfully downloaded.".format(
+            datetime.datetime.now().strftime("%H:%M:%S")
+        )
+    )
+
+    # one download of the additional data serves all projects
+    download_shared_additional_data(projects, proxy_list=proxy_list)
+
+    all_top_hits = {}
+
+    for project in projects:
+        # give user output
+        messages.write(
+            "{}: Finishing {}.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), project["fasta_name"]
+            )
+        )
+
+        # order the hits and add the additional data, all process ids are in the storage already
+        additional_data_download.main(
+            project["fasta_path"],
+            project["hdf_name"],
+            id_engine_coi.read_fasta,
+            output_formats=output_formats,
+            proxy_list=proxy_list,
+            memory_budget=memory_budget,
+        )
+
+        # filter for the top hits
+        all_top_hits[project["fasta_name"]] = digger_hit.main(
+            project["hdf_name"],
+            project["project_directory"],
+            project["fasta_name"],
+            thresholds=thresholds,
+            output_formats=output_formats,
+            memory_budget=memory_budget,
+        )
+
+    # save the metrics of the run next to the first fasta file
+    metrics.write_summary(
+        batch_directory.joinpath("{}_metrics.json".format(batch_name))
+    )
+    profiling.write_summary()
+    tracing.write_trace(batch_directory.joinpath("{}_trace.json".format(batch_name)))
+
+    return all_top_hits
@@ -0,0 +1,126 @@
+import pandas as pd
+import numpy as np
+from string import punctuation, digits
+from boldigger2 import metrics, journal
+
+# names containing any of these characters are no valid taxonomic names
+specials = punctuation + digits
+
+# key of the clean name table in the project storage
+clean_names_key = "clean_taxonomy_names"
+
+# set size limits for the columns of the clean name table
+item_sizes = {"name": 100, "first_name": 100}
+
+
+# function to clean a list of unique names
+# returns a dataframe in the form of name, valid, first_name
+def clean_unique_names(names):
+    names = pd.Series(names, dtype=object)
+
+    clean_names = pd.DataFrame(
+        {
+            "name": names,
+            "valid": ~names.str.contains("[{}]".format(specials)).astype(bool),
+            "first_name": names.str.split(" ").str[0],
+        }
+    )
+
+    return clean_names
+
+
+# function to load the clean name table from the project storage
+# returns a dataframe indexed by name, empty if nothing has been cleaned yet
+def load_clean_names(hdf_name):
+    try:
+        clean_names = pd.read_hdf(hdf_name, key=clean_names_key)
+    except (FileNotFoundError, KeyError):
+        clean_names = clean_unique_names([])
+
+    # concurrent runs may have added the same name twice
+    clean_names = clean_names.drop_duplicates(subset="name")
+
+    return clean_names.set_index("name")
+
+
+# function to add newly cleaned names to the project storage
+def save_clean_names(hdf_name, clean_names):
+    # names longer than the column size are cleaned again on every call instead
+    clean_names = clean_names.loc[
+        clean_names["name"].str.len() <= item_sizes["name"]
+    ].reset_index(drop=True)
+
+    if clean_names.empty:
+        return
+
+    with metrics.hdf_append(clean_names_key, len(clean_names.index)), pd.HDFStore(
+        hdf_name, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        hdf_output.append(
+            clean_names_key,
+            clean_names,
+            format="t",
+            data_columns=True,
+            min_itemsize=item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+        )
+        nrows = hdf_output.get_storer(clean_names_key).nrows
+
+    journal.record(hdf_name, "checkpoint", key=clean_names_key, nrows=nrows)
+
+
+# function to look up the clean version of all unique names
+# names that are not in the clean name table yet are cleaned and memoized in the project storage
+def lookup_clean_names(unique_names, hdf_name=None):
+    if hdf_name is not None:
+        clean_names = load_clean_names(hdf_name)
+    else:
+        clean_names = clean_unique_names([]).set_index("name")
+
+    # only clean names that have not been seen before
+    missing_names = [name for name in unique_names if name not in clean_names.index]
+
+    if missing_names:
+        new_clean_names = clean_unique_names(missing_names)
+
+        if hdf_name is not None:
+            save_clean_names(hdf_name, new_clean_names)
+
+        clean_names = pd.concat(
+            [clean_names, new_clean_names.set_index("name")], axis=0
+        )
+
+    return clean_names.loc[list(unique_names)]
+
+
+# function to clean the taxonomy of a top 100 hits table
+# every distinct name is only cleaned once, the results are mapped back to the rows via codes
+# names containing punctuation or digits are replaced with NaN
+# if first_species_name is set, only the first name of the species column is kept
+def clean_taxonomy(top_100_hits, levels, hdf_name=None, first_species_name=False):
+    # factorize all levels first to collect all distinct names at once
+    factorized = {level: pd.factorize(top_100_hits[level]) for level in levels}
+    unique_names = pd.unique(
+        np.concatenate(
+            [uniques.to_numpy(dtype=object) for _, uniques in factorized.values()]
+        )
+    )
+
+    clean_names = lookup_clean_names(unique_names, hdf_name)
+
+    for level, (codes, uniques) in factorized.items():
+        clean_uniques = clean_names.loc[uniques]
+
+        if first_species_name and level == "Species":
+            names = clean_uniques["first_name"].to_numpy(dtype=object)
+        else:
+            names = uniques.to_numpy(dtype=object)
+
+        # invalid names become NaN, the last element catches missing values (code -1)
+        names = np.where(clean_uniques["valid"].to_numpy(dtype=bool), names, np.nan)
+        names = np.append(names, np.nan)
+
+        top_100_hits[level] = names[codes]
+
+    return top_100_hits
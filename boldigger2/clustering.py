@@ -0,0 +1,305 @@
+import datetime
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from tqdm import tqdm
+from boldigger2 import local_engine, messages
+
+# key of the cluster membership in the project storage
+clusters_key = "clusters"
+
+# length of the k-mers of the sketches
+sketch_kmer_size = 15
+
+# a k-mer is part of the sketch if its hash is below this value, about one in eight k-mers
+sketch_threshold = 2**32 // 8
+
+# maximum number of representatives a sequence is compared with base by base
+max_verified = 5
+
+# random seed for the members that are queried to validate the clusters
+validation_seed = 0
+
+# taxonomic levels that are compared in the cluster validation
+validation_levels = ["Phylum", "Class", "Order", "Family", "Genus", "Species"]
+
+# bit masks of the bases, ambiguity codes match every base they stand for
+iupac_masks = np.zeros(256, dtype=np.uint8)
+for bases, mask in {
+    "A": 1,
+    "C": 2,
+    "G": 4,
+    "T": 8,
+    "R": 5,
+    "Y": 10,
+    "S": 6,
+    "W": 9,
+    "K": 12,
+    "M": 3,
+    "B": 14,
+    "D": 13,
+    "H": 11,
+    "V": 7,
+    "N": 15,
+    "X": 15,
+}.items():
+    iupac_masks[ord(bases)] = iupac_masks[ord(bases.lower())] = mask
+
+# 2 bit codes of the masks for the k-mers, ambiguous bases are 4
+mask_codes = np.full(16, 4, dtype=np.uint8)
+mask_codes[[1, 2, 4, 8]] = [0, 1, 2, 3]
+
+
+# function to compute the sketch of a sequence
+# the sketch holds the hashes of all k-mers without ambiguous bases that are below the threshold and their positions
+def sketch(masks):
+    kmers, _, positions = local_engine.kmer_codes(
+        mask_codes[masks], np.array([0, len(masks)]), sketch_kmer_size
+    )
+    hashes = kmers * np.uint32(2654435761)
+    selected = hashes < sketch_threshold
+
+    return hashes[selected], positions[selected].astype(np.int64)
+
+
+# function to compute the identity of a sequence to a representative in percent
+# the sequence is compared on the most frequent offset of the shared sketch k-mers,
+# bases that are not covered by the representative count as mismatches
+def identity(masks, hashes, positions, representative):
+    representative_masks, representative_hashes, representative_positions = (
+        representative
+    )
+
+    shared, own, other = np.intersect1d(
+        hashes, representative_hashes, assume_unique=False, return_indices=True
+    )
+
+    if not len(shared):
+        return 0.0
+
+    offsets, counts = np.unique(
+        positions[own] - representative_positions[other], return_counts=True
+    )
+    offset = offsets[np.argmax(counts)]
+
+    representative_positions = np.arange(len(masks)) - offset
+    covered = (representative_positions >= 0) & (
+        representative_positions < len(representative_masks)
+    )
+    compatible = (
+        masks[covered] & representative_masks[representative_positions[covered]]
+    ) != 0
+
+    return 100 * compatible.sum() / len(masks)
+
+
+# function to cluster near-identical sequences, e.g. sequences that only differ by ambiguity codes or their length
+# the longest sequences with the fewest ambiguous bases become representatives first, every other sequence joins
+# the most similar representative with at least the given identity (in percent) or becomes a representative itself
+# a sample of validation_size members is queried as well to check if they get the same top hit as their representative
+# returns the cluster membership in the order of the fasta dict
+def cluster_sequences(fasta_dict, min_identity, validation_size=0):
+    # give user output
+    messages.write(
+        "{}: Clustering {} sequences with at least {} % identity.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"), len(fasta_dict), min_identity
+        )
+    )
+
+    masks = {
+        id: iupac_masks[np.frombuffer(str(record.seq).encode(), dtype=np.uint8)]
+        for id, record in fasta_dict.items()
+    }
+    order = sorted(
+        masks,
+        key=lambda id: (-len(masks[id]), np.count_nonzero(mask_codes[masks[id]] == 4)),
+    )
+
+    # sketch hash -> representatives that contain it
+    index = {}
+    representatives = {}
+    membership = {}
+
+    # representatives share about identity ^ k of their k-mers with a member, half of that is required
+    min_shared = 0.5 * (min_identity / 100) ** sketch_kmer_size
+
+    for id in tqdm(order, desc="Clustering sequences", disable=not messages.enabled):
+        hashes, positions = sketch(masks[id])
+
+        shared = {}
+        for hash in hashes.tolist():
+            for representative in index.get(hash, []):
+                shared[representative] = shared.get(representative, 0) + 1
+
+        candidates = sorted(
+            (
+                representative
+                for representative, count in shared.items()
+                if count >= min_shared * len(hashes)
+            ),
+            key=lambda representative: -shared[representative],
+        )[:max_verified]
+
+        best, best_identity = id, 100.0
+
+        for representative in candidates:
+            candidate_identity = identity(
+                masks[id], hashes, positions, representatives[representative]
+            )
+            if candidate_identity >= min_identity and (
+                best == id or candidate_identity > best_identity
+            ):
+                best, best_identity = representative, candidate_identity
+
+        membership[id] = (best, best_identity)
+
+        if best == id:
+            representatives[id] = (masks[id], hashes, positions)
+            for hash in set(hashes.tolist()):
+                index.setdefault(hash, []).append(id)
+
+    clusters = pd.DataFrame(
+        [
+            (id, representative, round(cluster_identity, 2))
+            for id, (representative, cluster_identity) in (
+                (id, membership[id]) for id in fasta_dict
+            )
+        ],
+        columns=["ID", "representative", "identity"],
+    )
+    clusters["queried"] = clusters["ID"] == clusters["representative"]
+
+    # query a random sample of the members as well
+    members = clusters.index[~clusters["queried"]]
+    if validation_size and len(members):
+        sample = np.random.default_rng(validation_seed).choice(
+            members, size=min(validation_size, len(members)), replace=False
+        )
+        clusters.loc[sample, "queried"] = True
+
+    # give user output
+    messages.write(
+        "{}: {} sequences form {} clusters, {} sequences are queried.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(clusters.index),
+            len(representatives),
+            clusters["queried"].sum(),
+        )
+    )
+
+    return clusters
+
+
+# function to save the cluster membership in the project storage, None removes a previous clustering
+def save_clusters(hdf_name_top_100_hits, clusters):
+    if clusters is None and not Path(hdf_name_top_100_hits).is_file():
+        return
+
+    with pd.HDFStore(
+        hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        if "/{}".format(clusters_key) in hdf_output.keys():
+            hdf_output.remove(clusters_key)
+
+        if clusters is not None:
+            hdf_output.put(
+                clusters_key,
+                clusters,
+                format="t",
+                data_columns=True,
+                min_itemsize={"ID": 100, "representative": 100},
+                complib="blosc:blosclz",
+                complevel=9,
+            )
+
+
+# function to load the cluster membership of a project, None if the sequences were not clustered
+def load_clusters(hdf_name_top_100_hits):
+    try:
+        return pd.read_hdf(hdf_name_top_100_hits, key=clusters_key)
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+# function to remove the sequences that are not queried from a fasta dict
+def queried_sequences(fasta_dict, clusters):
+    if clusters is None:
+        return fasta_dict
+
+    queried = set(clusters.loc[clusters["queried"], "ID"])
+
+    return {id: seq for (id, seq) in fasta_dict.items() if id in queried}
+
+
+# function to report the top hit of the representative for all members that were not queried
+# adds the representative of every ID and keeps the order of the fasta file
+def expand_top_hits(top_hits, clusters):
+    members = clusters.loc[
+        ~clusters["queried"] & clusters["representative"].isin(top_hits["ID"]),
+        ["ID", "representative"],
+    ]
+    member_top_hits = members.merge(
+        top_hits.rename(columns={"ID": "representative"}), on="representative"
+    )
+
+    top_hits = pd.concat(
+        [top_hits, member_top_hits[top_hits.columns]], axis=0
+    ).reset_index(drop=True)
+    top_hits["representative"] = top_hits["ID"].map(
+        clusters.set_index("ID")["representative"]
+    )
+
+    # sort by the position in the fasta file
+    position = pd.Series(clusters.index, index=clusters["ID"])
+    top_hits = top_hits.iloc[
+        np.argsort(top_hits["ID"].map(position).to_numpy(), kind="stable")
+    ]
+
+    return top_hits.reset_index(drop=True)
+
+
+# function to compare the top hits of the validated members with the top hits of their representatives
+# returns one row per validated member, None if no member was validated
+def validation_report(top_hits, clusters):
+    validated = clusters.loc[
+        clusters["queried"] & (clusters["ID"] != clusters["representative"])
+    ]
+
+    if validated.empty:
+        return None
+
+    top_hits = top_hits.set_index("ID")
+    validated = validated.loc[
+        validated["ID"].isin(top_hits.index)
+        & validated["representative"].isin(top_hits.index)
+    ]
+    member_hits = top_hits.loc[validated["ID"]]
+    representative_hits = top_hits.loc[validated["representative"]]
+
+    report = validated[["ID", "representative", "identity"]].reset_index(drop=True)
+    report["member_level"] = member_hits["selected_level"].to_numpy()
+    report["representative_level"] = representative_hits["selected_level"].to_numpy()
+    report["member_similarity"] = member_hits["Similarity"].to_numpy()
+    report["representative_similarity"] = representative_hits["Similarity"].to_numpy()
+
+    for level in validation_levels:
+        report["same_{}".format(level.lower())] = (
+            member_hits[level].fillna("").to_numpy()
+            == representative_hits[level].fillna("").to_numpy()
+        )
+
+    report["agree"] = report[
+        ["same_{}".format(level.lower()) for level in validation_levels]
+    ].all(axis=1)
+
+    # give user output
+    messages.write(
+        "{}: {} of {} validated members ({:.1f} %) got the same top hit as their representative.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            report["agree"].sum(),
+            len(report.index),
+            100 * report["agree"].mean(),
+        )
+    )
+
+    return report
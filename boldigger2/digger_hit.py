@@ -1,48 +1,69 @@
 import pandas as pd
 import numpy as np
-import datetime
+import datetime, hashlib
 from tqdm import tqdm
-from string import punctuation, digits
 from joblib import Parallel, delayed
 from tqdm_joblib import tqdm_joblib
 from pathlib import Path
-
-
-# funnction to read the sorted top 100 hits including additional data
-# remove punctuation and digits from the hits
+from boldigger2 import clean_taxonomy, export, metrics, journal
+from boldigger2 import additional_data_download, clustering, id_summary, messages
+from boldigger2.exceptions import ProjectError
+
+# columns of the top 100 hits that are needed to select the top hits
+top_hit_columns = [
+    "ID",
+    "Phylum",
+    "Class",
+    "Order",
+    "Family",
+    "Genus",
+    "Species",
+    "Similarity",
+    "Status",
+    "bin_uri",
+    "identification_method",
+]
+
+
+# function to remove punctuation and digits from the hits
 # only keep the first name of the species column
-def read_clean_data(hdf_name_top_100):
-    # read the data
-    top_100_hits = pd.read_hdf(hdf_name_top_100, key="top_100_hits_additional_data")
-
+def clean_hits(top_100_hits, hdf_name_top_100):
     # remove punctuationa and numbers from the taxonomy
-    specials = punctuation + digits
+    # if there are more than 2 names in the species column only keep the first
     levels = ["Phylum", "Class", "Order", "Family", "Genus", "Species"]
+    top_100_hits = clean_taxonomy.clean_taxonomy(
+        top_100_hits, levels, hdf_name=hdf_name_top_100, first_species_name=True
+    )
 
-    for level in levels:
-        top_100_hits[level] = np.where(
-            top_100_hits[level].str.contains("[{}]".format(specials)),
-            np.nan,
-            top_100_hits[level],
-        )
+    return top_100_hits
 
-    # if there are more than 2 names in the species column only keep the first
-    top_100_hits["Species"] = top_100_hits["Species"].str.split(" ").str[0]
 
-    return top_100_hits
+# funnction to read the sorted top 100 hits including additional data and clean them
+def read_clean_data(hdf_name_top_100, columns=None):
+    # read the data
+    top_100_hits = pd.read_hdf(
+        hdf_name_top_100, key="top_100_hits_additional_data", columns=columns
+    )
+
+    return clean_hits(top_100_hits, hdf_name_top_100)
 
 
 # accepts a dataframe for any individual id
+# the summary of the id from the project storage saves scanning its hits
 # return the threshold to filter for and a taxonomic level
-def get_threshold(hit_for_id, thresholds):
+def get_threshold(hit_for_id, thresholds, summary=None):
     # find the highest similarity value for the threshold
-    threshold = hit_for_id["Similarity"].max()
+    if summary is not None:
+        threshold, status_class = summary["max_similarity"], summary["status_class"]
+    else:
+        threshold = hit_for_id["Similarity"].max()
+        status_class = hit_for_id["Species"][0] if threshold == 0 else "Hits"
 
     # check for no matches and broken records first
     if threshold == 0:
-        if hit_for_id["Species"][0] == "NoMatch":
+        if status_class == "NoMatch":
             return 0, "NoMatch"
-        elif hit_for_id["Species"][0] == "BrokenRecord":
+        elif status_class == "BrokenRecord":
             return 0, "BrokenRecord"
     else:
         # move through the taxonomy if it is no nomatch hit or broken record
@@ -127,22 +148,156 @@ def return_incomplete_taxonomy(idx):
     return incomplete_taxonomy
 
 
-# function to find the top hit for a given ID
-def find_top_hit(top_100_hits, idx, thresholds):
-    # only select the respective id
-    hits_for_id = (
-        top_100_hits.loc[top_100_hits["ID"] == idx].copy().reset_index(drop=True)
+# columns of the top hit table
+top_hit_output_columns = [
+    "ID",
+    "Phylum",
+    "Class",
+    "Order",
+    "Family",
+    "Genus",
+    "Species",
+    "Similarity",
+    "Status",
+    "records",
+    "selected_level",
+    "BIN",
+    "flags",
+]
+
+
+# function to select the top hit of an ID at one threshold and taxonomic level
+# returns None if no hit with a complete taxonomy remains at this level
+# the result only depends on the hits above the threshold, the level and whether the threshold is the species threshold,
+# so it can be reused for all threshold sets that reach the same step
+def top_hit_at_level(
+    hits_for_id, hits_for_id_no_empty, threshold, level, species_level
+):
+    # only select hits above the selected threshold
+    hits_for_id_above_similarity = hits_for_id_no_empty.loc[
+        hits_for_id_no_empty["Similarity"] >= threshold
+    ]
+
+    # if no hit remains move up one level until class
+    if len(hits_for_id_above_similarity.index) == 0:
+        return None
+
+    # define the levels for the groupby. care about the selector string later
+    all_levels = ["Phylum", "Class", "Order", "Family", "Genus", "Species"]
+    levels = all_levels[: all_levels.index(level) + 1]
+
+    # only select interesting levels (all levels above and including the selected level)
+    hits_for_id_above_similarity = hits_for_id_above_similarity[levels].copy()
+
+    # group the hits by level and then count the appearence
+    hits_for_id_above_similarity = pd.DataFrame(
+        {
+            "count": hits_for_id_above_similarity.groupby(
+                by=levels,
+                sort=False,
+            ).size()
+        }
+    ).reset_index()
+
+    # if the hits still contained np.nan values, groupby will drop them:
+    # if theres nothing left after the gruoupby move up one level
+    if len(hits_for_id_above_similarity.index) == 0:
+        return None
+
+    # sort the hits by count
+    hits_for_id_above_similarity = hits_for_id_above_similarity.sort_values(
+        "count", ascending=False
     )
 
+    # select the hit with the highest count from the dataframe
+    # also return the count to display in the top hit table in the end
+    top_hits, top_count = (
+        hits_for_id_above_similarity.head(1),
+        hits_for_id_above_similarity.head(1)["count"].item(),
+    )
+
+    # select all hits that match the top hit on every level, a boolean mask is much faster than a query string
+    selector = np.ones(len(hits_for_id.index), dtype=bool)
+    for level_name in levels:
+        selector &= hits_for_id[level_name].to_numpy() == top_hits[level_name].item()
+
+    # query for the top hits
+    top_hits = hits_for_id.loc[selector]
+
+    # collect the bins from the selected top hit
+    if species_level:
+        top_hit_bins = top_hits["bin_uri"].dropna().unique()
+    else:
+        top_hit_bins = []
+
+    # select the first match from the top hits table as the top hit
+    top_hit = top_hits.head(1).copy()
+
+    # add the record count to the top hit
+    top_hit["records"] = top_count
+
+    # add the selected level
+    top_hit["selected_level"] = level
+
+    # add the BINs to the top hit
+    top_hit["BIN"] = ";".join(top_hit_bins)
+
+    # define level to remove them from low level hits
+    levels = ["Class", "Order", "Family", "Genus", "Species"]
+
+    # return species level information if similarity is high enough
+    # else remove higher level information form output depending on level
+    if not species_level:
+        top_hit = top_hit.assign(
+            **{k: np.nan for k in levels[levels.index(level) + 1 :]}
+        )
+
+    # add flags to the hits
+    top_hit["flags"] = flag_hits(top_hits, hits_for_id_above_similarity, top_hit)
+
+    # remove all data that is not needed
+    return top_hit[top_hit_output_columns]
+
+
+# function to find the top hit for a given ID
+# level_cache can be shared between calls for the same ID with different thresholds to reuse finished steps
+# summary holds the maximum similarity and status class of the ID if they are known already
+def find_top_hit(top_100_hits, idx, thresholds, level_cache=None, summary=None):
+    if level_cache is None:
+        level_cache = {}
+
+    # only select the respective id, prepare the hits only once per ID
+    if "hits_for_id" not in level_cache:
+        hits_for_id = (
+            top_100_hits.loc[top_100_hits["ID"] == idx].copy().reset_index(drop=True)
+        )
+
+        with pd.option_context("future.no_silent_downcasting", True):
+            hits_for_id_no_empty = hits_for_id.replace("", np.nan)
+
+        level_cache["hits_for_id"] = (
+            hits_for_id,
+            hits_for_id_no_empty,
+            hits_for_id_no_empty["Similarity"].to_numpy(),
+        )
+
+    hits_for_id, hits_for_id_no_empty, similarities = level_cache["hits_for_id"]
+
     # get the threshold and taxonomic level
-    threshold, level = get_threshold(hits_for_id, thresholds)
+    threshold_level = get_threshold(hits_for_id, thresholds, summary)
+
+    # no hit reaches the lowest threshold, this can happen with custom thresholds
+    if threshold_level is None:
+        return return_incomplete_taxonomy(idx)
+
+    threshold, level = threshold_level
 
     # if NoMatch return the NoMatch, if broken record return BrokenRecord
-    if threshold == 0:
-        if level == "NoMatch":
-            return_value = hits_for_id.query("Species == 'NoMatch'").head(1)
-        elif level == "BrokenRecord":
-            return_value = hits_for_id.query("Species == 'BrokenRecord'").head(1)
+    # this does not depend on the thresholds, so it is only computed once per ID
+    if threshold == 0 and level in level_cache:
+        return level_cache[level]
+    elif threshold == 0:
+        return_value = hits_for_id.loc[hits_for_id["Species"] == level].head(1)
 
         return_value = return_value[
             [
@@ -160,140 +315,248 @@ def find_top_hit(top_100_hits, idx, thresholds):
         for value in ["records", "selected_level", "BIN", "flags", "Status"]:
             return_value[value] = np.nan
 
+        level_cache[level] = return_value
+
         return return_value
 
     # loop through the thresholds until a hit is found
     while True:
-        # copy the hits for the respective ID to perform modifications
-        hits_for_id_above_similarity = hits_for_id.copy()
-
-        # collect the idx here, to push it into the incomplete taxonomy if needed
-        idx = hits_for_id_above_similarity.head(1)["ID"].item()
+        # thresholds that select the same hits lead to the same step
+        step = (
+            np.count_nonzero(similarities >= threshold),
+            level,
+            threshold == thresholds[0],
+        )
 
-        with pd.option_context("future.no_silent_downcasting", True):
-            hits_for_id_above_similarity = hits_for_id_above_similarity.replace(
-                "", np.nan
+        if step not in level_cache:
+            level_cache[step] = top_hit_at_level(
+                hits_for_id,
+                hits_for_id_no_empty,
+                threshold,
+                level,
+                threshold == thresholds[0],
             )
 
-        # only select hits above the selected threshold
-        hits_for_id_above_similarity = hits_for_id_above_similarity.loc[
-            hits_for_id_above_similarity["Similarity"] >= threshold
-        ]
+        if level_cache[step] is not None:
+            return level_cache[step]
 
         # if no hit remains move up one level until class
-        if len(hits_for_id_above_similarity.index) == 0:
-            try:
-                threshold, level = move_threshold_up(threshold, thresholds)
-                continue
-            # if there is incomplete taxonomy, boldigger2 will move through all thresholds but end up here
-            # return incomplete taxonomy if that is the case
-            except IndexError:
-                return return_incomplete_taxonomy(idx)
-
-        # define the levels for the groupby. care about the selector string later
-        all_levels = ["Phylum", "Class", "Order", "Family", "Genus", "Species"]
-        levels = all_levels[: all_levels.index(level) + 1]
-
-        # only select interesting levels (all levels above and including the selected level)
-        hits_for_id_above_similarity = hits_for_id_above_similarity[levels].copy()
-
-        # group the hits by level and then count the appearence
-        hits_for_id_above_similarity = pd.DataFrame(
-            {
-                "count": hits_for_id_above_similarity.groupby(
-                    by=levels,
-                    sort=False,
-                ).size()
-            }
-        ).reset_index()
-
-        # if the hits still contained np.nan values, groupby will drop them:
-        # if theres nothing left after the gruoupby move up one level and continue
-        if len(hits_for_id_above_similarity.index) == 0:
-            try:
-                threshold, level = move_threshold_up(threshold, thresholds)
-                continue
-            # if there is incomplete taxonomy, boldigger2 will move through all thresholds but end up here
-            # return incomplete taxonomy if that is the case
-            except IndexError:
-                return return_incomplete_taxonomy(idx)
-
-        # sort the hits by count
-        hits_for_id_above_similarity = hits_for_id_above_similarity.sort_values(
-            "count", ascending=False
-        )
+        try:
+            threshold, level = move_threshold_up(threshold, thresholds)
+        # if there is incomplete taxonomy, boldigger2 will move through all thresholds but end up here
+        # return incomplete taxonomy if that is the case
+        except IndexError:
+            return return_incomplete_taxonomy(idx)
+
+
+# key of the memoized top hits in the project storage
+top_hit_memo_key = "top_hit_memo"
+
+# set size limits for the text columns of the memoized top hits
+memo_item_sizes = {
+    column: 100
+    for column in top_hit_output_columns
+    if column not in ["Similarity", "records"]
+}
+memo_item_sizes["hash"] = 40
+# the BIN column joins the BINs of up to 100 hits
+memo_item_sizes["BIN"] = 1300
+
+
+# function to give the top hits fixed column types, so tables that are appended in several parts fit together
+# numeric columns can be integers and text columns can be all missing in a single part otherwise
+def fixed_dtypes(top_hits):
+    return top_hits.astype(
+        {
+            column: float if column in ["Similarity", "records"] else object
+            for column in top_hits.columns
+        }
+    )
 
-        # select the hit with the highest count from the dataframe
-        # also return the count to display in the top hit table in the end
-        top_hits, top_count = (
-            hits_for_id_above_similarity.head(1),
-            hits_for_id_above_similarity.head(1)["count"].item(),
-        )
 
-        # generate the selector string based on the selected level
-        query_string = [
-            "{} == '{}'".format(level, top_hits[level].item()) for level in levels
+# function to hash the hit block of every ID together with the thresholds
+# the top hit of an ID only depends on its hits and the thresholds, so equal hashes give equal top hits
+# the hits are hashed before cleaning, the cleaning of every name is the same on every run
+# returns a series of hashes indexed by ID in the order of the hits
+def hit_block_hashes(top_100_hits, thresholds):
+    row_hashes = pd.util.hash_pandas_object(
+        top_100_hits[top_hit_columns], index=False
+    ).to_numpy()
+    threshold_key = ",".join(str(threshold) for threshold in thresholds).encode()
+
+    hashes = {
+        idx: hashlib.sha1(threshold_key + row_hashes[positions].tobytes()).hexdigest()
+        for idx, positions in top_100_hits.groupby("ID", sort=False).indices.items()
+    }
+
+    return pd.Series(hashes, dtype=object)
+
+
+# function to load the memoized top hits from the project storage
+# only rows covered by a journal checkpoint are read, returns a dataframe indexed by hash
+def load_top_hit_memo(hdf_name):
+    state = journal.load_state(hdf_name)
+    nrows = 0 if state is None else state["nrows"].get(top_hit_memo_key, 0)
+
+    try:
+        top_hit_memo = pd.read_hdf(hdf_name, key=top_hit_memo_key, stop=nrows)
+    except (FileNotFoundError, KeyError):
+        top_hit_memo = pd.DataFrame(columns=["hash"] + top_hit_output_columns)
+
+    # concurrent runs may have added the same top hit twice
+    top_hit_memo = top_hit_memo.drop_duplicates(subset="hash")
+
+    return top_hit_memo.set_index("hash")
+
+
+# function to add newly computed top hits to the memo in the project storage
+# with replace the memo is rewritten with the given top hits only
+def save_top_hit_memo(hdf_name, new_top_hits, replace=False):
+    # top hits with values longer than the column size are computed again on every run instead
+    fits = np.logical_and.reduce(
+        [
+            new_top_hits[column].astype(str).str.len() <= size
+            for column, size in memo_item_sizes.items()
         ]
-        query_string = " and ".join(query_string)
+    )
+    new_top_hits = fixed_dtypes(new_top_hits.loc[fits].reset_index(drop=True))
+
+    # an interrupted rewrite leaves an empty memo
+    if replace:
+        journal.record(hdf_name, "checkpoint", key=top_hit_memo_key, nrows=0)
+
+    if new_top_hits.empty:
+        return
+
+    with metrics.hdf_append(top_hit_memo_key, len(new_top_hits.index)), pd.HDFStore(
+        hdf_name, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        if replace and "/{}".format(top_hit_memo_key) in hdf_output.keys():
+            hdf_output.remove(top_hit_memo_key)
+
+        # the memo is never queried by column, so the columns are not indexed
+        hdf_output.append(
+            top_hit_memo_key,
+            new_top_hits,
+            format="t",
+            data_columns=True,
+            min_itemsize=memo_item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+            index=False,
+        )
+        nrows = hdf_output.get_storer(top_hit_memo_key).nrows
 
-        # query for the top hits
-        top_hits = hits_for_id.query(query_string)
+    journal.record(hdf_name, "checkpoint", key=top_hit_memo_key, nrows=nrows)
 
-        # collect the bins from the selected top hit
-        if threshold == thresholds[0]:
-            top_hit_bins = top_hits["bin_uri"].dropna().unique()
-        else:
-            top_hit_bins = []
 
-        # select the first match from the top hits table as the top hit
-        top_hit = top_hits.head(1).copy()
+# function to drop the memoized top hits of outdated hit blocks or thresholds
+# the memo is only rewritten once the outdated rows outnumber the live ones
+def prune_top_hit_memo(hdf_name, live_hashes):
+    top_hit_memo = load_top_hit_memo(hdf_name)
+    live = top_hit_memo.index.isin(live_hashes)
 
-        # add the record count to the top hit
-        top_hit["records"] = top_count
+    if len(top_hit_memo.index) > 2 * live.sum() + 1000:
+        save_top_hit_memo(hdf_name, top_hit_memo.loc[live].reset_index(), replace=True)
 
-        # add the selected level
-        top_hit["selected_level"] = level
 
-        # add the BINs to the top hit
-        top_hit["BIN"] = ";".join(top_hit_bins)
+# function to load the maximum similarity and status class of every ID from the id summary
+# returns a dict of ID -> summary
+def load_threshold_inputs(hdf_name_top_100):
+    return id_summary.threshold_inputs(id_summary.load(hdf_name_top_100)).to_dict(
+        "index"
+    )
 
-        # define level to remove them from low level hits
-        levels = ["Class", "Order", "Family", "Genus", "Species"]
 
-        # return species level information if similarity is high enough
-        # else remove higher level information form output depending on level
-        if threshold == thresholds[0]:
-            break
-        else:
-            top_hit = top_hit.assign(
-                **{k: np.nan for k in levels[levels.index(level) + 1 :]}
+# function to select the top hit of every ID of the cleaned top 100 hits
+# threshold_inputs is a dict of ID -> maximum similarity and status class from the id summary
+def select_top_hits(top_100_hits, thresholds, threshold_inputs, progress=True):
+    with tqdm_joblib(
+        desc="Calculating top hits",
+        total=top_100_hits["ID"].nunique(),
+        disable=not (progress and messages.enabled),
+    ) as progress_bar:
+        top_hits = Parallel(n_jobs=1)(
+            delayed(find_top_hit)(
+                hits_for_id, idx, thresholds, summary=threshold_inputs.get(idx)
             )
-            break
+            for idx, hits_for_id in top_100_hits.groupby("ID", sort=False)
+        )
 
-    # add flags to the hits
-    top_hit["flags"] = flag_hits(top_hits, hits_for_id_above_similarity, top_hit)
+    if top_hits:
+        top_hits = pd.concat(top_hits, axis=0).reset_index(drop=True)
+        return top_hits[top_hit_output_columns]
+    else:
+        return pd.DataFrame(columns=top_hit_output_columns)
+
+
+# function to select the top hits of IDs, reusing the memoized top hits of unchanged IDs
+# takes the hits as stored, only the hits of IDs whose hits or thresholds changed since the last run
+# are cleaned and computed, the results are memoized
+# the memo and the threshold inputs of the id summary can be passed in if they are used for several calls
+# returns the top hits and the hashes of the IDs
+def memoized_top_hits(
+    hdf_name_top_100,
+    top_100_hits,
+    thresholds,
+    progress=True,
+    top_hit_memo=None,
+    threshold_inputs=None,
+):
+    hashes = hit_block_hashes(top_100_hits, thresholds)
 
-    # remove all data that is not needed
-    top_hit = top_hit[
-        [
-            "ID",
-            "Phylum",
-            "Class",
-            "Order",
-            "Family",
-            "Genus",
-            "Species",
-            "Similarity",
-            "Status",
-            "records",
-            "selected_level",
-            "BIN",
-            "flags",
-        ]
-    ]
+    if top_hit_memo is None:
+        top_hit_memo = load_top_hit_memo(hdf_name_top_100)
+
+    if threshold_inputs is None:
+        threshold_inputs = load_threshold_inputs(hdf_name_top_100)
+
+    memoized = hashes.isin(top_hit_memo.index)
+    missing_ids = hashes.index[~memoized]
+
+    if progress:
+        messages.write(
+            "{}: Reusing {} memoized top hits, calculating {} top hits.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"),
+                memoized.sum(),
+                len(missing_ids),
+            )
+        )
+
+    # only clean and split the hits of the IDs that have to be computed
+    new_top_hits = select_top_hits(
+        clean_hits(
+            top_100_hits.loc[top_100_hits["ID"].isin(missing_ids)].reset_index(
+                drop=True
+            ),
+            hdf_name_top_100,
+        ),
+        thresholds,
+        threshold_inputs,
+        progress=progress,
+    )
+
+    new_top_hits.insert(0, "hash", new_top_hits["ID"].map(hashes).to_numpy())
+
+    save_top_hit_memo(hdf_name_top_100, new_top_hits)
+
+    live_top_hits = top_hit_memo.loc[hashes.loc[memoized]].reset_index()
 
-    # return the top hit
-    return top_hit
+    # merge the memoized and new top hits in the order of the IDs
+    # empty tables are left out, they would turn the numeric columns into object columns
+    all_top_hits = pd.concat(
+        [top_hits for top_hits in [live_top_hits, new_top_hits] if not top_hits.empty]
+        or [new_top_hits],
+        axis=0,
+    ).set_index("hash")
+
+    all_top_hits = all_top_hits.loc[hashes.to_numpy()].reset_index(drop=True)
+
+    # the memo holds the record counts as floats, they are integers like in a computed selection if none is missing
+    if all_top_hits["records"].notna().all():
+        all_top_hits["records"] = all_top_hits["records"].astype("int64")
+
+    return all_top_hits, hashes
 
 
 # function to finally save the results
@@ -301,60 +564,247 @@ def save_results(
     project_directory,
     fasta_name,
     all_top_hits,
+    output_formats=export.default_output_formats,
 ):
-    # generate an excel savename
-    savename_excel = Path(project_directory).joinpath(
-        "{}_identification_result.xlsx".format(fasta_name)
-    )
-    savename_parquet = Path(project_directory).joinpath(
-        "{}_identification_result.parquet.snappy".format(fasta_name)
+    # generate a savename without suffix, the export adds the suffix per format
+    savename = Path(project_directory).joinpath(
+        "{}_identification_result".format(fasta_name)
     )
 
-    # save to excel
-    print(
-        "{}: Saving results to Excel. This may take a while.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
-        )
-    )
-    all_top_hits.to_excel(savename_excel, index=False)
+    # save to parquet, csv and excel, depending on the selected formats
+    export.export_dataframe(all_top_hits, savename, output_formats)
 
-    # save to parquet
-    print(
-        "{}: Saving results to parquet.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
-        )
+
+# function to select the top hits chunk by chunk with bounded memory
+# the hits of every ID are contiguous in the table, so the hits of the last ID of a chunk are carried over to the next one
+def chunked_top_hits(hdf_name_top_100, thresholds, rows_per_chunk):
+    nrows = journal.load_state(hdf_name_top_100)["nrows"].get(
+        "top_100_hits_additional_data", 0
     )
-    all_top_hits.to_parquet(savename_parquet)
+    top_hit_memo = load_top_hit_memo(hdf_name_top_100)
+    threshold_inputs = load_threshold_inputs(hdf_name_top_100)
+    all_top_hits, all_hashes, carry = [], [], None
+
+    for start in tqdm(
+        range(0, nrows, rows_per_chunk),
+        desc="Calculating top hits in chunks",
+        disable=not messages.enabled,
+    ):
+        chunk = pd.read_hdf(
+            hdf_name_top_100,
+            key="top_100_hits_additional_data",
+            columns=top_hit_columns,
+            start=start,
+            stop=min(start + rows_per_chunk, nrows),
+        )
+        chunk = pd.concat([carry, chunk], axis=0)
+
+        # the last chunk has no ID to carry over
+        if start + rows_per_chunk < nrows:
+            last_id = chunk["ID"].to_numpy()[-1]
+            carry = chunk.loc[chunk["ID"] == last_id]
+            chunk = chunk.loc[chunk["ID"] != last_id]
+
+        if chunk.empty:
+            continue
+
+        top_hits, hashes = memoized_top_hits(
+            hdf_name_top_100,
+            chunk.reset_index(drop=True),
+            thresholds,
+            progress=False,
+            top_hit_memo=top_hit_memo,
+            threshold_inputs=threshold_inputs,
+        )
+        all_top_hits.append(top_hits)
+        all_hashes.append(hashes)
+
+    return pd.concat(all_top_hits, axis=0).reset_index(drop=True), pd.concat(all_hashes)
 
 
 # main function to run the script
-def main(hdf_name_top_100, project_directory, fasta_name, thresholds):
+# with a memory budget in MB the hits are processed in chunks that fit into the budget
+def main(
+    hdf_name_top_100,
+    project_directory,
+    fasta_name,
+    thresholds,
+    output_formats=export.default_output_formats,
+    memory_budget=None,
+):
     # give user output
-    print(
+    messages.write(
         "{}: Loading hits to select top hits.".format(
             datetime.datetime.now().strftime("%H:%M:%S")
         )
     )
 
-    # collect the top 100 hits with additional data
-    top_100_hits = read_clean_data(hdf_name_top_100)
+    with metrics.stage("top_hits"):
+        if memory_budget:
+            all_top_hits, hashes = chunked_top_hits(
+                hdf_name_top_100,
+                thresholds,
+                additional_data_download.chunk_rows(
+                    hdf_name_top_100, "top_100_hits_additional_data", memory_budget
+                ),
+            )
+        else:
+            # collect the top 100 hits with additional data, only the columns needed for the top hits
+            # they are cleaned only for the IDs that are not memoized
+            top_100_hits = pd.read_hdf(
+                hdf_name_top_100,
+                key="top_100_hits_additional_data",
+                columns=top_hit_columns,
+            )
+
+            # collect the top hits, only IDs whose hits or thresholds changed since the last run are computed
+            all_top_hits, hashes = memoized_top_hits(
+                hdf_name_top_100, top_100_hits, thresholds
+            )
+
+        prune_top_hit_memo(hdf_name_top_100, hashes)
+
+    # report the top hit of the representative for every member of a cluster
+    clusters = clustering.load_clusters(hdf_name_top_100)
+
+    if clusters is not None:
+        validation_report = clustering.validation_report(all_top_hits, clusters)
+        all_top_hits = clustering.expand_top_hits(all_top_hits, clusters)
+    else:
+        validation_report = None
+
+    # save to the selected output formats
+    with metrics.stage("export"):
+        save_results(project_directory, fasta_name, all_top_hits, output_formats)
+
+        if validation_report is not None:
+            export.export_dataframe(
+                validation_report,
+                Path(project_directory).joinpath(
+                    "{}_cluster_validation".format(fasta_name)
+                ),
+                output_formats,
+            )
+
+    messages.write("{}: Finished.".format(datetime.datetime.now().strftime("%H:%M:%S")))
+
+    return all_top_hits
+
+
+# function to compute the top hits for many threshold sets in a single pass over the hits
+# the hits are split by ID once and every selection step is shared by all threshold sets that reach it
+# returns a long table with one block of top hits per threshold set
+def sweep(hdf_name_top_100, threshold_sets, output_formats=["parquet"]):
+    hdf_name_top_100 = Path(hdf_name_top_100)
+
+    if not additional_data_download.additional_data_complete(hdf_name_top_100):
+        raise ProjectError(
+            "{} does not contain the top 100 hits with additional data. Please finish the identification first.".format(
+                hdf_name_top_100
+            )
+        )
+
+    # give user output
+    messages.write(
+        "{}: Loading hits to select top hits for {} threshold sets.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"), len(threshold_sets)
+        )
+    )
+
+    with metrics.stage("top_hits"):
+        top_100_hits = read_clean_data(hdf_name_top_100, columns=top_hit_columns)
 
-    # collect the top hits
-    with tqdm_joblib(
-        desc="Calculating top hits", total=len(top_100_hits["ID"].unique())
-    ) as progress_bar:
-        all_top_hits = Parallel(n_jobs=1)(
-            delayed(find_top_hit)(top_100_hits, idx, thresholds)
-            for idx in top_100_hits["ID"].unique()
+        # collect the top hits as plain rows, one list per threshold set
+        rows = [[] for _ in threshold_sets]
+
+        for idx, hits_for_id in tqdm(
+            top_100_hits.groupby("ID", sort=False),
+            desc="Calculating top hits",
+            total=top_100_hits["ID"].nunique(),
+            disable=not messages.enabled,
+        ):
+            level_cache, row_cache = {}, {}
+
+            for set_idx, thresholds in enumerate(threshold_sets):
+                top_hit = find_top_hit(hits_for_id, idx, thresholds, level_cache)
+
+                # the same top hit is returned for many threshold sets, only convert it once
+                if id(top_hit) not in row_cache:
+                    row_cache[id(top_hit)] = (
+                        top_hit,
+                        tuple(top_hit[top_hit_output_columns].iloc[0]),
+                    )
+
+                rows[set_idx].append(row_cache[id(top_hit)][1])
+
+        # build one long table keyed by the threshold set
+        sweep_result = pd.concat(
+            [
+                pd.DataFrame(set_rows, columns=top_hit_output_columns).assign(
+                    threshold_set="_".join(str(threshold) for threshold in thresholds)
+                )
+                for thresholds, set_rows in zip(threshold_sets, rows)
+            ],
+            axis=0,
+        ).reset_index(drop=True)
+
+        sweep_result = sweep_result[["threshold_set"] + top_hit_output_columns]
+
+        # report the top hit of the representative for every member of a cluster
+        clusters = clustering.load_clusters(hdf_name_top_100)
+
+        if clusters is not None:
+            sweep_result = pd.concat(
+                [
+                    clustering.expand_top_hits(set_result, clusters)
+                    for _, set_result in sweep_result.groupby(
+                        "threshold_set", sort=False
+                    )
+                ],
+                axis=0,
+            ).reset_index(drop=True)
+
+    # save to the selected output formats
+    fasta_name = hdf_name_top_100.with_suffix("").with_suffix("").name
+    fasta_name = fasta_name.removesuffix("_top_100_hits")
+
+    with metrics.stage("export"):
+        export.export_dataframe(
+            sweep_result,
+            hdf_name_top_100.parent.joinpath("{}_threshold_sweep".format(fasta_name)),
+            output_formats,
         )
 
-    # concat all the top hits as a final result
-    all_top_hits = pd.concat(all_top_hits, axis=0).reset_index(drop=True)
+    messages.write("{}: Finished.".format(datetime.datetime.now().strftime("%H:%M:%S")))
+
+    return sweep_result
 
-    # save to excel and parquet
-    save_results(project_directory, fasta_name, all_top_hits)
 
-    print("{}: Finished.".format(datetime.datetime.now().strftime("%H:%M:%S")))
+# function to rerun the top hit selection of a finished project with new thresholds
+# only reads the project storage, no login and no network access needed
+def reclassify(
+    hdf_name_top_100, thresholds, output_formats=export.default_output_formats
+):
+    hdf_name_top_100 = Path(hdf_name_top_100)
+
+    if not additional_data_download.additional_data_complete(hdf_name_top_100):
+        raise ProjectError(
+            "{} does not contain the top 100 hits with additional data. Please finish the identification first.".format(
+                hdf_name_top_100
+            )
+        )
+
+    # the results are saved under the name of the original fasta file
+    fasta_name = hdf_name_top_100.with_suffix("").with_suffix("").name
+    fasta_name = fasta_name.removesuffix("_top_100_hits")
+
+    return main(
+        hdf_name_top_100,
+        hdf_name_top_100.parent,
+        fasta_name,
+        thresholds,
+        output_formats=output_formats,
+    )
 
 
 if __name__ == "__main__":
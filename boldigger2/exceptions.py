@@ -12,3 +12,23 @@ class APIOverload(Exception):
 class ProxyNotWorking(Exception):
     def __init__(self, *args: object) -> None:
         super().__init__(*args)
+
+
+class LoginError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class InvalidSequenceError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class ReferenceLibraryError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class ProjectError(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
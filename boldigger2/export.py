@@ -0,0 +1,185 @@
+import datetime, os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from joblib import Parallel, delayed
+from boldigger2 import profiling, messages
+
+# output formats that can be selected by the user, none skips all exports
+# the top 100 hits are only saved to parquet if top_100_parquet is selected
+available_output_formats = ["xlsx", "parquet", "csv", "top_100_parquet", "none"]
+default_output_formats = ["xlsx", "parquet"]
+
+# maximum number of lines per excel file, excel can not handle more than 1.048.576 lines
+excel_part_size = 1000000
+
+# number of lines that are read from the hdf storage at once
+chunk_size = 50000
+
+
+# function to return the output formats that have to be written
+def selected_formats(output_formats):
+    if not output_formats or "none" in output_formats:
+        return []
+    else:
+        return [fmt for fmt in available_output_formats if fmt in output_formats]
+
+
+# function to add a chunk of a dataframe to a write only worksheet
+def append_to_worksheet(worksheet, chunk):
+    # replace missing values with None, so excel shows empty cells
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+
+    for row in chunk.itertuples(index=False, name=None):
+        worksheet.append(row)
+
+
+# function to write a dataframe to excel with constant memory
+def write_excel(dataframe, savename):
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(list(dataframe.columns))
+
+    for start in range(0, len(dataframe.index), chunk_size):
+        append_to_worksheet(worksheet, dataframe.iloc[start : start + chunk_size])
+
+    workbook.save(savename)
+
+
+# function to write one part of a hdf table to excel
+# every part reads its lines directly from the hdf storage, so it can run in a separate process
+def write_excel_part(hdf_name, key, start, stop, savename):
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        worksheet.append(list(hdf_input.select(key, start=0, stop=0).columns))
+
+        for chunk in hdf_input.select(
+            key, start=start, stop=stop, chunksize=chunk_size
+        ):
+            append_to_worksheet(worksheet, chunk)
+
+    workbook.save(savename)
+
+
+# function to write a hdf table to parquet chunk by chunk
+def write_parquet_from_hdf(hdf_name, key, savename):
+    writer = None
+
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        for chunk in hdf_input.select(key, chunksize=chunk_size):
+            chunk = chunk.reset_index(drop=True)
+            if writer is None:
+                # columns that only contain missing values in the first chunk are written as strings
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                for idx, field in enumerate(schema):
+                    if pa.types.is_null(field.type):
+                        schema = schema.set(idx, field.with_type(pa.string()))
+                writer = pq.ParquetWriter(savename, schema)
+
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            )
+
+    if writer is not None:
+        writer.close()
+
+
+# function to write a hdf table to csv chunk by chunk
+def write_csv_from_hdf(hdf_name, key, savename):
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        for idx, chunk in enumerate(hdf_input.select(key, chunksize=chunk_size)):
+            chunk.to_csv(
+                savename, mode="w" if idx == 0 else "a", header=idx == 0, index=False
+            )
+
+
+# function to return the output formats of the top 100 hits
+def top_100_formats(output_formats):
+    output_formats = selected_formats(output_formats)
+
+    return [
+        "parquet" if fmt == "top_100_parquet" else fmt
+        for fmt in output_formats
+        if fmt != "parquet"
+    ]
+
+
+# function to export a table from the hdf storage to all selected output formats
+# excel files are split in parts of 1.000.000 lines which are written in parallel processes
+def export_hdf_table(hdf_name, key, savename_stem, output_formats):
+    output_formats = selected_formats(output_formats)
+
+    if "parquet" in output_formats:
+        messages.write(
+            "{}: Saving {} to parquet.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), key
+            )
+        )
+        write_parquet_from_hdf(hdf_name, key, "{}.parquet.snappy".format(savename_stem))
+
+    if "csv" in output_formats:
+        messages.write(
+            "{}: Saving {} to csv.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), key
+            )
+        )
+        write_csv_from_hdf(hdf_name, key, "{}.csv".format(savename_stem))
+
+    if "xlsx" in output_formats:
+        messages.write(
+            "{}: Saving {} to excel, this may take a while.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), key
+            )
+        )
+
+        with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+            nrows = hdf_input.get_storer(key).nrows
+
+        parts = [
+            (start, min(start + excel_part_size, nrows))
+            for start in range(0, max(nrows, 1), excel_part_size)
+        ]
+
+        Parallel(n_jobs=min(len(parts), os.cpu_count() or 1))(
+            delayed(profiling.profiled(write_excel_part, "export_worker"))(
+                hdf_name,
+                key,
+                start,
+                stop,
+                "{}_part_{}.xlsx".format(savename_stem, idx),
+            )
+            for idx, (start, stop) in enumerate(parts)
+        )
+
+
+# function to export a dataframe to all selected output formats
+def export_dataframe(dataframe, savename_stem, output_formats):
+    output_formats = selected_formats(output_formats)
+
+    # parquet is written first, so the fast format is available as early as possible
+    if "parquet" in output_formats:
+        messages.write(
+            "{}: Saving results to parquet.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+        dataframe.to_parquet("{}.parquet.snappy".format(savename_stem))
+
+    if "csv" in output_formats:
+        messages.write(
+            "{}: Saving results to csv.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+        dataframe.to_csv("{}.csv".format(savename_stem), index=False)
+
+    if "xlsx" in output_formats:
+        messages.write(
+            "{}: Saving results to Excel. This may take a while.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+        write_excel(dataframe, "{}.xlsx".format(savename_stem))
@@ -1,19 +1,36 @@
-import datetime, sys, more_itertools, datetime, requests_html, asyncio, time
+import datetime, more_itertools, datetime, requests_html, asyncio, time, os
 import pandas as pd
 import numpy as np
 from boldigger2 import login, additional_data_download, digger_hit
+from boldigger2 import export, urls, metrics, profiling, tracing, journal
+from boldigger2 import streaming, proxy_pool, local_engine, clustering, archive
+from boldigger2 import sharding, id_summary, messages, in_memory
 from Bio import SeqIO
 from pathlib import Path
 from bs4 import BeautifulSoup as BSoup
 from tqdm import tqdm
 from tqdm.asyncio import tqdm_asyncio
+from joblib import Parallel, delayed
 from requests.exceptions import ReadTimeout
 from requests.exceptions import ConnectionError
 from io import StringIO
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from string import punctuation, digits
-from boldigger2.exceptions import BadResponseError
+from boldigger2.exceptions import BadResponseError, InvalidSequenceError, ProjectError
+
+# limits for the number of sequences per request, the query size is also the number of concurrent downloads
+min_query_size = 5
+max_query_size = 50
+
+# seconds to wait before retrying if BOLD did not return enough download links
+bad_response_wait = 180
+
+# stored download links older than this many seconds are not reused after a restart
+download_link_max_age = 24 * 60 * 60
+
+# archived responses parsed per worker task and per append to the project storage when reparsing
+pages_per_task = 50
+pages_per_write = 1000
 
 
 # function to read the fasta file into a dictionary
@@ -30,6 +47,18 @@ def read_fasta(fasta_path):
     # trim headers to maximum allowed length of 99 characters, names are preserverd in the SeqRecord object
     fasta_dict = {key[:99]: value for key, value in fasta_dict.items()}
 
+    # check for invalid sequences (invalid characters or sequences that are too short)
+    problems = invalid_sequences(fasta_dict)
+
+    if not problems:
+        return fasta_dict, fasta_name, project_directory
+    else:
+        raise InvalidSequenceError("\n".join(problems))
+
+
+# function to check a fasta dict for sequences that are too short or contain invalid characters
+# returns a list with one message per invalid sequence
+def invalid_sequences(fasta_dict):
     valid_chars = {
         "A",
         "C",
@@ -49,52 +78,29 @@ def read_fasta(fasta_path):
         "N",
     }
 
-    # check for invalid sequences (invalid characters or sequences that are too short)
-    raise_false_fasta = False
+    problems = []
 
     for key in fasta_dict.keys():
         if len(fasta_dict[key].seq) < 80:
-            print(
-                "{}: Sequence {} is too short (< 80 bp).".format(
-                    datetime.datetime.now().strftime("%H:%M:%S"), key
-                )
-            )
-            raise_false_fasta = True
+            problems.append("Sequence {} is too short (< 80 bp).".format(key))
         # check if the sequences contain invalid chars
         elif not set(fasta_dict[key].seq.upper()).issubset(valid_chars):
-            print(
-                "{}: Sequence {} contains invalid characters.".format(
-                    datetime.datetime.now().strftime("%H:%M:%S"), key
-                )
-            )
-            raise_false_fasta = True
+            problems.append("Sequence {} contains invalid characters.".format(key))
 
-    if not raise_false_fasta:
-        return fasta_dict, fasta_name, project_directory
-    else:
-        sys.exit()
+    return problems
 
 
+# the downloaded ids are read from the journal, which is much faster than scanning the hdf storage
 def check_already_downloaded(fasta_dict, hdf_name_top_100_hits, database):
-    try:
-        # load the hdf file
-        hdf_top_100_hits = pd.read_hdf(
-            hdf_name_top_100_hits, key="top_100_hits_unsorted"
-        )
-
-        # filter for the correct database
-        hdf_top_100_hits = hdf_top_100_hits.loc[
-            hdf_top_100_hits["database"] == database
-        ]
+    state = journal.load_state(hdf_name_top_100_hits)
 
+    # do nothing if nothing has been downloaded yet
+    if state is not None:
         # collect all unique IDs and remove them from the fasta dict
-        unique_ids = hdf_top_100_hits["ID"].unique()
+        unique_ids = journal.ids_in_stage(state, "parsed", database)
         fasta_dict = {
             id: seq for (id, seq) in fasta_dict.items() if id not in unique_ids
         }
-    except FileNotFoundError:
-        # do nothing if nothing has been downloaded yet
-        pass
 
     # return the (updated) fasta dict
     return fasta_dict
@@ -109,7 +115,7 @@ def gather_download_links(session, fasta_dict, query_size, database):
     bold_query_string = ""
 
     for key in bold_query.keys():
-        bold_query_string += ">{}\n".format(key)
+        bold_query_string += ">{}\n".format(bold_query[key].id[:99])
         bold_query_string += "{}\n".format(bold_query[key].seq)
 
     # generate the data for the post request
@@ -129,17 +135,23 @@ def gather_download_links(session, fasta_dict, query_size, database):
         }
 
     # post the request, reduce timeout to 5 minutes, decrease query size instead of just retrying
-    response = session.post(
-        "https://v4.boldsystems.org/index.php/IDS_IdentificationRequest",
-        data=post_request_data,
-        timeout=300,
-    )
+    with tracing.span(
+        "POST IDS_IdentificationRequest",
+        "http",
+        database=database,
+        sequences=len(bold_query),
+    ):
+        response = session.post(
+            "{}/index.php/IDS_IdentificationRequest".format(urls.v4_url),
+            data=post_request_data,
+            timeout=300,
+        )
 
     # extract the download links from the response
     soup = BSoup(response.text, "html5lib")
     download_links = soup.find_all("span", style="text-decoration: none")
     download_links = [
-        "http://v4.boldsystems.org" + download_links[i].get("result")
+        urls.v4_result_url + download_links[i].get("result")
         for i in range(len(download_links))
     ]
 
@@ -156,43 +168,141 @@ def gather_download_links(session, fasta_dict, query_size, database):
     return download_dataframe
 
 
+# function to save generated download links with their creation time to the hdf storage
+# links are saved before downloading, so they can be reused if the run is interrupted
+# an in-memory project cannot be resumed, its links are not kept
+def save_download_links(download_dataframe, hdf_name_top_100_hits, database):
+    if isinstance(hdf_name_top_100_hits, in_memory.Project):
+        return
+
+    download_links = download_dataframe.copy()
+    download_links["database"] = database
+    download_links["created"] = pd.Timestamp.now().strftime("%Y-%m-%d %X")
+
+    item_sizes = {"id": 100, "url": 500, "database": 20, "created": 30}
+
+    with metrics.hdf_append("download_links", len(download_links.index)), pd.HDFStore(
+        hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        hdf_output.append(
+            "download_links",
+            download_links,
+            format="t",
+            data_columns=True,
+            min_itemsize=item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+        )
+        nrows = hdf_output.get_storer("download_links").nrows
+
+    # checkpoint the links in the journal after they are written
+    journal.record(
+        hdf_name_top_100_hits,
+        "submitted",
+        key="download_links",
+        nrows=nrows,
+        ids=download_links["id"],
+        database=database,
+    )
+
+
+# function to load the stored download links of the ids that still have to be downloaded
+# only the newest link per id is returned and only if it is not expired yet
+def load_download_links(fasta_dict, hdf_name_top_100_hits, database):
+    try:
+        download_links = pd.read_hdf(
+            hdf_name_top_100_hits,
+            key="download_links",
+            where="database == {!r}".format(database),
+        )
+    except (FileNotFoundError, KeyError):
+        return pd.DataFrame(columns=["id", "url"])
+
+    download_links = download_links.loc[download_links["id"].isin(fasta_dict.keys())]
+    download_links = download_links.drop_duplicates(subset="id", keep="last")
+
+    link_age = pd.Timestamp.now() - pd.to_datetime(download_links["created"])
+    download_links = download_links.loc[
+        link_age < pd.Timedelta(seconds=download_link_max_age)
+    ]
+
+    return download_links[["id", "url"]].reset_index(drop=True)
+
+
+# function to download the stored links of a previous run before submitting any new requests
+# returns the fasta dict with all ids that still have to be submitted
+def download_stored_links(fasta_dict, hdf_name_top_100_hits, database):
+    download_links = load_download_links(fasta_dict, hdf_name_top_100_hits, database)
+
+    if download_links.empty:
+        return fasta_dict
+
+    # give user output
+    messages.write(
+        "{}: Reusing {} download links from a previous run.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"), len(download_links.index)
+        )
+    )
+
+    try:
+        with metrics.stage("downloads"):
+            downloaded = asyncio.run(
+                as_session(
+                    download_links,
+                    database=database,
+                    hdf_name_top_100_hits=hdf_name_top_100_hits,
+                    semaphore=asyncio.Semaphore(max_query_size),
+                    stored_links=True,
+                )
+            )
+    except (IndexError, ValueError):
+        # the ids of failed downloads are submitted again, duplicates are removed when ordering the hits
+        return fasta_dict
+
+    downloaded = set(download_links["id"].loc[downloaded])
+
+    # give user output
+    if len(downloaded) < len(download_links.index):
+        messages.write(
+            "{}: {} download links expired, the sequences will be submitted again.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"),
+                len(download_links.index) - len(downloaded),
+            )
+        )
+
+    return {id: seq for (id, seq) in fasta_dict.items() if id not in downloaded}
+
+
 # function to update the query size
 # accepts that query size and an increase argument. negative increase values will lead to a decrease
 def update_query_size(query_size, increase):
     # update the query size via increase
     query_size = query_size + increase
 
-    # return the updated value. can only be in the range of 1 to 50
-    if query_size < 5:
-        query_size = 5
+    # return the updated value. can only be in the range of 5 to 50
+    if query_size < min_query_size:
+        query_size = min_query_size
         return query_size
-    elif query_size > 50:
-        query_size = 50
+    elif query_size > max_query_size:
+        query_size = max_query_size
         return query_size
     else:
         return query_size
 
 
-# asynchronous request code to send n requests at once
+# function to parse the html of a result page into the top 100 hits of one sequence
 # database is a string specifying where the data comes from
-async def as_request(species_id, url, as_session, database, hdf_name_top_100_hits):
-    # add all requests to the eventloop
-    # request top 100 hits
-    # retry in case of connection error
-    while True:
-        try:
-            response = await as_session.get("{}&display=100".format(url), timeout=60)
-            break
-        except ConnectionError:
-            continue
-
+# returns None for an expired stored link, since nothing should be saved in that case
+def parse_result_page(text, species_id, database, stored_link=False):
     # parse the response and pass it to pandas
-    response = BSoup(response.text, "html5lib")
+    response = BSoup(text, "html5lib")
 
     # check for broken records already here in the raw html, since a valid and a broken record both return 4 tables
     broken_record = response.find_all("div", id="kohana_error")
 
-    if len(broken_record) == 1:
+    if len(broken_record) == 1 and stored_link:
+        return None
+    elif len(broken_record) == 1:
         result = pd.DataFrame(
             [[species_id] + ["BrokenRecord"] * 7 + [0.0] + [""] * 2],
             columns=[
@@ -281,9 +391,23 @@ async def as_request(species_id, url, as_session, database, hdf_name_top_100_hit
     # fill na values with empty strings to make frames compatible with hdf format
     result = result.fillna("")
 
-    # add the database and a timestamp to the result table
+    # add the database to the result table
     result["database"] = database
-    result["request_date"] = pd.Timestamp.now().strftime("%Y-%m-%d %X")
+
+    return result
+
+
+# function to save the parsed hits of a result page to the hdf storage, the journal and the archive
+def save_result_page(result, text, species_id, database, hdf_name_top_100_hits):
+    # keep the raw response, so the result page can be parsed again without downloading it
+    archive.store(
+        hdf_name_top_100_hits,
+        archive.result_page,
+        text,
+        id=species_id,
+        database=database,
+        request_date=result["request_date"].iloc[0],
+    )
 
     # add the results to the hdf storage
     # set size limits for the columns
@@ -303,7 +427,7 @@ async def as_request(species_id, url, as_session, database, hdf_name_top_100_hit
     }
 
     # append results to hdf
-    with pd.HDFStore(
+    with metrics.hdf_append("top_100_hits_unsorted", len(result.index)), pd.HDFStore(
         hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
     ) as hdf_output:
         hdf_output.append(
@@ -315,136 +439,131 @@ async def as_request(species_id, url, as_session, database, hdf_name_top_100_hit
             complib="blosc:blosclz",
             complevel=9,
         )
+        nrows = hdf_output.get_storer("top_100_hits_unsorted").nrows
+
+    # the id only counts as downloaded once the journal holds the checkpoint
+    journal.record(
+        hdf_name_top_100_hits,
+        "parsed",
+        key="top_100_hits_unsorted",
+        nrows=nrows,
+        ids=[species_id],
+        database=database,
+    )
 
-    if database == "species":
-        # give user output
-        tqdm.write(
-            "{}: Downloaded top 100 species level records for {}".format(
-                datetime.datetime.now().strftime("%H:%M:%S"), species_id
-            )
-        )
-
-    else:
-        tqdm.write(
-            "{}: Downloaded top 100 hits of all records for {}".format(
-                datetime.datetime.now().strftime("%H:%M:%S"), species_id
-            )
-        )
-
-
-# function to limit the maximum concurrent downloads
-async def limit_concurrency(
-    species_id, url, as_session, database, hdf_name_top_100_hits, semaphore
-):
-    async with semaphore:
-        return await as_request(
-            species_id, url, as_session, database, hdf_name_top_100_hits
-        )
+    # summarize the hits of the id, so later stages do not have to scan them again
+    id_summary.save(hdf_name_top_100_hits, id_summary.summarize(result))
 
 
-# function to create the asynchronous session
-async def as_session(
-    download_links_species, database, hdf_name_top_100_hits, semaphore
+# asynchronous request code to send n requests at once
+# database is a string specifying where the data comes from
+# links stored in a previous run can be expired, in that case nothing is saved and False is returned
+async def as_request(
+    species_id, url, as_session, database, hdf_name_top_100_hits, stored_link=False
 ):
-    as_session = requests_html.AsyncHTMLSession()
-    as_session.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82 Safari/537.36"
-        }
-    )
-    retry_strategy = Retry(
-        total=15,
-        status_forcelist=[400, 401, 403, 404, 413, 429, 502, 503, 504],
-        backoff_factor=1,
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    as_session.mount("https://", adapter)
-    as_session.mount("http://", adapter)
+    # add all requests to the eventloop
+    # request top 100 hits
+    # retry in case of connection error
+    while True:
+        try:
+            with tracing.span("GET result page", "http", id=species_id):
+                response = await as_session.get(
+                    "{}&display=100".format(url), timeout=60
+                )
+            break
+        except ConnectionError:
+            metrics.record_retry(url)
+            tracing.instant("retry", "http", id=species_id)
+            continue
 
-    # create all requests
-    tasks = download_links_species.copy()
-    tasks = (
-        limit_concurrency(
-            id, url, as_session, database, hdf_name_top_100_hits, semaphore
+    if not isinstance(hdf_name_top_100_hits, in_memory.Project):
+        journal.record(
+            hdf_name_top_100_hits, "downloaded", ids=[species_id], database=database
         )
-        for id, url in zip(tasks["id"], tasks["url"])
-    )
-
-    # return the result
-    return await asyncio.gather(*tasks)
 
+    # parse the response and pass it to pandas
+    parse_start = tracing.timestamp()
+    result = parse_result_page(response.text, species_id, database, stored_link)
 
-def check_valid_species_records(fasta_dict, hdf_name_top_100_hits, thresholds):
-    # read the hdf
-    top_100_hits_species = pd.read_hdf(
-        hdf_name_top_100_hits, key="top_100_hits_unsorted"
-    )
-    # filter for species level database only
-    top_100_hits_species = top_100_hits_species.loc[
-        top_100_hits_species["database"] == "species"
-    ]
-    # fill empty string with NA values for easy filtering
-    with pd.option_context("future.no_silent_downcasting", True):
-        top_100_hits_species = top_100_hits_species.replace("", np.nan)
-
-    # remove digits and punctuation in species column
-    specials = punctuation + digits
-    top_100_hits_species["Species"] = np.where(
-        top_100_hits_species["Species"].str.contains("[{}]".format(specials)),
-        np.nan,
-        top_100_hits_species["Species"],
-    )
-    # drop na values from species column
-    top_100_hits_species = top_100_hits_species.dropna(subset="Species")
-    # only keep values with similarity >= 97%
-    top_100_hits_species = top_100_hits_species.loc[
-        top_100_hits_species["Similarity"] >= thresholds[0]
-    ]
-
-    # pop those values from the fasta dict
-    fasta_dict = {
-        key: value
-        for key, value in fasta_dict.items()
-        if key not in top_100_hits_species["ID"].unique()
-    }
-
-    return fasta_dict
-
+    if result is None:
+        tracing.record_span("parse result page", "parse", parse_start, id=species_id)
+        return False
 
-def main(fasta_path, username="", password="", thresholds=[]):
-    # log in to BOLD to generate the session, initialize the query size
-    session, username, password = login.bold_login(username=username, password=password)
-    query_size = 5
+    # add a timestamp to the result table
+    result["request_date"] = pd.Timestamp.now().strftime("%Y-%m-%d %X")
 
-    # read the input fasta
-    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+    tracing.record_span("parse result page", "parse", parse_start, id=species_id)
 
-    # generate a name for the top hits hdf file
-    hdf_name_top_100_hits = project_directory.joinpath(
-        "{}_top_100_hits.h5.lz".format(fasta_name)
-    )
+    # an in-memory project only keeps the hits, there is no storage, journal or archive
+    if isinstance(hdf_name_top_100_hits, in_memory.Project):
+        hdf_name_top_100_hits.add_hits(result)
+    else:
+        save_result_page(
+            result, response.text, species_id, database, hdf_name_top_100_hits
+        )
 
-    # check if any of the ids have been downloaded and saved already. If so remove them from the fasta dict
-    fasta_dict = check_already_downloaded(fasta_dict, hdf_name_top_100_hits, "species")
+    if database == "species":
+        # give user output
+        messages.write(
+            "{}: Downloaded top 100 species level records for {}".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), species_id
+            )
+        )
 
-    # start the download for the species level database
-    # give user output
-    print(
-        "{}: Starting to download from the species level database.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
+    else:
+        messages.write(
+            "{}: Downloaded top 100 hits of all records for {}".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), species_id
+            )
         )
-    )
 
+    return True
+
+
+# function to submit sequences to BOLD and download their top 100 hits until the queue is empty
+# queue maps a unique key to the sequence record, routes maps the key to the sequence id and its project storage
+# sequences of several projects can share a queue, so every request is filled up to the query size
+# returns the session and the credentials, which may have been renewed, and the query size for the next queue
+def download_queue(
+    session,
+    queue,
+    routes,
+    database,
+    query_size,
+    username="",
+    password="",
+    interactive=True,
+    online_results=None,
+):
     # request the server until all links have been generated
-    if fasta_dict:
-        with tqdm(total=len(fasta_dict), desc="Generating download links") as pbar:
+    if queue:
+        with tqdm(
+            total=len(queue),
+            desc="Generating download links",
+            disable=not messages.enabled,
+        ) as pbar:
             # generate download links first
-            while fasta_dict:
+            while queue:
                 try:
                     # gather the returned download links to download them straight away
-                    download_dataframe = gather_download_links(
-                        session, fasta_dict, query_size, database="species"
-                    )
+                    with metrics.stage("link_generation"):
+                        download_dataframe = gather_download_links(
+                            session, queue, query_size, database=database
+                        )
+
+                        # route every link to the project it belongs to
+                        keys = list(download_dataframe["id"])
+                        download_dataframe["id"] = [routes[key][0] for key in keys]
+                        download_dataframe["hdf_name"] = [
+                            routes[key][1] for key in keys
+                        ]
+
+                        for hdf_name, download_links in download_dataframe.groupby(
+                            "hdf_name", sort=False
+                        ):
+                            save_download_links(
+                                download_links[["id", "url"]], hdf_name, database
+                            )
 
                     # set the semaphore to the query size of the original query
                     sem = asyncio.Semaphore(query_size)
@@ -453,20 +572,20 @@ def main(fasta_path, username="", password="", thresholds=[]):
                     query_size = update_query_size(query_size, 5)
 
                     # give user output
-                    if query_size != 50:
-                        tqdm.write(
+                    if query_size != max_query_size:
+                        messages.write(
                             "{}: Query size updated to {}.".format(
                                 datetime.datetime.now().strftime("%H:%M:%S"), query_size
                             )
                         )
                     else:
-                        tqdm.write(
+                        messages.write(
                             "{}: Query size kept at {}.".format(
                                 datetime.datetime.now().strftime("%H:%M:%S"), query_size
                             )
                         )
 
-                    # download the data from the generated links, update the fasta dict after successfull download
+                    # download the data from the generated links, update the queue after successfull download
                     # update the description of the progress bar
                     pbar.set_description("Downloading data")
 
@@ -474,16 +593,17 @@ def main(fasta_path, username="", password="", thresholds=[]):
                     # when downloading additional data / ordering the hits
                     try:
                         # run the control loop
-                        asyncio.run(
-                            as_session(
-                                download_dataframe,
-                                database="species",
-                                hdf_name_top_100_hits=hdf_name_top_100_hits,
-                                semaphore=sem,
+                        with metrics.stage("downloads"):
+                            asyncio.run(
+                                as_session(
+                                    download_dataframe,
+                                    database=database,
+                                    hdf_name_top_100_hits=None,
+                                    semaphore=sem,
+                                )
                             )
-                        )
                     except (IndexError, ValueError):
-                        tqdm.write(
+                        messages.write(
                             "{}: Bad download links. Repeating the request.".format(
                                 datetime.datetime.now().strftime("%H:%M:%S"), query_size
                             )
@@ -494,190 +614,632 @@ def main(fasta_path, username="", password="", thresholds=[]):
                     pbar.update(pbar_update)
                     pbar.set_description("Generating download links")
 
-                    # update the fasta dict
-                    fasta_dict = {
-                        id: seq
-                        for (id, seq) in fasta_dict.items()
-                        if id not in set(download_dataframe["id"])
-                    }
+                    # remove the downloaded sequences from the queue
+                    for key in keys:
+                        del queue[key]
+
+                    # emit the top hits of all IDs that are complete now
+                    if online_results:
+                        online_results.update()
 
                 except (ReadTimeout, ConnectionError):
                     # repeat if there is no response
+                    metrics.record_timeout(
+                        "{}/index.php/IDS_IdentificationRequest".format(urls.v4_url)
+                    )
                     # update the query size
                     query_size = update_query_size(query_size, -5)
                     # give user output
-                    if query_size != 5:
-                        tqdm.write(
+                    if query_size != min_query_size:
+                        messages.write(
                             "{}: BOLD did not respond. Retrying with reduced query size of {}.".format(
                                 datetime.datetime.now().strftime("%H:%M:%S"), query_size
                             )
                         )
                     else:
-                        tqdm.write(
+                        messages.write(
                             "{}: BOLD did not respond. Keeping query size at {}.".format(
                                 datetime.datetime.now().strftime("%H:%M:%S"), query_size
                             )
                         )
                 except BadResponseError:
-                    tqdm.write(
+                    messages.write(
                         "{}: BOLD did not return a sufficient number of download links. Retrying".format(
                             datetime.datetime.now().strftime("%H:%M:%S")
                         )
                     )
                     # wait for 3 minutes to give the BOLD Server a break
-                    time.sleep(180)
-
-                    # login again
-                    session, username, password = login.bold_login(
-                        username=username, password=password
+                    time.sleep(bad_response_wait)
+
+                    # login again if the session is not valid anymore
+                    session, username, password = login.ensure_login(
+                        session,
+                        username=username,
+                        password=password,
+                        interactive=interactive,
                     )
 
-    # give user output
-    print(
-        "{}: Starting to download from the all records database.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
+    return session, username, password, query_size
+
+
+# function to limit the maximum concurrent downloads
+async def limit_concurrency(
+    species_id,
+    url,
+    as_session,
+    database,
+    hdf_name_top_100_hits,
+    semaphore,
+    slot_pool,
+    stored_link=False,
+):
+    queued_at = time.perf_counter()
+
+    async with semaphore:
+        with profiling.task_timer("as_request", queued_at), tracing.hold_slot(
+            slot_pool
+        ):
+            return await as_request(
+                species_id,
+                url,
+                as_session,
+                database,
+                hdf_name_top_100_hits,
+                stored_link=stored_link,
+            )
+
+
+# function to create the asynchronous session
+# returns a list with True for every link that was downloaded successfully
+async def as_session(
+    download_links_species,
+    database,
+    hdf_name_top_100_hits,
+    semaphore,
+    stored_links=False,
+):
+    as_session = requests_html.AsyncHTMLSession()
+    as_session.headers.update(
+        {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.82 Safari/537.36"
+        }
+    )
+    retry_strategy = Retry(
+        total=15,
+        status_forcelist=[400, 401, 403, 404, 413, 429, 502, 503, 504],
+        backoff_factor=1,
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy)
+    as_session.mount("https://", adapter)
+    as_session.mount("http://", adapter)
+    metrics.instrument_session(as_session)
+
+    # create all requests, the slots show which task holds the semaphore in the trace
+    slot_pool = tracing.SlotPool()
+    tasks = download_links_species.copy()
+
+    # links of a shared queue carry the project storage they belong to
+    if "hdf_name" in tasks.columns:
+        hdf_names = tasks["hdf_name"]
+    else:
+        hdf_names = [hdf_name_top_100_hits] * len(tasks.index)
+
+    tasks = (
+        limit_concurrency(
+            id,
+            url,
+            as_session,
+            database,
+            hdf_name,
+            semaphore,
+            slot_pool,
+            stored_link=stored_links,
         )
+        for id, url, hdf_name in zip(tasks["id"], tasks["url"], hdf_names)
     )
 
-    # give user output
-    print(
-        "{}: Performing second login for requesting links from the all records database.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
+    # the journal records of all downloads of this request are synced at once
+    with journal.group():
+        return await asyncio.gather(*tasks)
+
+
+# function to remove the IDs that have a valid species level hit above the species threshold
+# those IDs do not need to be searched in the all records database
+def check_valid_species_records(fasta_dict, hdf_name_top_100_hits, thresholds):
+    # the id summary holds the highest similarity of a valid species hit per id
+    valid_ids = id_summary.valid_species_ids(
+        id_summary.load(hdf_name_top_100_hits), thresholds
+    )
+
+    # pop those values from the fasta dict
+    fasta_dict = {
+        key: value for key, value in fasta_dict.items() if key not in valid_ids
+    }
+
+    return fasta_dict
+
+
+def main(
+    fasta_path,
+    username="",
+    password="",
+    thresholds=[],
+    output_formats=export.default_output_formats,
+    metrics_textfile=None,
+    profile=False,
+    trace=False,
+    proxy_list=None,
+    interactive=True,
+    online=False,
+    memory_budget=None,
+    reference_library=None,
+    cluster_identity=None,
+    cluster_validation=0,
+    archive_responses=False,
+    shard=None,
+):
+    # start collecting metrics for this run
+    metrics.reset(metrics_textfile)
+
+    # a shard (i, N) only identifies its part of the sequences, as a project of its own next to the fasta file
+    if shard:
+        fasta_path = sharding.write_shard(fasta_path, *shard, read_fasta)
+
+    # trace all requests if requested
+    if trace:
+        tracing.enable()
+    else:
+        tracing.disable()
+
+    # profile all stages if requested, profiles are saved in the project folder
+    if profile:
+        fasta_path = Path(fasta_path)
+        profiling.enable(
+            fasta_path.parent.joinpath("{}_profile".format(fasta_path.stem))
         )
+    else:
+        profiling.disable()
+
+    # log in to BOLD to generate the session, initialize the query size
+    # a local reference library is searched without BOLD, no login needed
+    if reference_library is None:
+        session, username, password = login.bold_login(
+            username=username, password=password, interactive=interactive
+        )
+    else:
+        session = None
+    query_size = min_query_size
+
+    # read the input fasta
+    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+
+    # generate a name for the top hits hdf file
+    hdf_name_top_100_hits = project_directory.joinpath(
+        "{}_top_100_hits.h5.lz".format(fasta_name)
+    )
+
+    # remove rows of writes that were interrupted in a previous run
+    journal.recover(hdf_name_top_100_hits)
+
+    # keep the raw responses next to the project storage if requested
+    if archive_responses:
+        archive.enable()
+    else:
+        archive.disable()
+
+    # cluster near-identical sequences, only one representative per cluster is queried
+    if cluster_identity:
+        with metrics.stage("clustering"):
+            clusters = clustering.cluster_sequences(
+                fasta_dict, cluster_identity, validation_size=cluster_validation
+            )
+    else:
+        clusters = None
+
+    clustering.save_clusters(hdf_name_top_100_hits, clusters)
+    fasta_dict = clustering.queried_sequences(fasta_dict, clusters)
+
+    # in online mode the top hit of every ID is emitted as soon as its data is complete
+    proxy_source = proxy_pool.file_proxy_source(proxy_list) if proxy_list else None
+
+    online_results = (
+        streaming.OnlineResults(
+            hdf_name_top_100_hits,
+            project_directory,
+            fasta_name,
+            thresholds,
+            proxy_source=proxy_source,
+        )
+        if online
+        else None
+    )
+
+    # check if any of the ids have been downloaded and saved already. If so remove them from the fasta dict
+    fasta_dict = check_already_downloaded(fasta_dict, hdf_name_top_100_hits, "species")
+
+    if reference_library is not None:
+        # search the species level database of the local reference library instead of BOLD
+        with metrics.stage("local_search"):
+            local_engine.search(
+                reference_library, fasta_dict, hdf_name_top_100_hits, "species"
+            )
+        fasta_dict = {}
+
+        if online_results:
+            online_results.update()
+    else:
+        # start the download for the species level database
+        # give user output
+        messages.write(
+            "{}: Starting to download from the species level database.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+
+        # download links that were generated in a previous run and are still valid
+        fasta_dict = download_stored_links(fasta_dict, hdf_name_top_100_hits, "species")
+
+    # request the server until all links have been generated
+    session, username, password, query_size = download_queue(
+        session,
+        fasta_dict,
+        {id: (id, hdf_name_top_100_hits) for id in fasta_dict},
+        "species",
+        query_size,
+        username=username,
+        password=password,
+        interactive=interactive,
+        online_results=online_results,
     )
 
     # reread the fasta to generate a fresh fasta dict
     fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+    fasta_dict = clustering.queried_sequences(fasta_dict, clusters)
+
+    if reference_library is None:
+        # give user output
+        messages.write(
+            "{}: Starting to download from the all records database.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+
+        # give user output
+        messages.write(
+            "{}: Checking the login for requesting links from the all records database.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
 
-    # filter the fasta dict for hits no having a species level hit, perform a second log in
-    session, username, password = login.bold_login(username=username, password=password)
+        # the same session serves both databases
+        session, username, password = login.ensure_login(
+            session, username=username, password=password, interactive=interactive
+        )
+
+    # filter the fasta dict for hits no having a species level hit
     fasta_dict = check_valid_species_records(
         fasta_dict, hdf_name_top_100_hits, thresholds=thresholds
     )
 
-    # gather download links at all barcode records level until all download links are requested
+    # check if any of the ids have been downloaded and saved already. If so remove them from the fasta dict
+    fasta_dict = check_already_downloaded(
+        fasta_dict, hdf_name_top_100_hits, "all_records"
+    )
+
+    if reference_library is not None:
+        # search the all records database of the local reference library instead of BOLD
+        with metrics.stage("local_search"):
+            local_engine.search(
+                reference_library, fasta_dict, hdf_name_top_100_hits, "all_records"
+            )
+        fasta_dict = {}
+    else:
+        # gather download links at all barcode records level until all download links are requested
+        # give user output
+        messages.write(
+            "{}: Starting to gather download links from the all records database.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+
+        # download links that were generated in a previous run and are still valid
+        fasta_dict = download_stored_links(
+            fasta_dict, hdf_name_top_100_hits, "all_records"
+        )
+
+    # request the server until all links have been generated
+    session, username, password, query_size = download_queue(
+        session,
+        fasta_dict,
+        {id: (id, hdf_name_top_100_hits) for id in fasta_dict},
+        "all_records",
+        query_size,
+        username=username,
+        password=password,
+        interactive=interactive,
+        online_results=online_results,
+    )
+
     # give user output
-    print(
-        "{}: Starting to gather download links from the all records database.".format(
+    messages.write(
+        "{}: All records top 100 records successfully downloaded.".format(
             datetime.datetime.now().strftime("%H:%M:%S")
         )
     )
 
-    # check if any of the ids have been downloaded and saved already. If so remove them from the fasta dict
-    fasta_dict = check_already_downloaded(
-        fasta_dict, hdf_name_top_100_hits, "all_records"
+    # all remaining IDs are complete now, also covers IDs downloaded in a previous run
+    if online_results:
+        online_results.update()
+        online_results.close()
+
+    # download the additional data if it is not present yet
+    additional_data_download.main(
+        fasta_path,
+        hdf_name_top_100_hits,
+        read_fasta,
+        output_formats=output_formats,
+        proxy_list=proxy_list,
+        memory_budget=memory_budget,
     )
 
-    # request the server until all links have been generated
-    if fasta_dict:
-        with tqdm(total=len(fasta_dict), desc="Generating download links") as pbar:
-            # generate download links first
-            while fasta_dict:
-                try:
-                    # gather the returned download links to download them straight away
-                    download_dataframe = gather_download_links(
-                        session, fasta_dict, query_size, database="all_records"
-                    )
+    # filter for the top hits
+    all_top_hits = digger_hit.main(
+        hdf_name_top_100_hits,
+        project_directory,
+        fasta_name,
+        thresholds=thresholds,
+        output_formats=output_formats,
+        memory_budget=memory_budget,
+    )
 
-                    # set the semaphore to the query size of the original query
-                    sem = asyncio.Semaphore(query_size)
-                    pbar_update = query_size
-                    # update the query size by 2
-                    query_size = update_query_size(query_size, 5)
+    # save the metrics of the run next to the results
+    metrics.write_summary(
+        project_directory.joinpath("{}_metrics.json".format(fasta_name))
+    )
+    profiling.write_summary()
+    tracing.write_trace(project_directory.joinpath("{}_trace.json".format(fasta_name)))
 
-                    # give user output
-                    if query_size != 50:
-                        tqdm.write(
-                            "{}: Query size updated to {}.".format(
-                                datetime.datetime.now().strftime("%H:%M:%S"), query_size
-                            )
-                        )
-                    else:
-                        tqdm.write(
-                            "{}: Query size kept at {}.".format(
-                                datetime.datetime.now().strftime("%H:%M:%S"), query_size
-                            )
-                        )
+    return all_top_hits
 
-                    # download the data from the generated links, update the fasta dict after successfull download
-                    # update the description of the progress bar
-                    pbar.set_description("Downloading data")
 
-                    try:
-                        # run the control loop
-                        asyncio.run(
-                            as_session(
-                                download_dataframe,
-                                database="all_records",
-                                hdf_name_top_100_hits=hdf_name_top_100_hits,
-                                semaphore=sem,
-                            )
-                        )
-                    except (IndexError, ValueError):
-                        tqdm.write(
-                            "{}: Bad download links. Repeating the request.".format(
-                                datetime.datetime.now().strftime("%H:%M:%S"), query_size
-                            )
-                        )
-                        continue
+# function to parse a batch of archived result pages, runs in a worker process
+def parse_archived_pages(directory, entries):
+    results = []
 
-                    # update the progress bar
-                    pbar.update(pbar_update)
-                    pbar.set_description("Generating download links")
+    for entry in entries:
+        result = parse_result_page(
+            archive.load(directory, entry), entry["id"], entry["database"]
+        )
+        result["request_date"] = entry["request_date"]
+        results.append(result)
 
-                    # update the fasta dict
-                    fasta_dict = {
-                        id: seq
-                        for (id, seq) in fasta_dict.items()
-                        if id not in set(download_dataframe["id"])
-                    }
+    return pd.concat(results, axis=0, ignore_index=True)
 
-                except (ReadTimeout, ConnectionError):
-                    # repeat if there is no response
-                    # update the query size
-                    query_size = update_query_size(query_size, -5)
-                    # give user output
-                    if query_size != 5:
-                        tqdm.write(
-                            "{}: BOLD did not respond. Retrying with reduced query size of {}.".format(
-                                datetime.datetime.now().strftime("%H:%M:%S"), query_size
-                            )
-                        )
-                    else:
-                        tqdm.write(
-                            "{}: BOLD did not respond. Keeping query size at {}.".format(
-                                datetime.datetime.now().strftime("%H:%M:%S"), query_size
-                            )
-                        )
-                except BadResponseError:
-                    tqdm.write(
-                        "{}: BOLD did not return a sufficient number of download links. Retrying".format(
-                            datetime.datetime.now().strftime("%H:%M:%S")
-                        )
-                    )
-                    # wait for 3 minutes to give the BOLD Server a break
-                    time.sleep(180)
 
-                    # login again
-                    session, username, password = login.bold_login(
-                        username=username, password=password
-                    )
+# function to parse a batch of archived specimen data, runs in a worker process
+def parse_archived_specimen_data(directory, entries):
+    return [
+        (
+            additional_data_download.parse_specimen_data(
+                archive.load(directory, entry), entry["ids"]
+            ),
+            entry["ids"],
+        )
+        for entry in entries
+    ]
+
+
+# function to check if the archive holds a response for everything the journal marks as downloaded
+# parsed_ids maps the database to the ids whose result pages have to be parsed
+# returns a list with one message per missing response
+def missing_responses(state, parsed_ids, pages, specimen_data):
+    problems = []
+
+    for database in ["species", "all_records"]:
+        archived = {entry["id"] for entry in pages if entry["database"] == database}
+        missing = parsed_ids[database] - archived
+
+        if missing:
+            problems.append(
+                "{} result pages of the {} database are not archived.".format(
+                    len(missing), database
+                )
+            )
+
+    archived = {id for entry in specimen_data for id in entry["ids"]}
+    missing = journal.ids_in_stage(state, "metadata") - archived
+
+    if missing:
+        problems.append(
+            "The specimen data of {} process ids is not archived.".format(len(missing))
+        )
+
+    return problems
+
+
+# function to parse the archived raw responses of a project again without downloading anything
+# all tables derived from the responses are rebuilt, the memoized top hits are kept since they are keyed by content
+def reparse(
+    fasta_path,
+    thresholds=[],
+    output_formats=export.default_output_formats,
+    memory_budget=None,
+    workers=None,
+    profile=False,
+):
+    metrics.reset()
+    archive.disable()
+    tracing.disable()
+
+    # profile all stages if requested, profiles are saved in the project folder
+    if profile:
+        profiling.enable(
+            Path(fasta_path).parent.joinpath("{}_profile".format(Path(fasta_path).stem))
+        )
+    else:
+        profiling.disable()
+
+    # read the input fasta
+    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+
+    # generate a name for the top hits hdf file
+    hdf_name_top_100_hits = project_directory.joinpath(
+        "{}_top_100_hits.h5.lz".format(fasta_name)
+    )
+    directory = archive.project_archive(hdf_name_top_100_hits)
+
+    # remove rows of writes that were interrupted in a previous run
+    state = journal.recover(hdf_name_top_100_hits)
+
+    # an interrupted reparse has cleared the parsed ids already, they are kept in the reparse stage until it is finished
+    databases = ["species", "all_records"]
+    parsed_ids = {
+        database: (
+            set() if state is None else journal.ids_in_stage(state, "reparse", database)
+        )
+        for database in databases
+    }
+    interrupted = any(parsed_ids.values())
+
+    if state is not None and not interrupted:
+        parsed_ids = {
+            database: journal.ids_in_stage(state, "parsed", database)
+            for database in databases
+        }
+
+    # only the latest response per ID and database is parsed
+    pages = {
+        (entry["id"], entry["database"]): entry
+        for entry in archive.read_index(directory, archive.result_page)
+    }
+    specimen_data = archive.read_index(directory, archive.specimen_data)
+
+    if state is None or not pages:
+        problems = ["No archived responses found in {}.".format(directory)]
+    else:
+        problems = missing_responses(state, parsed_ids, pages.values(), specimen_data)
+
+    if problems:
+        problems.append(
+            "Run the identification with --archive to archive all responses."
+        )
+        raise ProjectError("\n".join(problems))
+
+    # only responses whose data made it into the storage are parsed
+    pages = [
+        entry for (id, database), entry in pages.items() if id in parsed_ids[database]
+    ]
+    workers = workers or os.cpu_count() or 1
 
     # give user output
-    print(
-        "{}: All records top 100 records successfully downloaded.".format(
-            datetime.datetime.now().strftime("%H:%M:%S")
+    messages.write(
+        "{}: Parsing {} archived result pages and {} archived specimen data responses.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(pages),
+            len(specimen_data),
         )
     )
 
-    # download the additional data if it is not present yet
-    additional_data_download.main(fasta_path, hdf_name_top_100_hits, read_fasta)
+    # the ids to parse are kept before they are cleared with the tables holding their data
+    # an interrupted reparse is detected by the reparse stage and finished by running it again
+    if interrupted:
+        messages.write(
+            "{}: Finishing an interrupted reparse.".format(
+                datetime.datetime.now().strftime("%H:%M:%S")
+            )
+        )
+    else:
+        for database in databases:
+            journal.record(
+                hdf_name_top_100_hits,
+                "reparse",
+                ids=parsed_ids[database],
+                database=database,
+            )
+
+    journal.clear(hdf_name_top_100_hits, ["parsed", "metadata", "final"])
+
+    # remove all tables derived from the responses
+    for key in [
+        "top_100_hits_unsorted",
+        id_summary.summary_key,
+        "top_100_hits_sorted",
+        "additional_data",
+        "top_100_hits_additional_data",
+        streaming.final_top_hits_key,
+    ]:
+        journal.discard(hdf_name_top_100_hits, key)
+
+    with metrics.stage("reparse"), Parallel(n_jobs=workers) as parallel:
+        for database in ["species", "all_records"]:
+            database_pages = [entry for entry in pages if entry["database"] == database]
+
+            for page_batch in tqdm(
+                list(more_itertools.chunked(database_pages, pages_per_write)),
+                desc="Parsing {} result pages".format(database),
+                disable=not messages.enabled,
+            ):
+                results = parallel(
+                    delayed(profiling.profiled(parse_archived_pages, "reparse_worker"))(
+                        directory, task
+                    )
+                    for task in more_itertools.chunked(page_batch, pages_per_task)
+                )
+                local_engine.save_hits(
+                    pd.concat(results, axis=0, ignore_index=True),
+                    hdf_name_top_100_hits,
+                    database,
+                )
+
+        for entry_batch in tqdm(
+            list(more_itertools.chunked(specimen_data, pages_per_write)),
+            desc="Parsing specimen data",
+            disable=not messages.enabled,
+        ):
+            results = parallel(
+                delayed(
+                    profiling.profiled(parse_archived_specimen_data, "reparse_worker")
+                )(directory, task)
+                for task in more_itertools.chunked(entry_batch, pages_per_task)
+            )
+
+            for process_id_batch_results, process_id_batch in (
+                result for task in results for result in task
+            ):
+                additional_data_download.save_additional_data(
+                    process_id_batch_results, process_id_batch, hdf_name_top_100_hits
+                )
+
+    # all responses are parsed again, the journal marks their ids as parsed
+    journal.clear(hdf_name_top_100_hits, ["reparse"])
+
+    # order the hits and add the additional data, all process ids are in the storage already
+    additional_data_download.main(
+        fasta_path,
+        hdf_name_top_100_hits,
+        read_fasta,
+        output_formats=output_formats,
+        memory_budget=memory_budget,
+    )
 
     # filter for the top hits
-    digger_hit.main(
-        hdf_name_top_100_hits, project_directory, fasta_name, thresholds=thresholds
+    all_top_hits = digger_hit.main(
+        hdf_name_top_100_hits,
+        project_directory,
+        fasta_name,
+        thresholds=thresholds,
+        output_formats=output_formats,
+        memory_budget=memory_budget,
     )
 
+    # save the metrics of the run next to the results
+    metrics.write_summary(
+        project_directory.joinpath("{}_metrics.json".format(fasta_name))
+    )
+    profiling.write_summary()
+
+    return all_top_hits
+
 
 # run only if called as a toplevel script
 if __name__ == "__main__":
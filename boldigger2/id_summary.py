@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from boldigger2 import clean_taxonomy, metrics, journal
+
+# key of the per ID summary in the project storage
+summary_key = "id_summary"
+
+# columns of the summary, one row per ID and database
+# valid_species_similarity is the highest similarity of a hit with a valid species name, NaN if there is none
+# status_class is NoMatch or BrokenRecord if BOLD returned no hits, Hits otherwise
+summary_columns = [
+    "ID",
+    "database",
+    "hits",
+    "max_similarity",
+    "valid_species_similarity",
+    "status_class",
+    "process_ids",
+]
+
+# set size limits for the text columns of the summary
+item_sizes = {"ID": 100, "database": 20, "status_class": 15}
+
+# columns of the top 100 hits that are needed to summarize them
+hit_columns = ["ID", "database", "Species", "Similarity", "Process_ID", "request_date"]
+
+
+# function to summarize the hits of one or more responses per ID and database
+# like the ordering of the hits, only the first response per ID and database counts if there are several
+def summarize(hits):
+    hits = hits[[column for column in hit_columns if column in hits.columns]].copy()
+
+    if "request_date" in hits.columns:
+        first_request = hits.groupby(["ID", "database"], sort=False)[
+            "request_date"
+        ].transform("first")
+        hits = hits.loc[hits["request_date"] == first_request]
+
+    # names with punctuation or digits are no valid species names, like in the species level filter
+    with pd.option_context("future.no_silent_downcasting", True):
+        species = hits[["Species"]].replace("", np.nan)
+    species = clean_taxonomy.clean_taxonomy(species, ["Species"])
+    hits["valid_similarity"] = hits["Similarity"].where(species["Species"].notna())
+
+    with pd.option_context("future.no_silent_downcasting", True):
+        hits["Process_ID"] = hits["Process_ID"].replace("", np.nan)
+
+    grouped = hits.groupby(["ID", "database"], sort=False)
+    summary = grouped.agg(
+        hits=("Similarity", "size"),
+        max_similarity=("Similarity", "max"),
+        valid_species_similarity=("valid_similarity", "max"),
+        first_species=("Species", "first"),
+        process_ids=("Process_ID", "nunique"),
+    ).reset_index()
+
+    # BOLD answers without hits with a single NoMatch or BrokenRecord row
+    no_hits = (summary["max_similarity"] == 0) & summary["first_species"].isin(
+        ["NoMatch", "BrokenRecord"]
+    )
+    summary["status_class"] = summary["first_species"].where(no_hits, "Hits")
+
+    return summary.astype(
+        {
+            "hits": np.int64,
+            "max_similarity": float,
+            "valid_species_similarity": float,
+            "process_ids": np.int64,
+        }
+    )[summary_columns]
+
+
+# function to append summary rows to the project storage and checkpoint them in the journal
+def save(hdf_name, summary):
+    if summary.empty:
+        return
+
+    with metrics.hdf_append(summary_key, len(summary.index)), pd.HDFStore(
+        hdf_name, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        hdf_output.append(
+            summary_key,
+            summary,
+            format="t",
+            data_columns=True,
+            min_itemsize=item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+        )
+        nrows = hdf_output.get_storer(summary_key).nrows
+
+    journal.record(hdf_name, "checkpoint", key=summary_key, nrows=nrows)
+
+
+# function to summarize the hits of IDs that were parsed without writing a summary
+# this covers projects from before the summary and downloads that were interrupted between both writes
+def backfill(hdf_name, state, summary):
+    known = set(zip(summary["ID"], summary["database"]))
+    missing = {
+        (id, database)
+        for (stage, database), ids in state["stages"].items()
+        if stage == "parsed"
+        for id in ids
+        if (id, database) not in known
+    }
+
+    if not missing:
+        return summary
+
+    hits = pd.read_hdf(
+        hdf_name,
+        key="top_100_hits_unsorted",
+        columns=hit_columns,
+        stop=state["nrows"].get("top_100_hits_unsorted", 0),
+    )
+    hits = hits.loc[
+        pd.Series(list(zip(hits["ID"], hits["database"])), index=hits.index).isin(
+            missing
+        )
+    ]
+
+    new_summary = summarize(hits)
+    save(hdf_name, new_summary)
+
+    return pd.concat(
+        [rows for rows in [summary, new_summary] if not rows.empty] or [summary],
+        axis=0,
+        ignore_index=True,
+    )
+
+
+# function to load the summary of all downloaded IDs, IDs without summary are summarized from their hits first
+# returns one row per ID and database
+def load(hdf_name):
+    state = journal.load_state(hdf_name)
+
+    if state is None:
+        return pd.DataFrame(columns=summary_columns)
+
+    try:
+        summary = pd.read_hdf(
+            hdf_name, key=summary_key, stop=state["nrows"].get(summary_key, 0)
+        )
+    except KeyError:
+        summary = pd.DataFrame(columns=summary_columns)
+
+    # a write that was repeated after an interruption may have added the same rows twice
+    summary = summary.drop_duplicates(subset=["ID", "database"], keep="first")
+
+    return backfill(hdf_name, state, summary).reset_index(drop=True)
+
+
+# function to return the IDs with a valid species level hit at or above the species threshold
+def valid_species_ids(summary, thresholds):
+    species = summary.loc[summary["database"] == "species"]
+
+    return set(species.loc[species["valid_species_similarity"] >= thresholds[0], "ID"])
+
+
+# function to combine the summary of both databases into the inputs of the threshold selection
+# the status class is taken from the species level database, its hits come first in the ordered hits
+# returns a dataframe with max_similarity and status_class indexed by ID
+def threshold_inputs(summary):
+    summary = summary.sort_values("database", ascending=False, kind="stable")
+    grouped = summary.groupby("ID", sort=False)
+
+    return pd.DataFrame(
+        {
+            "max_similarity": grouped["max_similarity"].max(),
+            "status_class": grouped["status_class"].first(),
+        }
+    )
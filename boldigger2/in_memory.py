@@ -0,0 +1,39 @@
+import threading
+import pandas as pd
+
+
+# holds the hits and the additional data of an identification that is not written to a project storage
+# the stages add their results here wherever they would append them to the project storage
+class Project:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = []
+        self.additional_data = []
+        # process ids whose additional data is present
+        self.process_ids = set()
+
+    # function to add the parsed hits of one or more IDs
+    def add_hits(self, hits):
+        with self.lock:
+            self.hits.append(hits)
+
+    # function to add the additional data of a batch of process ids
+    def add_additional_data(self, additional_data, process_ids):
+        with self.lock:
+            self.additional_data.append(additional_data)
+            self.process_ids.update(process_ids)
+
+    # function to return all hits in the order they were added, like the unsorted hits of a project storage
+    def top_100_hits(self):
+        with self.lock:
+            return pd.concat(self.hits, axis=0).reset_index(drop=True)
+
+    # function to return the additional data of all process ids, columns are the additional data columns
+    def additional_data_table(self, columns):
+        with self.lock:
+            additional_data = [data for data in self.additional_data if not data.empty]
+
+        if not additional_data:
+            return pd.DataFrame(columns=columns)
+
+        return pd.concat(additional_data, axis=0).reset_index(drop=True)
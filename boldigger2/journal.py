@@ -0,0 +1,284 @@
+# write-ahead journal of the project storage
+# every append to a journaled table is followed by a checkpoint with the number of committed rows,
+# recover removes the rows that were appended after the last checkpoint by an interrupted run.
+# the journal can not protect the hdf file itself: a run that is killed while hdf5 writes the structure
+# of the file can leave a storage that can not be opened anymore. recover reports this as a ProjectError,
+# the storage and its journal have to be deleted and the sequences identified again.
+import datetime, json, os, threading, time
+import pandas as pd
+from contextlib import contextmanager
+from pathlib import Path
+from boldigger2 import messages
+from boldigger2.exceptions import ProjectError
+
+# tables of the project storage whose appends are checkpointed in the journal
+journaled_keys = [
+    "download_links",
+    "top_100_hits_unsorted",
+    "id_summary",
+    "top_100_hits_sorted",
+    "additional_data",
+    "top_100_hits_additional_data",
+    "clean_taxonomy_names",
+    "top_hit_memo",
+    "final_top_hits",
+]
+
+# the additional data is downloaded in several threads, only one of them may write to the journal at once
+lock = threading.Lock()
+
+# replayed state per journal path as (state, bytes read, first line), later replays only read the appended lines
+# the first line holds the time the journal was started, a journal that was deleted and started again differs in it
+states = {}
+
+# journals written inside a group are synced once when the outermost group of the thread ends
+groups = threading.local()
+
+
+# function to return the journal path that belongs to a project storage
+def journal_path(hdf_name):
+    hdf_name = Path(hdf_name)
+
+    return hdf_name.with_name(
+        "{}.journal".format(hdf_name.with_suffix("").with_suffix("").name)
+    )
+
+
+# function to sync a journal to disk
+def sync(path):
+    with open(path, "a") as journal:
+        os.fsync(journal.fileno())
+
+
+# context manager to group the records of a batch, e.g. all downloads of one request, into one sync
+# a crash before the sync can only lose the last records, their ids are downloaded again
+@contextmanager
+def group():
+    groups.depth = getattr(groups, "depth", 0) + 1
+
+    if groups.depth == 1:
+        groups.pending = set()
+
+    try:
+        yield
+    finally:
+        groups.depth -= 1
+
+        if not groups.depth:
+            for path in groups.pending:
+                sync(path)
+
+
+# function to append one state transition to the journal
+# every line is written and synced to disk before the function returns, inside a group it is synced with the group
+# a torn last line is ignored on replay
+# stages: submitted, downloaded, parsed, metadata and checkpoint for tables without ids
+# a clear entry removes all ids of the stages listed in cleared
+def record(hdf_name, stage, key=None, nrows=None, ids=[], **fields):
+    entry = dict(
+        stage=stage,
+        time=time.time(),
+        key=key,
+        nrows=None if nrows is None else int(nrows),
+        ids=[str(id) for id in ids],
+    )
+    entry.update(fields)
+    line = json.dumps(entry) + "\n"
+
+    path = journal_path(hdf_name)
+
+    with lock, open(path, "a") as journal:
+        journal.write(line)
+        journal.flush()
+
+        if getattr(groups, "depth", 0):
+            groups.pending.add(path)
+        else:
+            os.fsync(journal.fileno())
+
+
+# function to read the journal into the current state of the project
+# the state is cached, every replay only parses the lines appended since the previous one
+# returns a dict with the committed number of rows per table and the ids per stage and database
+# the returned state is shared and updated by later replays, it must not be modified
+def replay(hdf_name):
+    path = journal_path(hdf_name)
+
+    try:
+        journal = open(path, "rb")
+    except FileNotFoundError:
+        states.pop(path, None)
+        return None
+
+    with lock, journal:
+        first_line = journal.readline()
+        size = os.fstat(journal.fileno()).st_size
+        state, offset, cached_first_line = states.get(path, (None, 0, None))
+
+        # a journal that was replaced or cut back is read from the start
+        if state is None or cached_first_line != first_line or size < offset:
+            state, offset = {"nrows": {}, "stages": {}}, 0
+
+        journal.seek(offset)
+
+        for line in journal:
+            # the last line may be incomplete after an unclean shutdown or while it is written
+            if not line.endswith(b"\n"):
+                break
+
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+
+            offset += len(line)
+
+            if entry["key"] is not None:
+                state["nrows"][entry["key"]] = entry["nrows"]
+
+            if entry["ids"]:
+                state["stages"].setdefault(
+                    (entry["stage"], entry.get("database")), set()
+                ).update(entry["ids"])
+
+            for stage in entry.get("cleared", []):
+                for stage_key in [key for key in state["stages"] if key[0] == stage]:
+                    del state["stages"][stage_key]
+
+        states[path] = (state, offset, first_line)
+
+    return state
+
+
+# function to return all ids that reached a stage, database is None for stages that do not depend on it
+def ids_in_stage(state, stage, database=None):
+    return state["stages"].get((stage, database), set())
+
+
+# function to start a journal for a project storage that was created without one
+# all tables present are trusted and checkpointed with their current size
+def bootstrap(hdf_name):
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        keys = [key for key in journaled_keys if "/{}".format(key) in hdf_input.keys()]
+        nrows = {key: hdf_input.get_storer(key).nrows for key in keys}
+
+        if "top_100_hits_unsorted" in keys:
+            downloaded = hdf_input.select(
+                "top_100_hits_unsorted", columns=["ID", "database"]
+            ).drop_duplicates()
+        if "additional_data" in keys:
+            metadata = hdf_input.select("additional_data", columns=["processid"])
+
+    for key in keys:
+        if key == "top_100_hits_unsorted":
+            for database, ids in downloaded.groupby("database")["ID"]:
+                record(
+                    hdf_name,
+                    "parsed",
+                    key=key,
+                    nrows=nrows[key],
+                    ids=ids,
+                    database=database,
+                )
+        elif key == "additional_data":
+            record(
+                hdf_name,
+                "metadata",
+                key=key,
+                nrows=nrows[key],
+                ids=metadata["processid"].unique(),
+            )
+        else:
+            record(hdf_name, "checkpoint", key=key, nrows=nrows[key])
+
+
+# function to return the state of a project, projects created without a journal are bootstrapped first
+# returns None if there is no project storage yet
+def load_state(hdf_name):
+    if Path(hdf_name).is_file() and not journal_path(hdf_name).is_file():
+        bootstrap(hdf_name)
+
+    return replay(hdf_name)
+
+
+# function to check if a table has been written completely
+def committed(state, key):
+    return state is not None and bool(state["nrows"].get(key))
+
+
+# function to check if a table that may be written in several chunks holds all expected rows
+def complete(state, key, nrows):
+    return committed(state, key) and state["nrows"][key] == nrows
+
+
+# function to remove the ids of stages in all databases, e.g. before the tables that hold their data are rebuilt
+def clear(hdf_name, stages):
+    record(hdf_name, "clear", cleared=list(stages))
+
+
+# function to remove a table, e.g. a partially written table that is written again in one piece
+# the empty checkpoint comes first, so an interrupted removal is finished by recover
+def discard(hdf_name, key):
+    record(hdf_name, "checkpoint", key=key, nrows=0)
+
+    with pd.HDFStore(hdf_name, mode="a") as hdf_output:
+        if "/{}".format(key) in hdf_output.keys():
+            hdf_output.remove(key)
+
+
+# function to cut off an incomplete last line, so new entries start on a fresh line
+def repair(hdf_name):
+    try:
+        with open(journal_path(hdf_name), "rb+") as journal:
+            content = journal.read()
+            if content and not content.endswith(b"\n"):
+                journal.truncate(content.rfind(b"\n") + 1)
+    except FileNotFoundError:
+        pass
+
+
+# function to bring the project storage back to the last checkpoint of the journal
+# rows that were appended after the last checkpoint belong to an interrupted append and are removed
+# returns the replayed state, None if there is no project storage yet
+def recover(hdf_name):
+    if not Path(hdf_name).is_file():
+        return None
+
+    repair(hdf_name)
+
+    # hdf5 raises a RuntimeError for files whose structure is damaged
+    try:
+        state = load_state(hdf_name)
+        hdf_output = pd.HDFStore(hdf_name, mode="a")
+    except RuntimeError:
+        raise ProjectError(
+            "{} is damaged and can not be opened, the last run was probably stopped while writing to it. Please delete it together with {} and start the identification again.".format(
+                hdf_name, journal_path(hdf_name)
+            )
+        )
+
+    with hdf_output:
+        for key in journaled_keys:
+            if "/{}".format(key) not in hdf_output.keys():
+                continue
+
+            committed_rows = state["nrows"].get(key, 0)
+            stored_rows = hdf_output.get_storer(key).nrows
+
+            if stored_rows <= committed_rows:
+                continue
+
+            messages.write(
+                "{}: Removing {} rows of an interrupted write from {}.".format(
+                    datetime.datetime.now().strftime("%H:%M:%S"),
+                    stored_rows - committed_rows,
+                    key,
+                )
+            )
+
+            if committed_rows:
+                hdf_output.remove(key, start=committed_rows)
+            else:
+                hdf_output.remove(key)
+
+    return state
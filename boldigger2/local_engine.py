@@ -0,0 +1,694 @@
+import datetime, functools, json, os, time, more_itertools
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from Bio import SeqIO
+from joblib import Parallel, delayed
+from tqdm import tqdm
+from boldigger2 import additional_data_download, metrics, journal, id_summary
+from boldigger2 import profiling, messages, in_memory
+from boldigger2.exceptions import ReferenceLibraryError
+
+# version of the on disk layout of a reference library
+library_version = 1
+
+# length of the k-mers in the index, at most 16 so a k-mer fits into 32 bits
+default_kmer_size = 12
+
+# number of references per query that are scored, ranked by their shared k-mers
+candidates_per_query = 250
+
+# maximum number of hits per query, like the BOLD identification engine
+max_hits = 100
+
+# hits below this similarity are not reported, queries without any hit get a NoMatch row
+min_similarity = 80.0
+
+# query and reference have to overlap by at least this many bases
+min_overlap = 80
+
+# a hit may be scored on two diagonals to allow for one indel, shifted by at most this many bases
+max_indel = 30
+
+# number of queries per worker task and per write to the hdf storage
+queries_per_task = 50
+queries_per_write = 1000
+
+# positions are stored as 16 bit integers, longer references are only indexed up to here
+max_position = 2**16
+
+# column names the taxonomy may have in the metadata table, e.g. in BOLD data packages or the public data portal
+taxonomy_columns = {
+    "Phylum": ["phylum", "phylum_name"],
+    "Class": ["class", "class_name"],
+    "Order": ["order", "order_name"],
+    "Family": ["family", "family_name"],
+    "Genus": ["genus", "genus_name"],
+    "Species": ["species", "species_name"],
+    "Subspecies": ["subspecies", "subspecies_name"],
+}
+
+# column names the process id, the status and the additional data may have in the metadata table
+processid_columns = ["processid", "process_id"]
+status_columns = ["status"]
+additional_data_aliases = {"record_id": ["record_id", "recordid"]}
+
+# maps bases to 2 bit codes, everything else (gaps, ambiguous bases) is 4
+base_codes = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("ACGT"):
+    base_codes[ord(base)] = code
+    base_codes[ord(base.lower())] = code
+
+
+# function to encode a sequence as an array of base codes, alignment gaps are removed
+def encode(sequence):
+    sequence = str(sequence).replace("-", "").replace(".", "")
+
+    return base_codes[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+
+
+# function to compute all k-mers without ambiguous bases of concatenated encoded sequences
+# offsets holds the start of every sequence and the end of the last one
+# returns the k-mer codes, the index of the sequence and the position in the sequence of every k-mer
+def kmer_codes(codes, offsets, kmer_size):
+    n_windows = len(codes) - kmer_size + 1
+
+    if n_windows <= 0:
+        return (
+            np.array([], dtype=np.uint32),
+            np.array([], dtype=np.int32),
+            np.array([], dtype=np.uint16),
+        )
+
+    kmers = np.zeros(n_windows, dtype=np.uint32)
+    for shift in range(kmer_size):
+        kmers <<= 2
+        kmers |= codes[shift : shift + n_windows]
+
+    # windows that contain ambiguous bases or span two sequences are dropped
+    ambiguous = np.concatenate(([0], np.cumsum(codes == 4)))
+    clean = ambiguous[kmer_size:] == ambiguous[:-kmer_size]
+
+    lengths = np.diff(offsets)
+    sequence = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)[:n_windows]
+    positions = np.arange(n_windows) - offsets[sequence]
+    valid = (
+        clean
+        & (positions + kmer_size <= lengths[sequence])
+        & (positions < max_position)
+    )
+
+    return kmers[valid], sequence[valid], positions[valid].astype(np.uint16)
+
+
+# function to return the first column of a table that exists, None if there is none
+def find_column(table, candidates):
+    for candidate in candidates:
+        if candidate in table.columns:
+            return candidate
+
+    return None
+
+
+# function to read the metadata table of the references into the columns of the hits and the additional data
+# accepts tab separated (BOLD data packages), comma separated and parquet files
+def read_metadata(metadata_path):
+    metadata_path = Path(metadata_path)
+
+    if metadata_path.suffix == ".parquet":
+        metadata = pd.read_parquet(metadata_path).astype(str)
+    else:
+        metadata = pd.read_csv(
+            metadata_path,
+            sep="," if metadata_path.suffix == ".csv" else "\t",
+            dtype=str,
+            keep_default_na=False,
+            quoting=3 if metadata_path.suffix != ".csv" else 0,
+        )
+
+    metadata.columns = [
+        column.strip().lower().replace(" ", "_") for column in metadata.columns
+    ]
+
+    processid_column = find_column(metadata, processid_columns)
+
+    if processid_column is None:
+        raise ReferenceLibraryError(
+            "The metadata table {} has no processid column.".format(metadata_path)
+        )
+
+    records = pd.DataFrame({"processid": metadata[processid_column].str.strip()})
+
+    for level, candidates in taxonomy_columns.items():
+        column = find_column(metadata, candidates)
+        records[level] = metadata[column].str.strip() if column else ""
+
+    # references of public data packages are published records
+    status_column = find_column(metadata, status_columns)
+    records["Status"] = metadata[status_column] if status_column else "Published"
+
+    # the additional data is only stored if the table contains any of it
+    additional_data = False
+    for column in additional_data_download.additional_data_columns[1:]:
+        source = find_column(metadata, additional_data_aliases.get(column, [column]))
+        records[column] = metadata[source] if source else ""
+        additional_data = additional_data or source is not None
+
+    # cut the values to the sizes of the hdf tables, so the hits can always be appended
+    # the process id is also the Process_ID of the hits
+    item_sizes = dict(additional_data_download.additional_data_item_sizes)
+    item_sizes.update(additional_data_download.hit_item_sizes)
+    item_sizes["processid"] = item_sizes["Process_ID"]
+
+    for column in records.columns:
+        records[column] = (
+            records[column].replace("nan", "").str.slice(0, item_sizes[column])
+        )
+
+    records = records.loc[records["processid"] != ""].drop_duplicates("processid")
+
+    return records, additional_data
+
+
+# function to build a reference library from a reference fasta and a metadata table
+# the fasta headers have to start with the process id, e.g. BOLD headers like processid|taxon|marker
+# the library is a directory with the k-mer index, the encoded sequences and the metadata of the references
+def build(fasta_path, metadata_path, library_path=None, kmer_size=default_kmer_size):
+    fasta_path = Path(fasta_path)
+
+    if library_path is None:
+        library_path = fasta_path.with_name(
+            "{}_reference_library".format(fasta_path.stem)
+        )
+    library_path = Path(library_path)
+
+    if not 1 <= kmer_size <= 16:
+        raise ReferenceLibraryError("The k-mer size has to be between 1 and 16.")
+
+    # give user output
+    messages.write(
+        "{}: Reading the reference metadata.".format(
+            datetime.datetime.now().strftime("%H:%M:%S")
+        )
+    )
+
+    records, additional_data = read_metadata(metadata_path)
+    records = records.set_index("processid", drop=False)
+
+    # give user output
+    messages.write(
+        "{}: Reading the reference sequences.".format(
+            datetime.datetime.now().strftime("%H:%M:%S")
+        )
+    )
+
+    # only the first sequence of every process id with metadata is used
+    processids, sequences, seen = [], [], set()
+    skipped = 0
+
+    for record in SeqIO.parse(fasta_path, "fasta"):
+        processid = record.id.split("|")[0]
+
+        if processid in seen or processid not in records.index:
+            skipped += 1
+            continue
+
+        seen.add(processid)
+        processids.append(processid)
+        sequences.append(str(record.seq).replace("-", "").replace(".", ""))
+
+    if not processids:
+        raise ReferenceLibraryError(
+            "None of the sequences in {} has metadata.".format(fasta_path)
+        )
+
+    if skipped:
+        messages.write(
+            "{}: Skipped {} sequences without metadata or with a duplicate process id.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), skipped
+            )
+        )
+
+    records = records.loc[processids].reset_index(drop=True)
+
+    # all sequences are stored as one array of base codes
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    codes = encode("".join(sequences))
+    del sequences
+
+    # collect the k-mers in batches of references to limit the temporary memory
+    kmers, references, positions = [], [], []
+
+    for batch in tqdm(
+        list(more_itertools.chunked(range(len(processids)), 10000)),
+        desc="Indexing references",
+        disable=not messages.enabled,
+    ):
+        start, stop = batch[0], batch[-1] + 1
+        batch_kmers, batch_references, batch_positions = kmer_codes(
+            codes[offsets[start] : offsets[stop]],
+            offsets[start : stop + 1] - offsets[start],
+            kmer_size,
+        )
+        kmers.append(batch_kmers)
+        references.append(batch_references + start)
+        positions.append(batch_positions)
+
+    kmers = np.concatenate(kmers)
+    order = np.argsort(kmers, kind="stable")
+
+    library_path.mkdir(parents=True, exist_ok=True)
+    np.save(library_path.joinpath("kmers.npy"), kmers[order])
+    del kmers
+    np.save(
+        library_path.joinpath("kmer_references.npy"), np.concatenate(references)[order]
+    )
+    del references
+    np.save(
+        library_path.joinpath("kmer_positions.npy"), np.concatenate(positions)[order]
+    )
+    del positions, order
+
+    np.save(library_path.joinpath("sequences.npy"), codes)
+    np.save(library_path.joinpath("sequence_offsets.npy"), offsets)
+    np.save(
+        library_path.joinpath("species_records.npy"),
+        (records["Species"] != "").to_numpy(),
+    )
+    records.to_parquet(library_path.joinpath("records.parquet"), index=False)
+
+    # the description is written last, a library without it is incomplete
+    with open(library_path.joinpath("library.json"), "w") as output:
+        json.dump(
+            {
+                "version": library_version,
+                "kmer_size": kmer_size,
+                "references": len(processids),
+                "additional_data": additional_data,
+                "fasta": str(fasta_path),
+                "metadata": str(metadata_path),
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            },
+            output,
+            indent=2,
+        )
+
+    # give user output
+    messages.write(
+        "{}: Reference library with {} references saved to {}.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(processids),
+            library_path,
+        )
+    )
+
+    return library_path
+
+
+# function to read the description of a reference library
+def library_info(library_path):
+    try:
+        with open(Path(library_path).joinpath("library.json")) as description:
+            info = json.load(description)
+    except FileNotFoundError:
+        raise ReferenceLibraryError(
+            "{} is not a complete reference library.".format(library_path)
+        )
+
+    if info["version"] != library_version:
+        raise ReferenceLibraryError(
+            "{} was built with another version of boldigger2, please build it again.".format(
+                library_path
+            )
+        )
+
+    return info
+
+
+# function to open the arrays of a reference library, they are memory mapped and shared by all queries of a process
+@functools.lru_cache(maxsize=None)
+def open_library(library_path):
+    library_path = Path(library_path)
+    info = library_info(library_path)
+
+    library = {
+        name: np.load(library_path.joinpath("{}.npy".format(name)), mmap_mode="r")
+        for name in [
+            "kmers",
+            "kmer_references",
+            "kmer_positions",
+            "sequences",
+            "sequence_offsets",
+            "species_records",
+        ]
+    }
+    library["kmer_size"] = info["kmer_size"]
+
+    return library
+
+
+# function to return the candidates of a query with the diagonals they are scored on
+# the seeds of a diagonal are the k-mers query and reference share at the same offset
+# returns the references, the best and the second best diagonal and the seeds of the best diagonal
+def candidates(library, query, species_only):
+    kmers, _, positions = kmer_codes(
+        query, np.array([0, len(query)]), library["kmer_size"]
+    )
+
+    lower = np.searchsorted(library["kmers"], kmers, side="left")
+    upper = np.searchsorted(library["kmers"], kmers, side="right")
+    counts = upper - lower
+    total = counts.sum()
+
+    if not total:
+        return np.array([], dtype=np.int64), None, None, None
+
+    # index of every posting of the query k-mers
+    postings = np.repeat(lower - np.cumsum(counts) + counts, counts) + np.arange(total)
+    references = library["kmer_references"][postings].astype(np.int64)
+    diagonals = (
+        np.repeat(positions.astype(np.int64), counts)
+        - library["kmer_positions"][postings]
+    )
+
+    if species_only:
+        species = library["species_records"][references]
+        references, diagonals = references[species], diagonals[species]
+
+        if not len(references):
+            return references, None, None, None
+
+    # count the seeds per reference and diagonal
+    keys, seeds = np.unique(
+        references * (2 * max_position) + diagonals + max_position, return_counts=True
+    )
+    references = keys // (2 * max_position)
+    diagonals = keys % (2 * max_position) - max_position
+
+    # best diagonals first within every reference
+    order = np.lexsort((-seeds, references))
+    references, diagonals, seeds = references[order], diagonals[order], seeds[order]
+    first = np.flatnonzero(np.r_[True, references[1:] != references[:-1]])
+
+    # the second best diagonal is only used if it is close to the best one and has more than one seed
+    second = np.minimum(first + 1, len(references) - 1)
+    second_diagonals = np.where(
+        (references[second] == references[first])
+        & (second != first)
+        & (seeds[second] > 1)
+        & (np.abs(diagonals[second] - diagonals[first]) <= max_indel),
+        diagonals[second],
+        diagonals[first],
+    )
+
+    # keep the references with the most seeds on their best diagonal
+    best = np.argsort(-seeds[first], kind="stable")[:candidates_per_query]
+
+    return (
+        references[first][best],
+        diagonals[first][best],
+        second_diagonals[best],
+        seeds[first][best],
+    )
+
+
+# function to compare the query with all candidates on one diagonal at once
+# returns the overlap and the matches along the query, one row per candidate
+def diagonal_matches(library, query, references, diagonals):
+    starts = library["sequence_offsets"][references]
+    lengths = library["sequence_offsets"][references + 1] - starts
+
+    reference_positions = np.arange(len(query))[None, :] - diagonals[:, None]
+    overlap = (reference_positions >= 0) & (reference_positions < lengths[:, None])
+    bases = library["sequences"][
+        starts[:, None]
+        + np.minimum(np.maximum(reference_positions, 0), lengths[:, None] - 1)
+    ]
+
+    return overlap, overlap & (bases == query[None, :]) & (query[None, :] < 4)
+
+
+# function to compute the identity of candidates that are aligned on two diagonals
+# the query is aligned on one diagonal up to a breakpoint and on the other one after it,
+# the best breakpoint and order is used and the bases between the diagonals are counted as gap
+def split_identity(library, query, references, first, second):
+    cumulative = []
+
+    for diagonals in [first, second]:
+        overlap, matches = diagonal_matches(library, query, references, diagonals)
+        zeros = np.zeros((len(references), 1), dtype=np.int32)
+        cumulative.append(
+            (
+                np.concatenate(
+                    (zeros, np.cumsum(overlap, axis=1, dtype=np.int32)), axis=1
+                ),
+                np.concatenate(
+                    (zeros, np.cumsum(matches, axis=1, dtype=np.int32)), axis=1
+                ),
+            )
+        )
+
+    # no gap if the breakpoint is at either end of the query
+    gap = (
+        np.abs(first - second)[:, None] * np.r_[0, np.ones(len(query) - 1), 0][None, :]
+    )
+    identity = np.zeros(len(references))
+
+    for (overlap_start, matches_start), (overlap_end, matches_end) in [
+        cumulative,
+        cumulative[::-1],
+    ]:
+        overlap = overlap_start + (overlap_end[:, -1:] - overlap_end)
+        matches = matches_start + (matches_end[:, -1:] - matches_end)
+        split = np.where(
+            overlap >= min_overlap, matches / np.maximum(overlap + gap, 1), 0
+        )
+        identity = np.maximum(identity, split.max(axis=1))
+
+    return identity
+
+
+# function to search one sequence in the reference library
+# the similarity is the identity over the overlap of query and reference on the best diagonal,
+# or on two diagonals if that allows for an indel
+# returns the references and similarities of the hits, best hits first
+def search_sequence(library, sequence, species_only):
+    query = encode(sequence)
+    references, first, second, seeds = candidates(library, query, species_only)
+
+    if not len(references):
+        return references, np.array([], dtype=np.float64)
+
+    overlap, matches = diagonal_matches(library, query, references, first)
+    overlap, matches = overlap.sum(axis=1), matches.sum(axis=1)
+    identity = np.where(overlap >= min_overlap, matches / np.maximum(overlap, 1), 0)
+
+    # only candidates with a second diagonal are aligned again
+    shifted = np.flatnonzero(first != second)
+    if len(shifted):
+        identity[shifted] = np.maximum(
+            identity[shifted],
+            split_identity(
+                library, query, references[shifted], first[shifted], second[shifted]
+            ),
+        )
+
+    similarities = np.round(identity * 100, 2)
+
+    # best similarity first, more seeds first for equal similarities
+    keep = similarities >= min_similarity
+    order = np.lexsort((-seeds[keep], -similarities[keep]))[:max_hits]
+
+    return references[keep][order], similarities[keep][order]
+
+
+# function to search a batch of sequences, runs in the worker processes
+def search_batch(library_path, queries, species_only):
+    library = open_library(library_path)
+
+    return [
+        (id, *search_sequence(library, sequence, species_only))
+        for id, sequence in queries
+    ]
+
+
+# function to turn the search results into the rows of the top 100 hits
+def hit_table(records, results, database):
+    columns = ["ID"] + list(taxonomy_columns) + ["Similarity", "Status", "Process_ID"]
+    found = [result for result in results if len(result[1])]
+    not_found = [id for id, references, _ in results if not len(references)]
+    tables = []
+
+    if found:
+        ids, references, similarities = zip(*found)
+        hits = records.iloc[np.concatenate(references)].reset_index(drop=True)
+        hits["ID"] = np.repeat(
+            ids, [len(hit_references) for hit_references in references]
+        )
+        hits["Similarity"] = np.concatenate(similarities)
+        # only published records have a process id in the results of BOLD
+        hits["Process_ID"] = hits["processid"].where(hits["Status"] == "Published", "")
+        tables.append(hits[columns])
+
+    # code to generate the no match table
+    if not_found:
+        tables.append(
+            pd.DataFrame(
+                [[id] + ["NoMatch"] * 7 + [0.0] + [""] * 2 for id in not_found],
+                columns=columns,
+            )
+        )
+
+    hits = pd.concat(tables, axis=0).reset_index(drop=True)
+
+    # add the database and a timestamp to the result table
+    hits["database"] = database
+    hits["request_date"] = pd.Timestamp.now().strftime("%Y-%m-%d %X")
+
+    return hits
+
+
+# function to append the hits of a batch to the hdf storage and the journal, like a download from BOLD
+def save_hits(hits, hdf_name_top_100_hits, database):
+    if isinstance(hdf_name_top_100_hits, in_memory.Project):
+        hdf_name_top_100_hits.add_hits(hits)
+        return
+
+    with metrics.hdf_append("top_100_hits_unsorted", len(hits.index)), pd.HDFStore(
+        hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        hdf_output.append(
+            "top_100_hits_unsorted",
+            hits,
+            format="t",
+            data_columns=True,
+            min_itemsize=additional_data_download.hit_item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+        )
+        nrows = hdf_output.get_storer("top_100_hits_unsorted").nrows
+
+    journal.record(
+        hdf_name_top_100_hits,
+        "parsed",
+        key="top_100_hits_unsorted",
+        nrows=nrows,
+        ids=hits["ID"].unique(),
+        database=database,
+    )
+    id_summary.save(hdf_name_top_100_hits, id_summary.summarize(hits))
+
+
+# function to store the additional data of the hits from the library, so it does not have to be downloaded
+def save_additional_data(records, hits, hdf_name_top_100_hits, known_process_ids):
+    process_ids = hits.loc[hits["Process_ID"] != "", "Process_ID"].unique()
+    process_ids = [id for id in process_ids if id not in known_process_ids]
+
+    if not process_ids:
+        return
+
+    additional_data = (
+        records.set_index("processid", drop=False)
+        .loc[process_ids, additional_data_download.additional_data_columns]
+        .reset_index(drop=True)
+    )
+    known_process_ids.update(process_ids)
+
+    if isinstance(hdf_name_top_100_hits, in_memory.Project):
+        hdf_name_top_100_hits.add_additional_data(additional_data, process_ids)
+        return
+
+    with metrics.hdf_append("additional_data", len(additional_data.index)), pd.HDFStore(
+        hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+    ) as hdf_output:
+        hdf_output.append(
+            "additional_data",
+            additional_data,
+            format="t",
+            data_columns=True,
+            min_itemsize=additional_data_download.additional_data_item_sizes,
+            complib="blosc:blosclz",
+            complevel=9,
+        )
+        nrows = hdf_output.get_storer("additional_data").nrows
+
+    journal.record(
+        hdf_name_top_100_hits,
+        "metadata",
+        key="additional_data",
+        nrows=nrows,
+        ids=process_ids,
+    )
+
+
+# function to search all sequences of a fasta dict in one database of the reference library
+# the species database only contains references with a species name, all records contains all references
+# the hits are written to the top 100 hits like the results of BOLD, so all following steps work unchanged
+def search(library_path, fasta_dict, hdf_name_top_100_hits, database, workers=None):
+    if not fasta_dict:
+        return
+
+    info = library_info(library_path)
+    records = pd.read_parquet(Path(library_path).joinpath("records.parquet"))
+    workers = workers or os.cpu_count() or 1
+
+    # the additional data of process ids that are already in the storage is not stored again
+    if isinstance(hdf_name_top_100_hits, in_memory.Project):
+        known_process_ids = set(hdf_name_top_100_hits.process_ids)
+    else:
+        state = journal.load_state(hdf_name_top_100_hits)
+        known_process_ids = (
+            set(journal.ids_in_stage(state, "metadata")) if state is not None else set()
+        )
+
+    # give user output
+    messages.write(
+        "{}: Searching {} sequences in the {} database of the reference library with {} workers.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(fasta_dict),
+            database,
+            workers,
+        )
+    )
+
+    start = time.perf_counter()
+
+    with tqdm(
+        total=len(fasta_dict),
+        desc="Searching reference library",
+        disable=not messages.enabled,
+    ) as progress_bar, Parallel(n_jobs=workers) as parallel:
+        for id_batch in more_itertools.chunked(fasta_dict.keys(), queries_per_write):
+            results = parallel(
+                delayed(profiling.profiled(search_batch, "local_search_worker"))(
+                    str(library_path),
+                    [(id, str(fasta_dict[id].seq)) for id in task],
+                    database == "species",
+                )
+                for task in more_itertools.chunked(id_batch, queries_per_task)
+            )
+
+            hits = hit_table(
+                records, [result for task in results for result in task], database
+            )
+            save_hits(hits, hdf_name_top_100_hits, database)
+
+            if info["additional_data"]:
+                save_additional_data(
+                    records, hits, hdf_name_top_100_hits, known_process_ids
+                )
+
+            progress_bar.update(len(id_batch))
+
+    duration = time.perf_counter() - start
+
+    # give user output
+    messages.write(
+        "{}: Searched {} sequences in {:.1f} s ({:.1f} queries per second).".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(fasta_dict),
+            duration,
+            len(fasta_dict) / max(duration, 1e-9),
+        )
+    )
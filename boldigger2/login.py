@@ -1,18 +1,17 @@
-import requests_html, getpass, datetime, sys
+import requests, requests_html, getpass, datetime, sys, os, json, time, hashlib
+from pathlib import Path
+from requests.exceptions import RequestException
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup as BSoup
+from boldigger2 import urls, metrics, messages
+from boldigger2.exceptions import LoginError
 
+# cached login cookies are reused for this many seconds at most
+session_max_age = 24 * 60 * 60
 
-# function to log in to the BOLD databases, is needed to run the identification engine with >1 sequences
-def bold_login(username="", password=""):
-    # give user output
-    print("{}: Trying to log in.".format(datetime.datetime.now().strftime("%H:%M:%S")))
-    # ask for the password and username in a safe way only if it is not prvided via the input
-    if not username:
-        username = input("BOLD username: ")
-        password = getpass.getpass("BOLD password: ")
 
+# function to create a new html session with headers and retry strategy
+def new_session():
     # start a new html session
     session = requests_html.HTMLSession()
     # update the header of the session
@@ -31,6 +30,170 @@ def bold_login(username="", password=""):
     adapter = HTTPAdapter(max_retries=retry_strategy)
     # mount the adapter to the session
     session.mount("https://", adapter)
+    # record all requests of the session
+    metrics.instrument_session(session)
+
+    return session
+
+
+# function to return the directory the login cookies are cached in
+# can be changed via the BOLDIGGER2_CACHE_DIR environment variable
+def cache_directory():
+    if os.environ.get("BOLDIGGER2_CACHE_DIR"):
+        return Path(os.environ["BOLDIGGER2_CACHE_DIR"])
+    elif os.environ.get("XDG_CACHE_HOME"):
+        return Path(os.environ["XDG_CACHE_HOME"]).joinpath("boldigger2")
+    else:
+        return Path.home().joinpath(".cache", "boldigger2")
+
+
+# function to return the cookie cache file of a user
+# the file name is a hash of server and username, so the username is not stored in clear text
+def cookie_cache_path(username):
+    user_hash = hashlib.sha256("{}|{}".format(urls.v4_url, username).encode())
+
+    return cache_directory().joinpath("session_{}.json".format(user_hash.hexdigest()))
+
+
+# function to save the cookies of a logged in session, only readable by the current user
+def save_cookies(session, username):
+    directory = cache_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    os.chmod(directory, 0o700)
+
+    cookies = [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+            "secure": cookie.secure,
+        }
+        for cookie in session.cookies
+    ]
+
+    savename = cookie_cache_path(username)
+    file_descriptor = os.open(
+        "{}.tmp".format(savename), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+    )
+    with os.fdopen(file_descriptor, "w") as output:
+        json.dump({"saved": time.time(), "cookies": cookies}, output)
+    os.replace("{}.tmp".format(savename), savename)
+
+
+# function to load cached cookies into a session
+# returns False if there are no cookies or they are expired
+def load_cookies(session, username):
+    try:
+        with open(cookie_cache_path(username)) as cache:
+            cached = json.load(cache)
+    except (OSError, ValueError):
+        return False
+
+    if time.time() - cached.get("saved", 0) > session_max_age:
+        return False
+
+    cookies = [
+        cookie
+        for cookie in cached.get("cookies", [])
+        if not cookie["expires"] or cookie["expires"] > time.time()
+    ]
+
+    if not cookies:
+        return False
+
+    for cookie in cookies:
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie["domain"],
+            path=cookie["path"],
+            expires=cookie["expires"],
+            secure=cookie["secure"],
+        )
+
+    return True
+
+
+# function to remove the cached cookies of a user, e.g. after they stopped working
+def remove_cookies(username):
+    try:
+        cookie_cache_path(username).unlink()
+    except FileNotFoundError:
+        pass
+
+
+# function to return a session without retries that shares headers and cookies with a session
+# a logged out or failing probe returns at once instead of backing off through the retry strategy
+def probe_session(session):
+    probe = requests.Session()
+    probe.headers.update(session.headers)
+    probe.cookies = session.cookies
+    metrics.instrument_session(probe)
+
+    return probe
+
+
+# function to check if a session is logged in
+# requests the user console without following redirects, logged out sessions are redirected to the login page
+# the page is streamed and only read until the logout link in its header is found
+def probe_login(session):
+    try:
+        with probe_session(session).get(
+            "{}/index.php/MAS_Management_UserConsole".format(urls.v4_url),
+            allow_redirects=False,
+            timeout=60,
+            stream=True,
+        ) as response:
+            if response.status_code != 200:
+                return False
+
+            # keep the end of the previous chunk, the link may be split between two chunks
+            tail = b""
+            for chunk in response.iter_content(chunk_size=8192):
+                if b"Log out" in tail + chunk:
+                    return True
+                tail = chunk[-len(b"Log out") :]
+
+            return False
+    except RequestException:
+        return False
+
+
+# function to log in to the BOLD databases, is needed to run the identification engine with >1 sequences
+# cached cookies of a previous login are reused until they expire
+# if interactive is False missing credentials and failed logins raise a LoginError instead of prompting or exiting
+def bold_login(username="", password="", interactive=True):
+    # give user output
+    messages.write(
+        "{}: Trying to log in.".format(datetime.datetime.now().strftime("%H:%M:%S"))
+    )
+    # ask for the username in a safe way only if it is not prvided via the input
+    if not username and not interactive:
+        raise LoginError("No BOLD username provided.")
+    elif not username:
+        username = input("BOLD username: ")
+
+    session = new_session()
+
+    # reuse the cookies of a previous login if they are still valid
+    with metrics.stage("login"):
+        if load_cookies(session, username) and probe_login(session):
+            messages.write(
+                "{}: Reusing login session.".format(
+                    datetime.datetime.now().strftime("%H:%M:%S")
+                )
+            )
+            return session, username, password
+
+    # the password is only needed if there is no valid session
+    if not password and not interactive:
+        raise LoginError("No BOLD password provided and no valid login session cached.")
+    elif not password:
+        password = getpass.getpass("BOLD password: ")
+
+    session = new_session()
 
     # perform the post request to log in with this data
     data = {
@@ -40,32 +203,49 @@ def bold_login(username="", password=""):
         "loginType": "",
     }
 
-    # send the post request to boldsystems.org
-    session.post("https://v4.boldsystems.org/index.php/Login", data=data)
+    with metrics.stage("login"):
+        # send the post request to boldsystems.org
+        session.post("{}/index.php/Login".format(urls.v4_url), data=data)
 
-    # test if the login was successfull
-    bold_url = session.get("https://v4.boldsystems.org")
+        # test if the login was successfull
+        logged_in = probe_login(session)
 
-    # parse the returned html
-    soup = BSoup(bold_url.text, "html.parser")
-    # look for the navigation bar
-    navigation_bar = soup.find(class_="site-navigation nav navbar-nav")
-    # find the text on the navigation bar
-    text_fields = [field.text for field in navigation_bar.find_all("a")]
-    if text_fields[5] != "Log out":
-        print(
+    if not logged_in and not interactive:
+        raise LoginError("Unable to log in. Please check username and password.")
+    elif not logged_in:
+        messages.write(
             "{}: Unable to log in.\nPlease check username and password.".format(
                 datetime.datetime.now().strftime("%H:%M:%S")
             )
         )
         sys.exit()
     else:
-        print(
+        messages.write(
             "{}: Login successful.".format(datetime.datetime.now().strftime("%H:%M:%S"))
         )
+        save_cookies(session, username)
         # return the session if the login was successful to handle the requests
         return session, username, password
 
 
+# function to make sure a session is still logged in, only logs in again if the session is not valid anymore
+# runs that started with cached cookies have no password, they stop with a LoginError instead of prompting mid-run
+def ensure_login(session, username="", password="", interactive=True):
+    with metrics.stage("login"):
+        logged_in = probe_login(session)
+
+    if logged_in:
+        return session, username, password
+
+    remove_cookies(username)
+
+    if not password:
+        raise LoginError(
+            "The BOLD login session expired and no password is available to log in again. Please start the run again, it continues where it stopped."
+        )
+
+    return bold_login(username=username, password=password, interactive=interactive)
+
+
 if __name__ == "__main__":
     bold_login()
@@ -0,0 +1,22 @@
+from tqdm import tqdm
+
+# user output is printed until disable is called, the api identifies sequences without printing anything
+enabled = True
+
+
+# function to enable the user output and the progress bars
+def enable():
+    global enabled
+    enabled = True
+
+
+# function to disable the user output and the progress bars
+def disable():
+    global enabled
+    enabled = False
+
+
+# function to print a line of user output, running progress bars are kept below it
+def write(message):
+    if enabled:
+        tqdm.write(message)
@@ -0,0 +1,292 @@
+import datetime, json, os, sys, threading, time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from boldigger2 import profiling, tracing
+
+# resource only exists on posix systems, the peak memory is reported as unavailable elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# upper bounds of the request latency histogram in seconds
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# minimum number of seconds between two updates of the prometheus textfile
+textfile_interval = 10
+
+# the metrics of the current run, requests are recorded from several threads
+lock = threading.Lock()
+run_start = time.time()
+stages = {}
+endpoints = {}
+hdf_appends = {}
+textfile = None
+textfile_written = 0
+
+
+# function to start collecting metrics for a new run
+# if a textfile is given, the metrics are also written in prometheus format while the run is going
+def reset(textfile_path=None):
+    global run_start, stages, endpoints, hdf_appends, textfile, textfile_written
+
+    with lock:
+        run_start = time.time()
+        stages, endpoints, hdf_appends = {}, {}, {}
+        textfile = textfile_path
+        textfile_written = 0
+
+
+# context manager to measure the wall and cpu time of a pipeline stage
+# stages that run several times (e.g. once per batch) are summed up
+# if profiling is enabled, the stage is also profiled
+@contextmanager
+def stage(name):
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+
+    try:
+        with profiling.stage(name), tracing.span(name, "stage"):
+            yield
+    finally:
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+
+        with lock:
+            stage_metrics = stages.setdefault(
+                name, {"calls": 0, "wall_time_s": 0.0, "cpu_time_s": 0.0}
+            )
+            stage_metrics["calls"] += 1
+            stage_metrics["wall_time_s"] += wall_time
+            stage_metrics["cpu_time_s"] += cpu_time
+
+        write_textfile(force=True)
+
+
+# function to get the metrics of an endpoint, the endpoint is the path of the url
+def endpoint_metrics(url):
+    endpoint = urlparse(url).path or "/"
+
+    return endpoints.setdefault(
+        endpoint,
+        {
+            "requests": 0,
+            "bytes": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "status_codes": {},
+            "latency_sum_s": 0.0,
+            "latency_max_s": 0.0,
+            "latency_buckets": [0] * (len(latency_buckets) + 1),
+        },
+    )
+
+
+# function to record a finished request
+def record_request(url, latency, n_bytes, status_code, retries=0):
+    with lock:
+        metrics = endpoint_metrics(url)
+        metrics["requests"] += 1
+        metrics["bytes"] += n_bytes
+        metrics["retries"] += retries
+        metrics["latency_sum_s"] += latency
+        metrics["latency_max_s"] = max(metrics["latency_max_s"], latency)
+        status_code = str(status_code)
+        metrics["status_codes"][status_code] = (
+            metrics["status_codes"].get(status_code, 0) + 1
+        )
+
+        # find the first bucket the latency fits in, the last bucket is +Inf
+        bucket = len(latency_buckets)
+        for idx, upper_bound in enumerate(latency_buckets):
+            if latency <= upper_bound:
+                bucket = idx
+                break
+        metrics["latency_buckets"][bucket] += 1
+
+    write_textfile()
+
+
+# function to record a request that timed out
+def record_timeout(url):
+    with lock:
+        endpoint_metrics(url)["timeouts"] += 1
+
+
+# function to record a request that is repeated by boldigger2
+def record_retry(url):
+    with lock:
+        endpoint_metrics(url)["retries"] += 1
+
+
+# response hook for requests sessions, records every response
+def response_hook(response, *args, **kwargs):
+    # retries performed by urllib3 are stored in the history of the retry object
+    try:
+        retries = len(response.raw.retries.history)
+    except AttributeError:
+        retries = 0
+
+    record_request(
+        response.url,
+        response.elapsed.total_seconds(),
+        len(response.content),
+        response.status_code,
+        retries,
+    )
+
+
+# function to record all requests of a session
+def instrument_session(session):
+    session.hooks["response"].append(response_hook)
+
+    return session
+
+
+# context manager to measure an append to the hdf storage
+@contextmanager
+def hdf_append(key, rows):
+    start = time.perf_counter()
+
+    try:
+        with tracing.span("append {}".format(key), "hdf", rows=rows):
+            yield
+    finally:
+        duration = time.perf_counter() - start
+
+        with lock:
+            append_metrics = hdf_appends.setdefault(
+                key, {"appends": 0, "rows": 0, "duration_s": 0.0}
+            )
+            append_metrics["appends"] += 1
+            append_metrics["rows"] += rows
+            append_metrics["duration_s"] += duration
+
+
+# function to return the peak resident set size of the process in bytes
+# returns None on systems without the resource module, e.g. windows
+def peak_rss():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on linux
+    if sys.platform == "darwin":
+        return peak
+    else:
+        return peak * 1024
+
+
+# function to collect all metrics in a dict
+def summary():
+    with lock:
+        return {
+            "run_start": datetime.datetime.fromtimestamp(run_start).isoformat(
+                timespec="seconds"
+            ),
+            "run_time_s": time.time() - run_start,
+            "peak_rss_bytes": peak_rss(),
+            "stages": json.loads(json.dumps(stages)),
+            "endpoints": json.loads(json.dumps(endpoints)),
+            "hdf_appends": json.loads(json.dumps(hdf_appends)),
+            "latency_buckets_s": latency_buckets,
+        }
+
+
+# function to write the summary of the run to a json file
+def write_summary(savename):
+    with open(savename, "w") as output:
+        json.dump(summary(), output, indent=2)
+
+
+# function to format the metrics in the prometheus text format
+def prometheus_text(metrics):
+    lines = [
+        "# TYPE boldigger2_run_seconds gauge",
+        "boldigger2_run_seconds {:.3f}".format(metrics["run_time_s"]),
+    ]
+
+    # the peak memory is left out where it cannot be measured
+    if metrics["peak_rss_bytes"] is not None:
+        lines += [
+            "# TYPE boldigger2_peak_rss_bytes gauge",
+            "boldigger2_peak_rss_bytes {}".format(metrics["peak_rss_bytes"]),
+        ]
+
+    lines += [
+        "# TYPE boldigger2_stage_wall_seconds counter",
+        "# TYPE boldigger2_stage_cpu_seconds counter",
+    ]
+
+    for name, values in metrics["stages"].items():
+        lines.append(
+            'boldigger2_stage_wall_seconds{{stage="{}"}} {:.3f}'.format(
+                name, values["wall_time_s"]
+            )
+        )
+        lines.append(
+            'boldigger2_stage_cpu_seconds{{stage="{}"}} {:.3f}'.format(
+                name, values["cpu_time_s"]
+            )
+        )
+
+    lines.append("# TYPE boldigger2_http_request_duration_seconds histogram")
+    for endpoint, values in metrics["endpoints"].items():
+        label = 'endpoint="{}"'.format(endpoint)
+        cumulative = 0
+        for upper_bound, count in zip(
+            latency_buckets + ["+Inf"], values["latency_buckets"]
+        ):
+            cumulative += count
+            lines.append(
+                'boldigger2_http_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+                    label, upper_bound, cumulative
+                )
+            )
+        lines.append(
+            "boldigger2_http_request_duration_seconds_sum{{{}}} {:.3f}".format(
+                label, values["latency_sum_s"]
+            )
+        )
+        lines.append(
+            "boldigger2_http_request_duration_seconds_count{{{}}} {}".format(
+                label, values["requests"]
+            )
+        )
+        for name in ["bytes", "retries", "timeouts"]:
+            lines.append(
+                "boldigger2_http_{}_total{{{}}} {}".format(name, label, values[name])
+            )
+
+    for key, values in metrics["hdf_appends"].items():
+        label = 'key="{}"'.format(key)
+        lines.append(
+            "boldigger2_hdf_appends_total{{{}}} {}".format(label, values["appends"])
+        )
+        lines.append("boldigger2_hdf_rows_total{{{}}} {}".format(label, values["rows"]))
+        lines.append(
+            "boldigger2_hdf_append_seconds_total{{{}}} {:.3f}".format(
+                label, values["duration_s"]
+            )
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+# function to update the prometheus textfile, only writes every textfile_interval seconds if not forced
+def write_textfile(force=False):
+    global textfile_written
+
+    if not textfile:
+        return
+
+    with lock:
+        if not force and time.time() - textfile_written < textfile_interval:
+            return
+        textfile_written = time.time()
+
+    # write to a temporary file first, so the collector never reads a partial file
+    temporary_savename = "{}.tmp".format(textfile)
+    with open(temporary_savename, "w") as output:
+        output.write(prometheus_text(summary()))
+    os.replace(temporary_savename, textfile)
@@ -0,0 +1,207 @@
+import cProfile, datetime, io, os, pstats, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from boldigger2 import messages
+
+# use the sampling profiler pyinstrument if it is installed, cProfile otherwise
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# number of functions per stage in the text summary
+summary_functions = 15
+
+# profiling is disabled until a profile directory is set
+profile_directory = None
+lock = threading.Lock()
+# stage name -> number of profiles written for this stage in this process
+profile_counts = {}
+# only one profiler can be active at a time, nested stages are part of the outer profile
+active_stage = None
+# stage name -> list of (time waiting for the semaphore, time running) of asyncio tasks
+task_timings = {}
+
+
+# function to enable profiling, all profiles are written to the given directory
+# profiles of earlier runs are removed, so the summary only covers this run
+def enable(directory):
+    global profile_directory, profile_counts, task_timings
+
+    profile_directory = Path(directory)
+    profile_directory.mkdir(parents=True, exist_ok=True)
+    profile_counts, task_timings = {}, {}
+
+    for profile in profile_directory.iterdir():
+        if profile.suffix in [".prof", ".txt"]:
+            profile.unlink()
+
+
+# function to disable profiling, stages of later runs in the same process are not profiled anymore
+def disable():
+    global profile_directory
+
+    profile_directory = None
+
+
+# function to generate a unique savename for a profile of a stage
+def profile_savename(directory, stage_name, suffix):
+    with lock:
+        count = profile_counts.get(stage_name, 0)
+        profile_counts[stage_name] = count + 1
+
+    return Path(directory).joinpath(
+        "{}_{}_{}.{}".format(stage_name, os.getpid(), count, suffix)
+    )
+
+
+# context manager to profile a stage, does nothing if profiling is disabled
+# the stage is profiled with cProfile, or with pyinstrument if available
+@contextmanager
+def stage(stage_name, directory=None):
+    global active_stage
+
+    directory = directory or profile_directory
+
+    # profiles can only be collected in the main thread and not nested
+    if (
+        directory is None
+        or active_stage is not None
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    active_stage = stage_name
+
+    if pyinstrument is not None:
+        profiler = pyinstrument.Profiler(async_mode="enabled")
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if pyinstrument is not None:
+            profiler.stop()
+            with open(profile_savename(directory, stage_name, "txt"), "w") as output:
+                output.write(profiler.output_text(unicode=False, color=False))
+        else:
+            profiler.disable()
+            profiler.dump_stats(profile_savename(directory, stage_name, "prof"))
+
+        active_stage = None
+
+
+# wrapper to profile functions that run in parallel worker processes
+# the profile directory is passed along, since workers do not share the state of the main process
+class ProfiledCall:
+    def __init__(self, function, stage_name, directory):
+        self.function = function
+        self.stage_name = stage_name
+        self.directory = directory
+
+    def __call__(self, *args, **kwargs):
+        with stage(self.stage_name, self.directory):
+            return self.function(*args, **kwargs)
+
+
+# function to wrap a function for a parallel worker, returns the function itself if profiling is disabled
+def profiled(function, stage_name):
+    if profile_directory is None:
+        return function
+    else:
+        return ProfiledCall(function, stage_name, profile_directory)
+
+
+# function to record the timing of an asyncio task
+def record_task(stage_name, wait_time, run_time):
+    if profile_directory is None:
+        return
+
+    with lock:
+        task_timings.setdefault(stage_name, []).append((wait_time, run_time))
+
+
+# context manager to time an asyncio task that is limited by a semaphore
+@contextmanager
+def task_timer(stage_name, queued_at):
+    started_at = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record_task(
+            stage_name, started_at - queued_at, time.perf_counter() - started_at
+        )
+
+
+# function to format the timings of the asyncio tasks
+def task_summary():
+    lines = []
+
+    for stage_name, timings in task_timings.items():
+        wait_times = sorted(timing[0] for timing in timings)
+        run_times = sorted(timing[1] for timing in timings)
+        lines.append(
+            "{}: {} tasks, run time mean {:.3f} s, p95 {:.3f} s, max {:.3f} s, "
+            "semaphore wait mean {:.3f} s, max {:.3f} s".format(
+                stage_name,
+                len(timings),
+                sum(run_times) / len(run_times),
+                run_times[int(0.95 * (len(run_times) - 1))],
+                run_times[-1],
+                sum(wait_times) / len(wait_times),
+                wait_times[-1],
+            )
+        )
+
+    return lines
+
+
+# function to write a short text summary of the top hot functions per stage
+# profiles of the main process and the workers are combined per stage
+def write_summary():
+    if profile_directory is None:
+        return
+
+    lines = [
+        "BOLDigger2 profile summary, {}".format(
+            datetime.datetime.now().strftime("%Y-%m-%d %X")
+        ),
+        "",
+    ]
+
+    # group all cProfile dumps by stage
+    dumps = {}
+    for dump in sorted(profile_directory.glob("*.prof")):
+        stage_name = dump.stem.rsplit("_", 2)[0]
+        dumps.setdefault(stage_name, []).append(str(dump))
+
+    for stage_name, stage_dumps in dumps.items():
+        stream = io.StringIO()
+        stats = pstats.Stats(*stage_dumps, stream=stream)
+        stats.sort_stats("tottime").print_stats(summary_functions)
+        lines.append("=== {} ({} profiles) ===".format(stage_name, len(stage_dumps)))
+        lines.append(stream.getvalue())
+
+    # pyinstrument writes text reports, point to them
+    for report in sorted(profile_directory.glob("*.txt")):
+        if report.name != "summary.txt":
+            lines.append("Sampling profile: {}".format(report.name))
+
+    if task_timings:
+        lines.append("")
+        lines.append("=== asyncio tasks ===")
+        lines.extend(task_summary())
+
+    with open(profile_directory.joinpath("summary.txt"), "w") as output:
+        output.write("\n".join(lines) + "\n")
+
+    messages.write(
+        "{}: Profiles saved to {}.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"), profile_directory
+        )
+    )
@@ -0,0 +1,292 @@
+import datetime, json, random, threading, time, requests
+from concurrent.futures import ThreadPoolExecutor
+from fp.fp import FreeProxy
+from fp.errors import FreeProxyException
+from boldigger2 import messages
+
+# number of validated proxies the pool tries to keep available
+target_size = 4
+
+# seconds a candidate may need to answer the validation request
+validation_timeout = 15
+
+# number of candidates that are validated at the same time
+validation_workers = 8
+
+# proxies are evicted after this many failures in a row or if less than half of their requests succeed
+max_consecutive_failures = 3
+min_success_rate = 0.5
+min_attempts = 5
+
+# seconds a connection is not used after the api reported an overload
+cooldown = 60
+
+# seconds to wait before asking the candidate source again if it returned no new candidates
+refill_wait = 60
+
+
+# candidate source that scrapes public proxy lists with free-proxy
+def free_proxy_source():
+    try:
+        candidates = FreeProxy(https=True).get_proxy_list(repeat=False)
+    except FreeProxyException:
+        return []
+
+    random.shuffle(candidates)
+
+    return ["http://{}".format(candidate) for candidate in candidates]
+
+
+# function to create a candidate source from a local file with one proxy per line
+# lines starting with # are ignored, proxies without scheme are treated as http proxies
+def file_proxy_source(path):
+    def source():
+        with open(path) as proxy_list:
+            candidates = [
+                line.strip()
+                for line in proxy_list
+                if line.strip() and not line.startswith("#")
+            ]
+
+        return [
+            candidate if "://" in candidate else "http://{}".format(candidate)
+            for candidate in candidates
+        ]
+
+    return source
+
+
+# function to check if a response of the specimen api is usable
+def valid_response(response):
+    if response.status_code != 200:
+        return False
+    if "You have exceeded" in response.text or "REMOTE_ADDR" in response.text:
+        return False
+
+    try:
+        return "bold_records" in json.loads(response.text)
+    except ValueError:
+        return False
+
+
+# a connection to the specimen api, either direct (empty address) or via a proxy
+class Proxy:
+    def __init__(self, address, latency=None):
+        self.address = address
+        self.latency = latency
+        self.attempts = 0
+        self.successes = 0
+        self.consecutive_failures = 0
+        self.in_use = False
+        self.blocked_until = 0
+
+    @property
+    def direct(self):
+        return not self.address
+
+    # proxies argument for requests, None uses the direct connection
+    @property
+    def requests_proxies(self):
+        if self.direct:
+            return None
+        else:
+            return {"http": self.address, "https": self.address}
+
+    # success rate with one optimistic prior attempt, so new proxies are not evicted immediately
+    @property
+    def success_rate(self):
+        return (self.successes + 1) / (self.attempts + 1)
+
+    # higher is better, fast and reliable proxies are used first
+    @property
+    def score(self):
+        return self.success_rate / (self.latency or validation_timeout)
+
+    def available(self, now):
+        return not self.in_use and self.blocked_until <= now
+
+    def record(self, success, latency=None):
+        self.attempts += 1
+
+        if success:
+            self.successes += 1
+            self.consecutive_failures = 0
+            # exponentially weighted latency
+            if latency is not None:
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else 0.7 * self.latency + 0.3 * latency
+                )
+        else:
+            self.consecutive_failures += 1
+
+    def failing(self):
+        return self.consecutive_failures >= max_consecutive_failures or (
+            self.attempts >= min_attempts and self.success_rate < min_success_rate
+        )
+
+
+# pool of validated proxies that are used concurrently for the specimen api
+# candidates are validated in a background thread ahead of time, so a fresh proxy is available
+# as soon as one fails. the direct connection is always part of the pool and only paused after failures.
+class ProxyPool:
+    def __init__(self, source=free_proxy_source, size=target_size, use_direct=True):
+        self.source = source
+        self.size = size
+        self.condition = threading.Condition()
+        # address -> validated proxy
+        self.proxies = {}
+        # all candidates that have been validated, evicted candidates are not tried again
+        self.seen = set()
+        self.direct = Proxy("") if use_direct else None
+        self.validation_url = None
+        self.refill_thread = None
+        self.closed = False
+
+    # start validating candidates in the background
+    def start(self, validation_url):
+        self.validation_url = validation_url
+        self.closed = False
+        self.refill_thread = threading.Thread(target=self.refill, daemon=True)
+        self.refill_thread.start()
+
+        return self
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # function to validate a candidate against the specimen api, returns the latency or None
+    def validate(self, address):
+        start = time.perf_counter()
+
+        try:
+            response = requests.get(
+                self.validation_url,
+                proxies={"http": address, "https": address},
+                timeout=validation_timeout,
+            )
+        except Exception:
+            return None
+
+        if valid_response(response):
+            return time.perf_counter() - start
+        else:
+            return None
+
+    # function to keep the pool filled with validated proxies, runs in a background thread
+    def refill(self):
+        while True:
+            with self.condition:
+                while not self.closed and len(self.proxies) >= self.size:
+                    self.condition.wait()
+                if self.closed:
+                    return
+
+            try:
+                candidates = [
+                    candidate
+                    for candidate in self.source()
+                    if candidate not in self.seen
+                ]
+            except Exception:
+                candidates = []
+
+            if not candidates:
+                with self.condition:
+                    self.condition.wait(refill_wait)
+                continue
+
+            self.seen.update(candidates)
+
+            with ThreadPoolExecutor(max_workers=validation_workers) as executor:
+                for address, latency in zip(
+                    candidates, executor.map(self.validate, candidates)
+                ):
+                    if latency is None:
+                        continue
+
+                    with self.condition:
+                        if self.closed or len(self.proxies) >= self.size:
+                            continue
+                        self.proxies[address] = Proxy(address, latency)
+                        self.condition.notify_all()
+
+                    messages.write(
+                        "{}: Proxy {} added to the pool ({:.2f} s).".format(
+                            datetime.datetime.now().strftime("%H:%M:%S"),
+                            address,
+                            latency,
+                        )
+                    )
+
+    # function to return the best available connection, blocks until one is available
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                connections = list(self.proxies.values())
+                if self.direct is not None:
+                    connections.append(self.direct)
+
+                available = [
+                    connection
+                    for connection in connections
+                    if connection.available(now)
+                ]
+
+                if available:
+                    # prefer the direct connection while it works, then the best scoring proxy
+                    best = max(
+                        available,
+                        key=lambda connection: (connection.direct, connection.score),
+                    )
+                    best.in_use = True
+                    return best
+
+                # wake up when a connection is released, added or its cooldown is over
+                blocked = [
+                    connection.blocked_until - now
+                    for connection in connections
+                    if not connection.in_use and connection.blocked_until > now
+                ]
+                self.condition.wait(min(blocked + [1]))
+
+    # function to give a connection back to the pool with the outcome of the request
+    # outcome is one of success, timeout, overload or broken
+    def release(self, connection, outcome, latency=None):
+        with self.condition:
+            connection.in_use = False
+            connection.record(outcome == "success", latency)
+
+            if outcome == "overload" or (
+                connection.direct and (outcome == "broken" or connection.failing())
+            ):
+                # pause connections that are rate limited, the direct connection is never evicted
+                connection.blocked_until = time.monotonic() + cooldown
+                if connection.direct:
+                    connection.consecutive_failures = 0
+            elif not connection.direct and (
+                outcome == "broken" or connection.failing()
+            ):
+                self.proxies.pop(connection.address, None)
+                messages.write(
+                    "{}: Proxy {} evicted from the pool.".format(
+                        datetime.datetime.now().strftime("%H:%M:%S"),
+                        connection.address,
+                    )
+                )
+
+            self.condition.notify_all()
+
+    # number of connections that can be used concurrently
+    def max_connections(self):
+        return self.size + (self.direct is not None)
@@ -0,0 +1,347 @@
+import datetime, hashlib, re, os
+import pandas as pd
+from pathlib import Path
+from Bio import SeqIO
+from boldigger2 import additional_data_download, digger_hit, clustering, journal
+from boldigger2 import export, metrics, id_summary, profiling, tracing
+from boldigger2 import messages
+from boldigger2.exceptions import ProjectError
+
+# name pattern of the project storage of a shard
+shard_store_pattern = re.compile(r"^(.+)_shard_(\d+)_of_(\d+)_top_100_hits\.h5\.lz$")
+
+
+# function to return the shard (1 to N) a sequence belongs to
+# the partition only depends on the id, so every node computes the same shards without coordination
+def shard_of(id, shard_count):
+    digest = hashlib.sha1(id.encode()).digest()
+
+    return int.from_bytes(digest[:8], "little") % shard_count + 1
+
+
+# function to return the project name of a shard
+def shard_name(fasta_name, shard_index, shard_count):
+    return "{}_shard_{}_of_{}".format(fasta_name, shard_index, shard_count)
+
+
+# function to write the sequences of one shard into a fasta file next to the input, in the order of the input
+# the shard is identified like any other fasta file, so all project files of the shard live next to it
+# returns the path of the shard fasta
+def write_shard(fasta_path, shard_index, shard_count, read_fasta):
+    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+    records = [
+        record
+        for id, record in fasta_dict.items()
+        if shard_of(id, shard_count) == shard_index
+    ]
+
+    savename = project_directory.joinpath(
+        "{}.fasta".format(shard_name(fasta_name, shard_index, shard_count))
+    )
+    SeqIO.write(records, "{}.tmp".format(savename), "fasta")
+    os.replace("{}.tmp".format(savename), savename)
+
+    # give user output
+    messages.write(
+        "{}: {} of {} sequences belong to shard {} of {}.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(records),
+            len(fasta_dict),
+            shard_index,
+            shard_count,
+        )
+    )
+
+    return savename
+
+
+# function to find the shard stores of a project next to its fasta file
+# returns a dict of shard index -> store, raises a ProjectError if shards are missing or belong to different partitions
+def find_shard_stores(fasta_name, project_directory, shard_stores=None):
+    if not shard_stores:
+        shard_stores = project_directory.glob(
+            "{}_shard_*_of_*_top_100_hits.h5.lz".format(fasta_name)
+        )
+
+    shards, problems = {}, []
+
+    for shard_store in map(Path, shard_stores):
+        match = shard_store_pattern.match(shard_store.name)
+
+        if not match:
+            problems.append("{} is not a shard store.".format(shard_store))
+            continue
+
+        shards.setdefault(int(match.group(3)), {})[int(match.group(2))] = shard_store
+
+    if len(shards) > 1:
+        problems.append(
+            "The shard stores belong to different partitions ({} shards).".format(
+                ", ".join(str(shard_count) for shard_count in sorted(shards))
+            )
+        )
+    elif not shards:
+        problems.append("No shard stores found for {}.".format(fasta_name))
+    else:
+        shard_count, shard_stores = shards.popitem()
+        missing = sorted(set(range(1, shard_count + 1)) - set(shard_stores))
+
+        if missing:
+            problems.append(
+                "Shards {} of {} are missing.".format(
+                    ", ".join(map(str, missing)), shard_count
+                )
+            )
+
+        # only finished shards can be merged
+        for shard_index, shard_store in sorted(shard_stores.items()):
+            if not additional_data_download.additional_data_complete(shard_store):
+                problems.append(
+                    "Shard {} of {} is not finished yet.".format(
+                        shard_index, shard_count
+                    )
+                )
+
+    if problems:
+        raise ProjectError("\n".join(problems))
+
+    return dict(sorted(shard_stores.items()))
+
+
+# function to read a table of a shard store in chunks of rows, only the checkpointed rows are read
+def read_chunks(shard_store, key, memory_budget=None):
+    nrows = journal.load_state(shard_store)["nrows"].get(key, 0)
+
+    if memory_budget:
+        rows_per_chunk = additional_data_download.chunk_rows(
+            shard_store, key, memory_budget
+        )
+    else:
+        rows_per_chunk = max(nrows, 1)
+
+    for start in range(0, nrows, rows_per_chunk):
+        yield pd.read_hdf(
+            shard_store, key=key, start=start, stop=min(start + rows_per_chunk, nrows)
+        )
+
+
+# function to append the rows of one shard to a table of the merged project
+# the rows only count once the merged checkpoint is written, an interrupted merge is cut back by journal.recover
+def append_shard_rows(hdf_name_top_100_hits, key, chunks, item_sizes):
+    nrows = None
+
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+
+        with metrics.hdf_append(key, len(chunk.index)), pd.HDFStore(
+            hdf_name_top_100_hits, mode="a", complib="blosc:blosclz", complevel=9
+        ) as hdf_output:
+            hdf_output.append(
+                key,
+                chunk,
+                format="t",
+                data_columns=True,
+                min_itemsize=item_sizes,
+                complib="blosc:blosclz",
+                complevel=9,
+            )
+            nrows = hdf_output.get_storer(key).nrows
+
+    return nrows
+
+
+# function to merge the hits of a shard into the project storage
+def merge_hits(hdf_name_top_100_hits, shard_name, shard_store, memory_budget=None):
+    parsed = {}
+
+    def chunks():
+        for chunk in read_chunks(shard_store, "top_100_hits_unsorted", memory_budget):
+            for database, ids in chunk.groupby("database")["ID"]:
+                parsed.setdefault(database, set()).update(ids)
+            yield chunk
+
+    nrows = append_shard_rows(
+        hdf_name_top_100_hits,
+        "top_100_hits_unsorted",
+        chunks(),
+        additional_data_download.hit_item_sizes,
+    )
+
+    for database, ids in parsed.items():
+        journal.record(hdf_name_top_100_hits, "parsed", ids=ids, database=database)
+
+    # every id belongs to one shard, so the summaries of the shards are simply appended
+    id_summary.save(hdf_name_top_100_hits, id_summary.load(shard_store))
+
+    journal.record(
+        hdf_name_top_100_hits,
+        "merged",
+        key="top_100_hits_unsorted" if nrows else None,
+        nrows=nrows,
+        ids=["{}:hits".format(shard_name)],
+    )
+
+
+# function to merge the additional data of a shard into the project storage
+# process ids that are already in the project storage are skipped, so every process id is stored once
+def merge_additional_data(
+    hdf_name_top_100_hits, shard_name, shard_store, memory_budget=None
+):
+    state = journal.load_state(hdf_name_top_100_hits)
+
+    # the process ids in the committed rows, ids of an interrupted merge are not trusted
+    try:
+        known_process_ids = set(
+            pd.read_hdf(
+                hdf_name_top_100_hits,
+                key="additional_data",
+                columns=["processid"],
+                stop=state["nrows"].get("additional_data", 0),
+            )["processid"]
+        )
+    except KeyError:
+        known_process_ids = set()
+
+    process_ids = set()
+
+    def chunks():
+        for chunk in read_chunks(shard_store, "additional_data", memory_budget):
+            # like in the download the last row of a process id wins
+            chunk = chunk.drop_duplicates(subset="processid", keep="last")
+            chunk = chunk.loc[~chunk["processid"].isin(known_process_ids)]
+            known_process_ids.update(chunk["processid"])
+            process_ids.update(chunk["processid"])
+            yield chunk
+
+    nrows = append_shard_rows(
+        hdf_name_top_100_hits,
+        "additional_data",
+        chunks(),
+        additional_data_download.additional_data_item_sizes,
+    )
+
+    if process_ids:
+        journal.record(hdf_name_top_100_hits, "metadata", ids=process_ids)
+
+    journal.record(
+        hdf_name_top_100_hits,
+        "merged",
+        key="additional_data" if nrows else None,
+        nrows=nrows,
+        ids=["{}:additional_data".format(shard_name)],
+    )
+
+
+# function to merge the cluster membership of all shards in the order of the fasta file
+def merge_clusters(hdf_name_top_100_hits, fasta_dict, shard_stores):
+    clusters = [clustering.load_clusters(shard_store) for shard_store in shard_stores]
+    clusters = [
+        shard_clusters for shard_clusters in clusters if shard_clusters is not None
+    ]
+
+    if clusters:
+        position = {id: idx for idx, id in enumerate(fasta_dict)}
+        clusters = pd.concat(clusters, axis=0, ignore_index=True)
+        clusters = clusters.iloc[clusters["ID"].map(position).argsort(kind="stable")]
+        clusters = clusters.reset_index(drop=True)
+    else:
+        clusters = None
+
+    clustering.save_clusters(hdf_name_top_100_hits, clusters)
+
+
+# main function to merge the shard stores of a fasta file into one project next to the fasta file
+# the merged project is ordered like the fasta file, the specimen metadata is stored once per process id
+# an interrupted merge continues with the first shard that has not been merged completely
+def merge(
+    fasta_path,
+    read_fasta,
+    shard_stores=None,
+    thresholds=[],
+    output_formats=export.default_output_formats,
+    memory_budget=None,
+    profile=False,
+):
+    # start collecting metrics for this run, merges are not traced
+    metrics.reset()
+    tracing.disable()
+
+    fasta_dict, fasta_name, project_directory = read_fasta(fasta_path)
+
+    # profile all stages if requested, profiles are saved next to the fasta file
+    if profile:
+        profiling.enable(project_directory.joinpath("{}_profile".format(fasta_name)))
+    else:
+        profiling.disable()
+    shard_stores = find_shard_stores(fasta_name, project_directory, shard_stores)
+
+    # generate a name for the top hits hdf file
+    hdf_name_top_100_hits = project_directory.joinpath(
+        "{}_top_100_hits.h5.lz".format(fasta_name)
+    )
+
+    # remove rows of writes that were interrupted in a previous run
+    state = journal.recover(hdf_name_top_100_hits)
+    merged = set() if state is None else journal.ids_in_stage(state, "merged")
+
+    # never mix the shards into a project that was identified without sharding
+    if state is not None and not merged:
+        raise ProjectError(
+            "{} was not created by merge, move it away to merge the shards.".format(
+                hdf_name_top_100_hits
+            )
+        )
+
+    # mark the project as merged before anything is written
+    if not merged:
+        journal.record(hdf_name_top_100_hits, "merged", ids=[fasta_name])
+
+    # give user output
+    messages.write(
+        "{}: Merging {} shards into {}.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            len(shard_stores),
+            hdf_name_top_100_hits.name,
+        )
+    )
+
+    with metrics.stage("merge"):
+        for shard_index, shard_store in shard_stores.items():
+            name = shard_name(fasta_name, shard_index, len(shard_stores))
+
+            if "{}:hits".format(name) not in merged:
+                merge_hits(hdf_name_top_100_hits, name, shard_store, memory_budget)
+            if "{}:additional_data".format(name) not in merged:
+                merge_additional_data(
+                    hdf_name_top_100_hits, name, shard_store, memory_budget
+                )
+
+        merge_clusters(hdf_name_top_100_hits, fasta_dict, shard_stores.values())
+
+    # order the hits like the fasta file and add the additional data, all process ids are merged already
+    additional_data_download.main(
+        fasta_path,
+        hdf_name_top_100_hits,
+        read_fasta,
+        output_formats=output_formats,
+        memory_budget=memory_budget,
+    )
+
+    # filter for the top hits
+    all_top_hits = digger_hit.main(
+        hdf_name_top_100_hits,
+        project_directory,
+        fasta_name,
+        thresholds=thresholds,
+        output_formats=output_formats,
+        memory_budget=memory_budget,
+    )
+
+    # save the metrics of the merge next to the results
+    metrics.write_summary(
+        project_directory.joinpath("{}_metrics.json".format(fasta_name))
+    )
+    profiling.write_summary()
+
+    return all_top_hits
@@ -0,0 +1,312 @@
+import datetime, os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from boldigger2 import additional_data_download, digger_hit
+from boldigger2 import metrics, journal, proxy_pool, clustering, id_summary
+from boldigger2 import messages
+
+# key of the top hits of all IDs that are final in the project storage
+final_top_hits_key = "final_top_hits"
+
+# set size limits for the columns of the final top hits
+final_item_sizes = {
+    column: size
+    for column, size in digger_hit.memo_item_sizes.items()
+    if column != "hash"
+}
+
+# schema of the online result parts, fixed so parts with only missing values in a column can be read together
+result_schema = pa.schema(
+    [
+        (column, pa.float64() if column in ["Similarity", "records"] else pa.string())
+        for column in digger_hit.top_hit_output_columns
+    ]
+)
+
+
+# function to return the directory of the online results
+# every emission adds one parquet part, the directory can be read at any time with pd.read_parquet
+def online_result_directory(project_directory, fasta_name):
+    return Path(project_directory).joinpath(
+        "{}_identification_result_online".format(fasta_name)
+    )
+
+
+# function to read the final top hits of a project, can be used while the identification is still running
+def read_final_top_hits(hdf_name_top_100_hits):
+    state = journal.load_state(hdf_name_top_100_hits)
+    nrows = 0 if state is None else state["nrows"].get(final_top_hits_key, 0)
+
+    try:
+        return pd.read_hdf(hdf_name_top_100_hits, key=final_top_hits_key, stop=nrows)
+    except (FileNotFoundError, KeyError):
+        return pd.DataFrame(columns=digger_hit.top_hit_output_columns)
+
+
+# function to order the hits of complete IDs like read_and_order does for the whole project
+# keeps the first response per ID and database, species level hits come first, then the order of the download
+def order_hits(top_100_hits):
+    first_request = top_100_hits.groupby(["ID", "database"], sort=False)[
+        "request_date"
+    ].transform("first")
+    top_100_hits = top_100_hits.loc[top_100_hits["request_date"] == first_request]
+
+    top_100_hits = top_100_hits.rename_axis("index").sort_values(
+        by=["database", "index"], ascending=[False, True]
+    )
+
+    return top_100_hits.reset_index(drop=True)
+
+
+# emits the top hit of every ID as soon as its hits and specimen data are complete
+# an ID is complete once its species level hits are parsed and, if it has no valid species level hit,
+# its all records hits are parsed as well. the specimen data of complete IDs is downloaded right away.
+# the top hits are appended to the final top hits in the project storage and written as parquet parts
+class OnlineResults:
+    def __init__(
+        self,
+        hdf_name_top_100_hits,
+        project_directory,
+        fasta_name,
+        thresholds,
+        proxy_source=None,
+    ):
+        self.hdf_name = hdf_name_top_100_hits
+        self.directory = online_result_directory(project_directory, fasta_name)
+        self.thresholds = thresholds
+        self.proxy_source = proxy_source or proxy_pool.free_proxy_source
+        self.pool = None
+        # rows of the unsorted hits and the additional data that have been read already
+        self.hits_read = 0
+        self.metadata_read = 0
+        # hits of the IDs that are not final yet and the additional data downloaded so far
+        self.pending_hits = None
+        self.metadata = pd.DataFrame(
+            columns=additional_data_download.additional_data_columns
+        )
+        # IDs without valid species level hit, they wait for the all records database
+        self.needs_all_records = set()
+        # the id summary is read incrementally, IDs parsed without a summary are summarized once here
+        id_summary.load(hdf_name_top_100_hits)
+        self.summary_read = 0
+        # summary rows of the IDs that are not final yet, only the first row per ID and database counts
+        self.pending_summary = None
+        self.summarized = set()
+        # IDs with a valid species level hit at or above the species threshold
+        self.valid_ids = set()
+        # the memo is loaded once, the top hits of every ID are computed once per run anyway
+        self.top_hit_memo = digger_hit.load_top_hit_memo(hdf_name_top_100_hits)
+        # members of a cluster are emitted together with their representative
+        self.clusters = clustering.load_clusters(hdf_name_top_100_hits)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    # function to read the rows that were checkpointed since the last update
+    def read_new_rows(self, state, key, start):
+        stop = state["nrows"].get(key, 0)
+
+        if stop <= start:
+            return None, start
+
+        rows = pd.read_hdf(self.hdf_name, key=key, start=start, stop=stop)
+        # number the rows by their position in the table, this is the order of the download
+        rows.index = pd.RangeIndex(start, stop)
+
+        return rows, stop
+
+    # function to add the summary rows that were checkpointed since the last update
+    def read_new_summary(self, state):
+        new_summary, self.summary_read = self.read_new_rows(
+            state, id_summary.summary_key, self.summary_read
+        )
+
+        if new_summary is None:
+            return
+
+        keys = pd.Series(
+            list(zip(new_summary["ID"], new_summary["database"])),
+            index=new_summary.index,
+        )
+        new_summary = new_summary.loc[
+            ~keys.isin(self.summarized)
+            & ~keys.duplicated()
+            & ~new_summary["ID"].isin(journal.ids_in_stage(state, "final"))
+        ]
+        self.summarized.update(zip(new_summary["ID"], new_summary["database"]))
+
+        self.valid_ids.update(
+            id_summary.valid_species_ids(new_summary, self.thresholds)
+        )
+        self.pending_summary = pd.concat([self.pending_summary, new_summary], axis=0)
+
+    # function to download the additional data of process ids that have not been downloaded yet
+    # the proxy pool is started once and reused for all updates
+    def download_metadata(self, process_ids):
+        id_batches = list(
+            additional_data_download.data_already_downloaded(process_ids, self.hdf_name)
+        )
+
+        if not id_batches:
+            return
+
+        if self.pool is None:
+            self.pool = proxy_pool.ProxyPool(source=self.proxy_source).start(
+                additional_data_download.generate_download_link(id_batches[0][:1])
+            )
+
+        additional_data_download.download_data(
+            id_batches, self.hdf_name, pool=self.pool
+        )
+
+    # function to write the top hits of newly completed IDs and mark them as final
+    def emit(self, top_hits):
+        top_hits = digger_hit.fixed_dtypes(top_hits)
+
+        with metrics.hdf_append(final_top_hits_key, len(top_hits.index)), pd.HDFStore(
+            self.hdf_name, mode="a", complib="blosc:blosclz", complevel=9
+        ) as hdf_output:
+            if "/{}".format(final_top_hits_key) in hdf_output.keys():
+                start = hdf_output.get_storer(final_top_hits_key).nrows
+            else:
+                start = 0
+
+            hdf_output.append(
+                final_top_hits_key,
+                top_hits,
+                format="t",
+                data_columns=True,
+                min_itemsize=final_item_sizes,
+                complib="blosc:blosclz",
+                complevel=9,
+            )
+            nrows = hdf_output.get_storer(final_top_hits_key).nrows
+
+        # the part is named by its first row, so a part of an interrupted emission is overwritten on resume
+        self.directory.mkdir(parents=True, exist_ok=True)
+        savename = self.directory.joinpath("part-{:09d}.parquet".format(start))
+        pq.write_table(
+            pa.Table.from_pandas(top_hits, schema=result_schema, preserve_index=False),
+            "{}.tmp".format(savename),
+        )
+        os.replace("{}.tmp".format(savename), savename)
+
+        # the IDs only count as final once the journal holds the checkpoint
+        journal.record(
+            self.hdf_name,
+            "final",
+            key=final_top_hits_key,
+            nrows=nrows,
+            ids=top_hits["ID"],
+        )
+
+    # function to compute and emit the top hits of all IDs that became complete since the last update
+    # returns the number of emitted top hits
+    def update(self):
+        state = journal.load_state(self.hdf_name)
+
+        if state is None:
+            return 0
+
+        self.read_new_summary(state)
+
+        new_hits, self.hits_read = self.read_new_rows(
+            state, "top_100_hits_unsorted", self.hits_read
+        )
+
+        if new_hits is not None:
+            # IDs that became final in a previous run are not emitted again
+            new_hits = new_hits.loc[
+                ~new_hits["ID"].isin(journal.ids_in_stage(state, "final"))
+            ]
+            self.pending_hits = pd.concat([self.pending_hits, new_hits], axis=0)
+
+        if self.pending_hits is None or self.pending_hits.empty:
+            return 0
+
+        # sort the IDs with parsed species level hits into complete IDs and IDs that wait for all records
+        species_ids = journal.ids_in_stage(state, "parsed", "species")
+        all_records_ids = journal.ids_in_stage(state, "parsed", "all_records")
+
+        unchecked = self.pending_hits.loc[
+            self.pending_hits["ID"].isin(species_ids)
+            & ~self.pending_hits["ID"].isin(self.needs_all_records)
+        ]
+        self.needs_all_records.update(set(unchecked["ID"].unique()) - self.valid_ids)
+
+        complete = self.pending_hits["ID"].isin(species_ids) & (
+            self.pending_hits["ID"].isin(self.valid_ids)
+            | self.pending_hits["ID"].isin(all_records_ids)
+        )
+
+        if not complete.any():
+            return 0
+
+        top_100_hits = order_hits(self.pending_hits.loc[complete])
+        self.pending_hits = self.pending_hits.loc[~complete]
+        complete_ids = set(top_100_hits["ID"].unique())
+        self.needs_all_records.difference_update(complete_ids)
+
+        # the threshold inputs of the complete IDs, their summary rows are not needed afterwards
+        # IDs without summary are selected from their hits alone
+        if self.pending_summary is not None:
+            summary = self.pending_summary["ID"].isin(complete_ids)
+            threshold_inputs = id_summary.threshold_inputs(
+                self.pending_summary.loc[summary]
+            ).to_dict("index")
+            self.pending_summary = self.pending_summary.loc[~summary]
+        else:
+            threshold_inputs = {}
+
+        # download the specimen data of the complete IDs
+        process_ids = additional_data_download.non_empty_process_ids(top_100_hits)
+
+        self.download_metadata(process_ids)
+
+        # the cached journal state only folds in the records of the download
+        new_metadata, self.metadata_read = self.read_new_rows(
+            journal.load_state(self.hdf_name), "additional_data", self.metadata_read
+        )
+        if new_metadata is not None:
+            self.metadata = pd.concat([self.metadata, new_metadata], axis=0)
+
+        top_100_hits = additional_data_download.join_additional_data(
+            top_100_hits,
+            process_ids,
+            self.metadata.loc[self.metadata["processid"].isin(process_ids)],
+        )
+
+        # select the top hits, they are memoized so the final selection of the whole project reuses them
+        top_hits, _ = digger_hit.memoized_top_hits(
+            self.hdf_name,
+            top_100_hits[digger_hit.top_hit_columns],
+            self.thresholds,
+            progress=False,
+            top_hit_memo=self.top_hit_memo,
+            threshold_inputs=threshold_inputs,
+        )
+
+        if self.clusters is not None:
+            top_hits = clustering.expand_top_hits(top_hits, self.clusters)[
+                digger_hit.top_hit_output_columns
+            ]
+
+        self.emit(top_hits)
+
+        messages.write(
+            "{}: {} top hits are final.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), len(top_hits.index)
+            )
+        )
+
+        return len(top_hits.index)
@@ -0,0 +1,179 @@
+import contextvars, json, os, threading, time
+from contextlib import contextmanager
+
+# tracing is disabled until enable is called
+enabled = False
+lock = threading.Lock()
+trace_start = time.perf_counter()
+events = []
+
+# the semaphore slot held by the current asyncio task, used as thread id in the trace
+current_slot = contextvars.ContextVar("current_slot", default=None)
+
+# slots are shown as separate threads in the trace viewer, offset them from real thread ids
+slot_offset = 100000000
+
+
+# function to enable tracing, drops all previously recorded events
+def enable():
+    global enabled, trace_start, events
+
+    with lock:
+        enabled = True
+        trace_start = time.perf_counter()
+        events = []
+
+
+# function to disable tracing and drop the recorded events, later runs in the same process are not traced
+def disable():
+    global enabled, events
+
+    with lock:
+        enabled = False
+        events = []
+
+
+# function to return the current time in microseconds since tracing was enabled
+def timestamp():
+    return (time.perf_counter() - trace_start) * 1e6
+
+
+# function to return the thread id for an event, asyncio tasks use their semaphore slot
+def thread_id():
+    slot = current_slot.get()
+
+    if slot is None:
+        return threading.get_native_id()
+    else:
+        return slot_offset + slot
+
+
+# function to record a span from start until now as a chrome trace complete event
+def record_span(name, category, start, **args):
+    if not enabled:
+        return
+
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": start,
+        "dur": timestamp() - start,
+        "pid": os.getpid(),
+        "tid": thread_id(),
+        "args": {key: str(value) for key, value in args.items()},
+    }
+
+    with lock:
+        events.append(event)
+
+
+# context manager to record a span
+@contextmanager
+def span(name, category, **args):
+    if not enabled:
+        yield
+        return
+
+    start = timestamp()
+
+    try:
+        yield
+    finally:
+        record_span(name, category, start, **args)
+
+
+# function to record an instant event, e.g. a retry
+def instant(name, category, **args):
+    if not enabled:
+        return
+
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "i",
+        "s": "t",
+        "ts": timestamp(),
+        "pid": os.getpid(),
+        "tid": thread_id(),
+        "args": {key: str(value) for key, value in args.items()},
+    }
+
+    with lock:
+        events.append(event)
+
+
+# pool of semaphore slots, every task holding the semaphore gets the lowest free slot
+class SlotPool:
+    def __init__(self):
+        self.free_slots = []
+        self.n_slots = 0
+
+    def acquire(self):
+        if self.free_slots:
+            self.free_slots.sort()
+            return self.free_slots.pop(0)
+        else:
+            self.n_slots += 1
+            return self.n_slots - 1
+
+    def release(self, slot):
+        self.free_slots.append(slot)
+
+
+# context manager to mark the current asyncio task as holding a semaphore slot
+@contextmanager
+def hold_slot(slot_pool):
+    slot = slot_pool.acquire()
+    token = current_slot.set(slot)
+
+    try:
+        yield slot
+    finally:
+        current_slot.reset(token)
+        slot_pool.release(slot)
+
+
+# function to generate metadata events that name the processes and threads in the viewer
+def metadata_events():
+    names = {}
+
+    for event in events:
+        names[(event["pid"], event["tid"])] = None
+
+    metadata = []
+    for pid, tid in names:
+        if tid >= slot_offset:
+            thread_name = "semaphore slot {}".format(tid - slot_offset)
+        elif tid == threading.main_thread().native_id:
+            thread_name = "main thread"
+        else:
+            thread_name = "thread {}".format(tid)
+
+        metadata.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_name},
+            }
+        )
+
+    return metadata
+
+
+# function to write all recorded events to a chrome trace json file
+# the file can be opened in chrome://tracing or https://ui.perfetto.dev
+def write_trace(savename):
+    if not enabled:
+        return
+
+    with lock:
+        trace = {
+            "traceEvents": metadata_events() + events,
+            "displayTimeUnit": "ms",
+        }
+
+    with open(savename, "w") as output:
+        json.dump(trace, output)
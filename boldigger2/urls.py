@@ -0,0 +1,15 @@
+import os
+
+# base urls of boldsystems.org, can be changed via environment variables
+# e.g. to run the whole pipeline against a local test server
+v4_url = os.environ.get("BOLDIGGER2_V4_URL", "https://v4.boldsystems.org")
+v4_result_url = os.environ.get("BOLDIGGER2_V4_RESULT_URL", "http://v4.boldsystems.org")
+api_url = os.environ.get("BOLDIGGER2_API_URL", "http://www.boldsystems.org")
+
+
+# function to point all base urls to a different server
+def configure(base_url):
+    global v4_url, v4_result_url, api_url
+
+    base_url = base_url.rstrip("/")
+    v4_url, v4_result_url, api_url = base_url, base_url, base_url
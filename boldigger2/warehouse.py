@@ -0,0 +1,365 @@
+import bisect, datetime, hashlib, os, time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs, ipc
+from pathlib import Path
+from boldigger2 import additional_data_download, digger_hit, login, messages
+
+# columns of the registered top hits, projects without clustering have no representatives
+schema = pa.schema(
+    [
+        ("project", pa.string()),
+        ("ID", pa.string()),
+        ("Phylum", pa.string()),
+        ("Class", pa.string()),
+        ("Order", pa.string()),
+        ("Family", pa.string()),
+        ("Genus", pa.string()),
+        ("Species", pa.string()),
+        ("Similarity", pa.float64()),
+        ("Status", pa.string()),
+        ("records", pa.int64()),
+        ("selected_level", pa.string()),
+        ("BIN", pa.string()),
+        ("flags", pa.string()),
+        ("representative", pa.string()),
+    ]
+)
+
+# columns of the catalog of registered projects
+catalog_schema = pa.schema(
+    [
+        ("project", pa.string()),
+        ("fasta_name", pa.string()),
+        ("project_file", pa.string()),
+        ("source_modified", pa.float64()),
+        ("registered", pa.string()),
+        ("rows", pa.int64()),
+    ]
+)
+
+# indexed lookups, every index maps a value to the rows of the top hits that contain it
+index_names = ["ID", "taxon", "BIN"]
+taxon_levels = ["Phylum", "Class", "Order", "Family", "Genus", "Species"]
+
+
+# function to return the default warehouse directory, next to the cached login
+def default_warehouse():
+    return login.cache_directory().joinpath("warehouse")
+
+
+# function to return the partition file of a project
+def partition_path(warehouse, project):
+    return Path(warehouse).joinpath(
+        "top_hits", "project={}".format(project), "part-0.arrow"
+    )
+
+
+# function to write an arrow table as uncompressed ipc file, so it can be memory mapped
+# the file is written under a temporary name first, readers never see a partial file
+def write_table(table, savename):
+    savename = Path(savename)
+    savename.parent.mkdir(parents=True, exist_ok=True)
+    temporary = "{}.tmp".format(savename)
+
+    with ipc.new_file(temporary, table.schema) as writer:
+        writer.write_table(table)
+
+    os.replace(temporary, savename)
+
+
+# function to read an ipc file memory mapped, the buffers of the table point into the file
+def read_table(savename):
+    with pa.memory_map(str(savename)) as source:
+        return ipc.open_file(source).read_all()
+
+
+# function to load the catalog of the registered projects
+def load_catalog(warehouse):
+    try:
+        return read_table(Path(warehouse).joinpath("projects.arrow"))
+    except FileNotFoundError:
+        return catalog_schema.empty_table()
+
+
+# function to return the unique name of a project in the warehouse
+# projects with the same name in different folders get a different suffix
+def project_key(project_file):
+    project_file = Path(project_file).resolve()
+    fasta_name = project_file.with_suffix("").with_suffix("").name
+    fasta_name = fasta_name.removesuffix("_top_100_hits")
+    path_hash = hashlib.sha1(str(project_file).encode()).hexdigest()[:8]
+
+    return fasta_name, "{}_{}".format(fasta_name, path_hash)
+
+
+# function to collect the project storages to register, directories are searched recursively
+def project_files(paths):
+    files = []
+
+    for path in map(Path, paths):
+        if path.is_dir():
+            files += sorted(path.rglob("*_top_100_hits.h5.lz"))
+        else:
+            files.append(path)
+
+    return list(dict.fromkeys(file.resolve() for file in files))
+
+
+# function to load the top hits of a finished project
+# the identification result is used if it was exported as parquet, otherwise the top hits are selected again
+def project_top_hits(project_file, fasta_name, thresholds):
+    result_file = project_file.with_name(
+        "{}_identification_result.parquet.snappy".format(fasta_name)
+    )
+
+    if result_file.is_file():
+        return pd.read_parquet(result_file)
+    else:
+        return digger_hit.reclassify(project_file, thresholds, output_formats=["none"])
+
+
+# function to bring the top hits of a project into the schema of the warehouse
+def warehouse_table(top_hits, project):
+    top_hits = top_hits.copy()
+    top_hits.insert(0, "project", project)
+
+    for field in schema:
+        if field.name not in top_hits.columns:
+            top_hits[field.name] = None
+
+    return pa.Table.from_pandas(
+        top_hits[schema.names], schema=schema, preserve_index=False
+    )
+
+
+# function to return the index file of a project
+def index_path(warehouse, name, project):
+    return Path(warehouse).joinpath(
+        "indexes", name, "project={}".format(project), "part-0.arrow"
+    )
+
+
+# function to build the indexes of a project
+# every index holds value and row sorted by value, so a value is found by binary search
+def build_indexes(warehouse, project, table):
+    table = table.combine_chunks()
+    rows = pa.array(range(table.num_rows), type=pa.int64())
+
+    for name in index_names:
+        if name == "ID":
+            values = [(table["ID"].chunk(0), rows)]
+        elif name == "taxon":
+            values = [(table[level].chunk(0), rows) for level in taxon_levels]
+        else:
+            # the BIN column joins the BINs of all hits that support the top hit
+            bins = pc.split_pattern(table["BIN"].chunk(0), ";")
+            values = [
+                (pc.list_flatten(bins), pc.take(rows, pc.list_parent_indices(bins)))
+            ]
+
+        index = pa.concat_tables(
+            [
+                pa.table({"value": value, "row": value_rows})
+                for value, value_rows in values
+            ]
+        )
+        index = index.filter(pc.invert(pc.is_null(index["value"])))
+        index = index.filter(pc.not_equal(index["value"], ""))
+        index = index.sort_by([("value", "ascending"), ("row", "ascending")])
+
+        write_table(index, index_path(warehouse, name, project))
+
+
+# function to register finished projects in the warehouse
+# a project that is registered again replaces its previous version, unchanged projects are skipped
+def register(paths, warehouse=None, thresholds=[97, 95, 90, 85, 50]):
+    warehouse = Path(warehouse or default_warehouse())
+    catalog = load_catalog(warehouse).to_pandas()
+    registered = 0
+
+    for project_file in project_files(paths):
+        fasta_name, project = project_key(project_file)
+
+        if not additional_data_download.additional_data_complete(project_file):
+            messages.write(
+                "{}: Skipping {}, the identification is not finished.".format(
+                    datetime.datetime.now().strftime("%H:%M:%S"), project_file
+                )
+            )
+            continue
+
+        known = catalog.loc[catalog["project"] == project]
+        if (
+            not known.empty
+            and known["source_modified"].iloc[0] == project_file.stat().st_mtime
+        ):
+            continue
+
+        # a project that cannot be classified is skipped, the other projects are still registered
+        try:
+            top_hits = project_top_hits(project_file, fasta_name, thresholds)
+        except Exception as error:
+            messages.write(
+                "{}: Skipping {}, the top hits could not be selected: {}".format(
+                    datetime.datetime.now().strftime("%H:%M:%S"), project_file, error
+                )
+            )
+            continue
+
+        # reclassify memoizes the top hits in the project storage, so the time is taken afterwards
+        source_modified = project_file.stat().st_mtime
+        table = warehouse_table(top_hits, project)
+
+        # the indexes are written before the partition, the catalog is replaced last
+        build_indexes(warehouse, project, table)
+        write_table(table, partition_path(warehouse, project))
+
+        catalog = pd.concat(
+            [
+                catalog.loc[catalog["project"] != project],
+                pd.DataFrame(
+                    [
+                        [
+                            project,
+                            fasta_name,
+                            str(project_file),
+                            source_modified,
+                            pd.Timestamp.now().strftime("%Y-%m-%d %X"),
+                            table.num_rows,
+                        ]
+                    ],
+                    columns=catalog_schema.names,
+                ),
+            ],
+            ignore_index=True,
+        )
+        registered += 1
+
+        # give user output
+        messages.write(
+            "{}: Registered {} with {} top hits.".format(
+                datetime.datetime.now().strftime("%H:%M:%S"), project, table.num_rows
+            )
+        )
+
+    if registered or not Path(warehouse).joinpath("projects.arrow").is_file():
+        write_table(
+            pa.Table.from_pandas(catalog, schema=catalog_schema, preserve_index=False),
+            warehouse.joinpath("projects.arrow"),
+        )
+
+    # give user output
+    messages.write(
+        "{}: {} projects registered, the warehouse holds {} projects.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"), registered, len(catalog)
+        )
+    )
+
+
+# function to return the rows of a project that contain one of the values, via binary search in the index
+def lookup(warehouse, name, project, values):
+    index = read_table(index_path(warehouse, name, project))
+    index_values = index["value"]
+    rows = set()
+
+    for value in values:
+        start = bisect.bisect_left(
+            index_values, value, key=lambda scalar: scalar.as_py()
+        )
+        stop = bisect.bisect_right(
+            index_values, value, lo=start, key=lambda scalar: scalar.as_py()
+        )
+        rows.update(index["row"].slice(start, stop - start).to_pylist())
+
+    return rows
+
+
+# function to query the top hits of all registered projects
+# ids, taxa (of any level) and bins are looked up in the indexes, rows matching any of them are returned,
+# filter is a pyarrow expression that all rows have to match, e.g. pc.field("Similarity") >= 97
+# only the selected columns are read, the table is memory mapped if no index lookup is needed
+def query(
+    warehouse=None,
+    ids=None,
+    taxa=None,
+    bins=None,
+    projects=None,
+    filter=None,
+    columns=None,
+):
+    warehouse = Path(warehouse or default_warehouse())
+    catalog = load_catalog(warehouse)
+    start = time.perf_counter()
+
+    if projects:
+        projects = set(projects)
+        selected = [
+            project
+            for project, fasta_name in zip(
+                catalog["project"].to_pylist(), catalog["fasta_name"].to_pylist()
+            )
+            if project in projects or fasta_name in projects
+        ]
+    else:
+        selected = catalog["project"].to_pylist()
+
+    columns = list(columns) if columns else schema.names
+
+    if ids or taxa or bins:
+        tables = []
+
+        for project in selected:
+            rows = set()
+            for name, values in [("ID", ids), ("taxon", taxa), ("BIN", bins)]:
+                if values:
+                    rows.update(lookup(warehouse, name, project, values))
+
+            if not rows:
+                continue
+
+            table = read_table(partition_path(warehouse, project)).take(sorted(rows))
+            if filter is not None:
+                table = table.filter(filter)
+            tables.append(table.select(columns))
+
+        result = (
+            pa.concat_tables(tables) if tables else schema.empty_table().select(columns)
+        )
+    elif selected:
+        # filters and the projection are pushed down into the memory mapped partitions
+        dataset = ds.dataset(
+            [str(partition_path(warehouse, project)) for project in selected],
+            schema=schema,
+            format="ipc",
+            filesystem=fs.LocalFileSystem(use_mmap=True),
+        )
+        result = dataset.to_table(columns=columns, filter=filter)
+    else:
+        result = schema.empty_table().select(columns)
+
+    # give user output
+    messages.write(
+        "{}: {} top hits found in {} projects in {:.2f} s.".format(
+            datetime.datetime.now().strftime("%H:%M:%S"),
+            result.num_rows,
+            len(selected),
+            time.perf_counter() - start,
+        )
+    )
+
+    return result
+
+
+# function to save the result of a query, the format is taken from the file extension (parquet or csv)
+# without a savename the first rows are printed
+def save_query(result, savename=None):
+    if savename is None:
+        print(result.to_pandas().to_string(max_rows=50))
+    elif Path(savename).suffix == ".csv":
+        result.to_pandas().to_csv(savename, index=False)
+    else:
+        pq.write_table(result, savename)
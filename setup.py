@@ -35,6 +35,8 @@ setuptools.setup(
         "lxml_html_clean>=0.1.1",
         "free-proxy >= 1.1.1",
     ],
+    # formatting and test tools for development, install with pip install -e .[dev]
+    extras_require={"dev": ["black>=24.1.0", "pytest>=7.0.0"]},
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 3",
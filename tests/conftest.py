@@ -0,0 +1,186 @@
+import shutil, sys
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+from boldigger2 import id_engine_coi, local_engine, messages, proxy_pool, urls
+
+sys.path.insert(0, str(Path(__file__).parents[1].joinpath("benchmarks")))
+
+from mock_bold_server import MockBoldServer
+
+bases = np.array(list("ACGT"))
+
+# thresholds for species, genus, family, order and class
+thresholds = [97, 95, 90, 85, 50]
+
+
+# function to change a fraction of the bases of a sequence
+def mutate(sequence, rate, rng):
+    sequence = np.array(list(sequence))
+    changed = rng.random(len(sequence)) < rate
+    sequence[changed] = bases[rng.integers(0, 4, changed.sum())]
+
+    return "".join(sequence)
+
+
+# function to generate references of 2 orders with 2 families, 2 genera, 3 species and 3 records each
+# the last species of every genus has no species name, so some IDs only get a genus level hit
+# returns the reference sequences by process id and the metadata table
+def generate_references(seed=0):
+    rng = np.random.default_rng(seed)
+    root = "".join(bases[rng.integers(0, 4, 500)])
+    sequences, rows = {}, []
+
+    for order in range(2):
+        order_sequence = mutate(root, 0.2, rng)
+        for family in range(2):
+            family_sequence = mutate(order_sequence, 0.1, rng)
+            for genus in range(2):
+                genus_sequence = mutate(family_sequence, 0.06, rng)
+                genus_name = "Genus{}{}{}".format(
+                    "ab"[order], "ab"[family], "ab"[genus]
+                )
+                for species in range(3):
+                    species_sequence = mutate(genus_sequence, 0.04, rng)
+                    for record in range(3):
+                        processid = "REF{:04d}-20".format(len(rows))
+                        sequences[processid] = mutate(species_sequence, 0.004, rng)
+                        rows.append(
+                            [
+                                processid,
+                                "Arthropoda",
+                                "Insecta",
+                                "Order{}".format("ab"[order]),
+                                "Family{}{}".format("ab"[order], "ab"[family]),
+                                genus_name,
+                                (
+                                    "{} species{}".format(genus_name, "abc"[species])
+                                    if species < 2
+                                    else ""
+                                ),
+                                "BOLD:AAA{:04d}".format(len(rows) // 3),
+                                "Germany",
+                            ]
+                        )
+
+    metadata = pd.DataFrame(
+        rows,
+        columns=[
+            "processid",
+            "phylum",
+            "class",
+            "order",
+            "family",
+            "genus",
+            "species",
+            "bin_uri",
+            "country",
+        ],
+    )
+
+    return sequences, metadata
+
+
+# function to generate queries from the references, every fourth query is a random sequence
+# returns a dict of query id -> sequence
+def generate_queries(references, n_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    processids = list(references)
+    queries = {}
+
+    for i in range(n_queries):
+        if i % 4 == 3:
+            sequence = "".join(bases[rng.integers(0, 4, 450)])
+        else:
+            reference = references[processids[rng.integers(len(processids))]]
+            sequence = mutate(reference[25:475], [0, 0.01, 0.03][i % 4], rng)
+        queries["OTU_{}".format(i + 1)] = sequence
+
+    return queries
+
+
+# function to write sequences to a fasta file
+def write_fasta(path, sequences):
+    with open(path, "w") as output:
+        for id, sequence in sequences.items():
+            output.write(">{}\n{}\n".format(id, sequence))
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    messages.disable()
+    yield
+    messages.enable()
+
+
+@pytest.fixture(scope="session")
+def references():
+    return generate_references()
+
+
+@pytest.fixture(scope="session")
+def reference_library(tmp_path_factory, references):
+    sequences, metadata = references
+    directory = tmp_path_factory.mktemp("reference")
+    write_fasta(
+        directory.joinpath("references.fasta"),
+        {"{}|taxon|COI-5P".format(id): sequence for id, sequence in sequences.items()},
+    )
+    metadata.to_csv(directory.joinpath("metadata.tsv"), sep="\t", index=False)
+
+    messages.disable()
+    return local_engine.build(
+        directory.joinpath("references.fasta"),
+        directory.joinpath("metadata.tsv"),
+        library_path=directory.joinpath("library"),
+    )
+
+
+# a finished project of 40 queries, identified with the reference library
+@pytest.fixture(scope="session")
+def project_template(tmp_path_factory, references, reference_library):
+    directory = tmp_path_factory.mktemp("project")
+    write_fasta(
+        directory.joinpath("queries.fasta"), generate_queries(references[0], 40)
+    )
+
+    messages.disable()
+    id_engine_coi.main(
+        directory.joinpath("queries.fasta"),
+        thresholds=thresholds,
+        output_formats=["parquet"],
+        interactive=False,
+        reference_library=reference_library,
+    )
+
+    return directory
+
+
+# returns the fasta path of a copy of the finished project, tests may change it
+@pytest.fixture
+def finished_project(tmp_path, project_template):
+    shutil.copytree(project_template, tmp_path, dirs_exist_ok=True)
+
+    return tmp_path.joinpath("queries.fasta")
+
+
+# a local mock of boldsystems.org, all urls point to it and login cookies are cached in a temporary directory
+# no public proxies are scraped, the additional data is downloaded directly from the mock
+@pytest.fixture
+def mock_bold(tmp_path_factory, monkeypatch):
+    with MockBoldServer() as server:
+        for name in ["v4_url", "v4_result_url", "api_url"]:
+            monkeypatch.setattr(urls, name, server.url)
+        monkeypatch.setenv(
+            "BOLDIGGER2_CACHE_DIR", str(tmp_path_factory.mktemp("cache"))
+        )
+        monkeypatch.setattr(id_engine_coi, "bad_response_wait", 1)
+        monkeypatch.setattr(proxy_pool, "free_proxy_source", lambda: [])
+
+        yield server
+
+
+# function to return the project storage of a fasta file
+def project_file(fasta_path):
+    return fasta_path.with_name("{}_top_100_hits.h5.lz".format(fasta_path.stem))
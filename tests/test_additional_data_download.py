@@ -0,0 +1,70 @@
+import pandas as pd
+from boldigger2 import additional_data_download, digger_hit, journal
+from boldigger2.id_engine_coi import read_fasta
+from conftest import project_file, thresholds
+
+
+# function to append a second, later response for an ID, like a repeated request after an interruption
+def add_repeated_response(hdf_name, id):
+    hits = pd.read_hdf(hdf_name, key="top_100_hits_unsorted")
+    repeated = hits.loc[(hits["ID"] == id) & (hits["database"] == "species")].copy()
+    repeated["request_date"] = "2099-01-01 00:00:00"
+    repeated["Similarity"] = 50.0
+
+    with pd.HDFStore(hdf_name, mode="a") as hdf_output:
+        hdf_output.append("top_100_hits_unsorted", repeated, format="t")
+        nrows = hdf_output.get_storer("top_100_hits_unsorted").nrows
+
+    journal.record(hdf_name, "checkpoint", key="top_100_hits_unsorted", nrows=nrows)
+
+
+def test_chunked_ordering_matches_ordering(finished_project):
+    hdf_name = project_file(finished_project)
+    add_repeated_response(hdf_name, "OTU_5")
+
+    journal.discard(hdf_name, "top_100_hits_sorted")
+    top_100_hits, process_ids = additional_data_download.read_and_order(
+        finished_project, hdf_name, read_fasta
+    )
+    ordered = pd.read_hdf(hdf_name, key="top_100_hits_sorted")
+
+    journal.discard(hdf_name, "top_100_hits_sorted")
+    chunked_process_ids = additional_data_download.read_and_order_chunked(
+        finished_project, hdf_name, read_fasta, rows_per_chunk=150
+    )
+
+    assert ordered["Similarity"].loc[ordered["ID"] == "OTU_5"].min() > 50
+    pd.testing.assert_frame_equal(top_100_hits, ordered)
+    pd.testing.assert_frame_equal(
+        pd.read_hdf(hdf_name, key="top_100_hits_sorted"), ordered
+    )
+    assert set(chunked_process_ids) == set(process_ids)
+
+
+def test_chunked_top_hits_match_top_hits(finished_project):
+    hdf_name = project_file(finished_project)
+    with_additional_data = pd.read_hdf(hdf_name, key="top_100_hits_additional_data")
+
+    journal.discard(hdf_name, "top_100_hits_additional_data")
+    additional_data_download.add_additional_data_chunked(hdf_name, rows_per_chunk=150)
+
+    pd.testing.assert_frame_equal(
+        pd.read_hdf(hdf_name, key="top_100_hits_additional_data"),
+        with_additional_data,
+    )
+
+    top_hits, hashes = digger_hit.memoized_top_hits(
+        hdf_name,
+        pd.read_hdf(
+            hdf_name,
+            key="top_100_hits_additional_data",
+            columns=digger_hit.top_hit_columns,
+        ),
+        thresholds,
+    )
+    chunked_top_hits, chunked_hashes = digger_hit.chunked_top_hits(
+        hdf_name, thresholds, rows_per_chunk=150
+    )
+
+    pd.testing.assert_frame_equal(chunked_top_hits, top_hits)
+    pd.testing.assert_series_equal(chunked_hashes, hashes)
@@ -0,0 +1,49 @@
+import asyncio
+import pandas as pd
+import pytest
+from boldigger2 import api, id_engine_coi, messages
+from boldigger2.exceptions import InvalidSequenceError
+from conftest import generate_queries, thresholds
+
+
+# function to drop the download time and give both tables the same column types
+def comparable(top_100_hits):
+    return top_100_hits.drop(columns="request_date").reset_index(drop=True).astype(str)
+
+
+def test_in_memory_identification_matches_a_persisted_one(
+    tmp_path, references, mock_bold, monkeypatch, capsys
+):
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 4)
+    mock_bold.config["hits_per_page"] = 20
+    sequences = generate_queries(references[0], 8)
+    messages.enable()
+
+    in_memory = api.identify(
+        sequences, username="user", password="secret", thresholds=thresholds
+    )
+
+    # nothing is printed and nothing is written
+    assert capsys.readouterr() == ("", "")
+    assert not list(tmp_path.iterdir())
+
+    persisted = asyncio.run(
+        api.identify_async(
+            sequences,
+            username="user",
+            password="secret",
+            thresholds=thresholds,
+            project_directory=tmp_path,
+        )
+    )
+
+    assert tmp_path.joinpath("boldigger2_top_100_hits.h5.lz").is_file()
+    pd.testing.assert_frame_equal(comparable(in_memory[0]), comparable(persisted[0]))
+    pd.testing.assert_frame_equal(in_memory[1].astype(str), persisted[1].astype(str))
+
+
+def test_invalid_sequences_are_rejected_before_anything_is_sent(mock_bold):
+    with pytest.raises(InvalidSequenceError, match="not unique"):
+        api.identify([("OTU_1", "ACGT" * 30), ("OTU_1", "ACGT" * 30)])
+
+    assert not mock_bold.request_counts
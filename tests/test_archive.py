@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+from boldigger2 import archive, id_engine_coi
+from boldigger2.exceptions import ProjectError
+from conftest import generate_queries, project_file, thresholds, write_fasta
+
+# tables that are rebuilt from the archived responses
+# the unsorted tables hold the responses in the order they arrived, they are compared by content
+derived_keys = [
+    "top_100_hits_unsorted",
+    "top_100_hits_sorted",
+    "additional_data",
+    "top_100_hits_additional_data",
+]
+unsorted_keys = ["top_100_hits_unsorted", "additional_data"]
+
+
+# function to read the tables derived from the responses and the identification result
+def project_tables(fasta_path):
+    tables = {
+        key: pd.read_hdf(project_file(fasta_path), key=key) for key in derived_keys
+    }
+
+    for key in unsorted_keys:
+        tables[key] = (
+            tables[key]
+            .sort_values(by=list(tables[key].columns), kind="stable")
+            .reset_index(drop=True)
+        )
+    tables["result"] = pd.read_parquet(
+        fasta_path.with_name("queries_identification_result.parquet.snappy")
+    )
+
+    return tables
+
+
+def test_reparse_rebuilds_the_project_without_downloading(
+    tmp_path, references, mock_bold, monkeypatch
+):
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 4)
+    mock_bold.config["hits_per_page"] = 20
+    fasta_path = tmp_path.joinpath("queries.fasta")
+    write_fasta(fasta_path, generate_queries(references[0], 8))
+
+    id_engine_coi.main(
+        fasta_path,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["parquet"],
+        interactive=False,
+        archive_responses=True,
+    )
+    archive.disable()
+
+    tables = project_tables(fasta_path)
+    requests = dict(mock_bold.request_counts)
+
+    id_engine_coi.reparse(fasta_path, thresholds=thresholds, output_formats=["parquet"])
+
+    assert mock_bold.request_counts == requests
+    for key, table in project_tables(fasta_path).items():
+        pd.testing.assert_frame_equal(table, tables[key])
+
+
+def test_reparse_needs_archived_responses(finished_project):
+    with pytest.raises(ProjectError, match="No archived responses"):
+        id_engine_coi.reparse(finished_project, thresholds=thresholds)
@@ -0,0 +1,98 @@
+import shutil
+import pandas as pd
+from boldigger2 import batch, id_engine_coi
+from conftest import generate_queries, project_file, thresholds, write_fasta
+
+
+# function to read the ordered hits of a project without the time of the download
+def ordered_hits(fasta_path):
+    return pd.read_hdf(project_file(fasta_path), key="top_100_hits_sorted").drop(
+        columns="request_date"
+    )
+
+
+def test_shared_ids_get_the_hits_of_their_own_project(
+    tmp_path, references, mock_bold, monkeypatch
+):
+    # all sequences of both files fit into one request
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 10)
+    mock_bold.config["hits_per_page"] = 20
+    queries = generate_queries(references[0], 8)
+    ids = list(queries)
+    fasta_paths = [tmp_path.joinpath("first.fasta"), tmp_path.joinpath("second.fasta")]
+
+    # both files contain OTU_1, with a different sequence
+    write_fasta(fasta_paths[0], {id: queries[id] for id in ids[:4]})
+    write_fasta(
+        fasta_paths[1],
+        {"OTU_1": queries[ids[4]], **{id: queries[id] for id in ids[5:]}},
+    )
+
+    for fasta_path in fasta_paths:
+        single_directory = tmp_path.joinpath("single_{}".format(fasta_path.stem))
+        single_directory.mkdir()
+        shutil.copy(fasta_path, single_directory)
+
+        id_engine_coi.main(
+            single_directory.joinpath(fasta_path.name),
+            username="user",
+            password="secret",
+            thresholds=thresholds,
+            output_formats=["none"],
+            interactive=False,
+        )
+
+    requests = mock_bold.request_counts["/index.php/IDS_IdentificationRequest"]
+
+    top_hits = batch.main(
+        fasta_paths,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["none"],
+        interactive=False,
+    )
+
+    # the sequences of both files are sent in shared requests
+    assert (
+        mock_bold.request_counts["/index.php/IDS_IdentificationRequest"] - requests
+        < requests
+    )
+
+    for fasta_path in fasta_paths:
+        single = tmp_path.joinpath("single_{}".format(fasta_path.stem), fasta_path.name)
+        pd.testing.assert_frame_equal(ordered_hits(fasta_path), ordered_hits(single))
+        assert top_hits[fasta_path.stem]["ID"].tolist() == list(
+            id_engine_coi.read_fasta(fasta_path)[0]
+        )
+
+    # the shared id got different hits in both projects
+    first, second = [ordered_hits(fasta_path) for fasta_path in fasta_paths]
+    assert (
+        not first.loc[first["ID"] == "OTU_1"]
+        .reset_index(drop=True)
+        .equals(second.loc[second["ID"] == "OTU_1"].reset_index(drop=True))
+    )
+
+
+def test_profiles_and_traces_with_a_reference_library(
+    tmp_path, references, reference_library
+):
+    queries = generate_queries(references[0], 8)
+    fasta_paths = [tmp_path.joinpath("first.fasta"), tmp_path.joinpath("second.fasta")]
+    write_fasta(fasta_paths[0], dict(list(queries.items())[:4]))
+    write_fasta(fasta_paths[1], dict(list(queries.items())[4:]))
+
+    batch.main(
+        fasta_paths,
+        thresholds=thresholds,
+        output_formats=["none"],
+        interactive=False,
+        reference_library=reference_library,
+        profile=True,
+        trace=True,
+    )
+
+    for fasta_path in fasta_paths:
+        assert fasta_path.with_name("{}_trace.json".format(fasta_path.stem)).is_file()
+        assert any(fasta_path.with_name("{}_profile".format(fasta_path.stem)).iterdir())
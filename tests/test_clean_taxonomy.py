@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from string import punctuation, digits
+from boldigger2 import clean_taxonomy
+from conftest import project_file
+
+levels = ["Phylum", "Class", "Order", "Family", "Genus", "Species"]
+
+
+# function to clean the taxonomy row by row as before the names were factorized
+def clean_per_row(top_100_hits):
+    top_100_hits = top_100_hits.copy()
+    specials = punctuation + digits
+
+    for level in levels:
+        top_100_hits[level] = np.where(
+            top_100_hits[level].str.contains("[{}]".format(specials)),
+            np.nan,
+            top_100_hits[level],
+        )
+
+    top_100_hits["Species"] = top_100_hits["Species"].str.split(" ").str[0]
+
+    return top_100_hits
+
+
+def test_factorized_cleaning_matches_cleaning_per_row(finished_project):
+    hdf_name = project_file(finished_project)
+    top_100_hits = pd.read_hdf(hdf_name, key="top_100_hits_additional_data")
+
+    # names with digits, punctuation, several words and missing values
+    top_100_hits.loc[:5, "Species"] = [
+        "Baetis rhodani",
+        "Baetis sp.",
+        "Baetis cf. rhodani",
+        "Baetis rhodani 2",
+        np.nan,
+        "Homo sapiens sapiens",
+    ]
+    top_100_hits.loc[6:8, "Genus"] = ["Baetis", "BOLD:AAA1234", None]
+
+    expected = clean_per_row(top_100_hits)
+
+    # the first call memoizes the clean names in the project storage, the second one reads them
+    for _ in range(2):
+        cleaned = clean_taxonomy.clean_taxonomy(
+            top_100_hits.copy(), levels, hdf_name=hdf_name, first_species_name=True
+        )
+
+        pd.testing.assert_frame_equal(
+            cleaned.fillna(np.nan), expected.fillna(np.nan), check_dtype=False
+        )
+
+    assert cleaned["Species"].iloc[[0, 5]].tolist() == ["Baetis", "Homo"]
+    assert cleaned["Species"].iloc[1:5].isna().all()
+    assert "Baetis sp." in clean_taxonomy.load_clean_names(hdf_name).index
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from boldigger2 import clustering, id_engine_coi
+from conftest import mutate, thresholds, write_fasta
+
+
+# function to generate sequences with known near-duplicates
+# a and b are unrelated, the other sequences are copies of a or b
+def near_duplicates():
+    rng = np.random.default_rng(3)
+    a = "".join(rng.choice(list("ACGT"), 450))
+    b = "".join(rng.choice(list("ACGT"), 450))
+
+    # the ambiguity codes stand for the base they replace
+    ambiguous = list(a)
+    ambiguous[50] = "N"
+    for position in [150, 300]:
+        ambiguous[position] = {"A": "R", "G": "R", "C": "Y", "T": "Y"}[a[position]]
+
+    return {
+        "shorter_a": a[30:420],
+        "b": b,
+        "a": a,
+        "ambiguous_a": "".join(ambiguous),
+        "mutated_a": a[:100] + ("C" if a[100] != "C" else "G") + a[101:],
+        "distant_b": mutate(b, 0.08, rng),
+    }
+
+
+def fasta_dict(sequences):
+    return {id: SeqRecord(Seq(sequence)) for id, sequence in sequences.items()}
+
+
+def test_near_duplicates_join_their_representative():
+    clusters = clustering.cluster_sequences(fasta_dict(near_duplicates()), 99)
+
+    assert clusters["ID"].tolist() == list(near_duplicates())
+    assert clusters.set_index("ID")["representative"].to_dict() == {
+        "shorter_a": "a",
+        "b": "b",
+        "a": "a",
+        "ambiguous_a": "a",
+        "mutated_a": "a",
+        "distant_b": "distant_b",
+    }
+    identities = clusters.set_index("ID")["identity"]
+    assert identities["shorter_a"] == identities["ambiguous_a"] == 100
+    assert identities["mutated_a"] == round(449 / 450 * 100, 2)
+    assert clusters["queried"].tolist() == [False, True, True, False, False, True]
+
+
+def test_validation_queries_a_sample_of_the_members():
+    clusters = clustering.cluster_sequences(
+        fasta_dict(near_duplicates()), 99, validation_size=2
+    )
+    members = clusters.loc[clusters["ID"] != clusters["representative"]]
+
+    assert members["queried"].sum() == 2
+    assert clustering.queried_sequences(
+        fasta_dict(near_duplicates()), clusters
+    ).keys() == set(clusters.loc[clusters["queried"], "ID"])
+
+
+def test_members_get_the_top_hit_of_their_representative():
+    clusters = clustering.cluster_sequences(fasta_dict(near_duplicates()), 99)
+    top_hits = pd.DataFrame(
+        {
+            "ID": ["b", "a", "distant_b"],
+            "Species": ["Species b", "Species a", "Species c"],
+            "Similarity": [100.0, 99.5, 98.0],
+        }
+    )
+
+    expanded = clustering.expand_top_hits(top_hits, clusters)
+
+    assert expanded["ID"].tolist() == list(near_duplicates())
+    assert expanded["Species"].tolist() == [
+        "Species a",
+        "Species b",
+        "Species a",
+        "Species a",
+        "Species a",
+        "Species c",
+    ]
+    assert expanded["representative"].tolist() == clusters["representative"].tolist()
+
+
+def test_clustered_identification_reports_every_sequence(
+    tmp_path, references, reference_library
+):
+    sequences = references[0]
+    write_fasta(
+        tmp_path.joinpath("queries.fasta"),
+        {
+            "OTU_1": sequences["REF0010-20"][20:480],
+            "OTU_2": sequences["REF0010-20"][30:470],
+            "OTU_3": sequences["REF0050-20"][20:480],
+        },
+    )
+
+    top_hits = id_engine_coi.main(
+        tmp_path.joinpath("queries.fasta"),
+        thresholds=thresholds,
+        output_formats=["none"],
+        interactive=False,
+        reference_library=reference_library,
+        cluster_identity=99,
+    )
+
+    assert top_hits["ID"].tolist() == ["OTU_1", "OTU_2", "OTU_3"]
+    assert top_hits["representative"].tolist() == ["OTU_1", "OTU_1", "OTU_3"]
+    assert top_hits.iloc[0].drop(["ID"]).equals(top_hits.iloc[1].drop(["ID"]))
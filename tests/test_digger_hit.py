@@ -0,0 +1,122 @@
+import hashlib
+import pandas as pd
+from boldigger2 import digger_hit
+from conftest import project_file, thresholds
+
+threshold_sets = [thresholds, [99, 97, 95, 90, 50], [95, 92, 88, 80, 50]]
+
+
+def test_sweep_matches_separate_reclassify_runs(finished_project):
+    sweep_result = digger_hit.sweep(project_file(finished_project), threshold_sets)
+
+    for set_thresholds in threshold_sets:
+        set_result = sweep_result.loc[
+            sweep_result["threshold_set"]
+            == "_".join(str(threshold) for threshold in set_thresholds)
+        ]
+        top_hits = digger_hit.reclassify(
+            project_file(finished_project), set_thresholds, output_formats=["none"]
+        )
+
+        pd.testing.assert_frame_equal(
+            set_result.drop(columns="threshold_set").reset_index(drop=True), top_hits
+        )
+
+    # the threshold sets select different top hits for some IDs
+    assert sweep_result.groupby("ID")["selected_level"].nunique().max() > 1
+
+
+def test_memoized_top_hits_match_computed_top_hits(finished_project, monkeypatch):
+    hdf_name = project_file(finished_project)
+    top_100_hits = pd.read_hdf(
+        hdf_name,
+        key="top_100_hits_additional_data",
+        columns=digger_hit.top_hit_columns,
+    )
+    computed = digger_hit.select_top_hits(
+        digger_hit.clean_hits(top_100_hits.copy(), hdf_name),
+        thresholds,
+        digger_hit.load_threshold_inputs(hdf_name),
+    )
+
+    # the finished identification memoized all top hits, none is cleaned or computed again
+    clean_hits, select_top_hits = digger_hit.clean_hits, digger_hit.select_top_hits
+    cleaned_ids, selected_ids = [], []
+
+    def record_cleaned_ids(top_100_hits, *args):
+        cleaned_ids.extend(top_100_hits["ID"].unique())
+        return clean_hits(top_100_hits, *args)
+
+    def record_ids(top_100_hits, *args, **kwargs):
+        selected_ids.extend(top_100_hits["ID"].unique())
+        return select_top_hits(top_100_hits, *args, **kwargs)
+
+    monkeypatch.setattr(digger_hit, "clean_hits", record_cleaned_ids)
+    monkeypatch.setattr(digger_hit, "select_top_hits", record_ids)
+    memoized, hashes = digger_hit.memoized_top_hits(hdf_name, top_100_hits, thresholds)
+
+    assert cleaned_ids == selected_ids == []
+    assert list(hashes.index) == list(computed["ID"])
+    pd.testing.assert_frame_equal(memoized, computed)
+
+    # only the hit block that changed is computed again
+    changed = top_100_hits.copy()
+    changed.loc[changed["ID"] == "OTU_2", "Similarity"] -= 3
+    changed_top_hits, changed_hashes = digger_hit.memoized_top_hits(
+        hdf_name, changed, thresholds
+    )
+
+    assert cleaned_ids == selected_ids == ["OTU_2"]
+    assert (changed_hashes != hashes).tolist() == list(hashes.index == "OTU_2")
+    assert (
+        changed_top_hits.loc[changed_top_hits["ID"] == "OTU_2", "Similarity"].iloc[0]
+        == computed.loc[computed["ID"] == "OTU_2", "Similarity"].iloc[0] - 3
+    )
+
+
+def test_outdated_top_hits_are_pruned(finished_project):
+    hdf_name = project_file(finished_project)
+    top_hit_memo = digger_hit.load_top_hit_memo(hdf_name)
+    live_hashes = list(top_hit_memo.index)
+
+    # a few outdated top hits are kept, rewriting the memo would cost more than it saves
+    outdated = top_hit_memo.reset_index().iloc[[0] * 1200]
+    outdated["hash"] = [
+        hashlib.sha1(str(i).encode()).hexdigest() for i in range(len(outdated))
+    ]
+    digger_hit.save_top_hit_memo(hdf_name, outdated.iloc[:1000])
+    digger_hit.prune_top_hit_memo(hdf_name, live_hashes)
+
+    assert len(digger_hit.load_top_hit_memo(hdf_name)) == len(live_hashes) + 1000
+
+    # once they outnumber the live top hits the memo is rewritten with the live ones only
+    digger_hit.save_top_hit_memo(hdf_name, outdated.iloc[1000:])
+    digger_hit.prune_top_hit_memo(hdf_name, live_hashes)
+
+    pd.testing.assert_frame_equal(
+        digger_hit.load_top_hit_memo(hdf_name), top_hit_memo, check_index_type=False
+    )
+
+
+def test_memoized_record_counts_keep_their_type(finished_project):
+    hdf_name = project_file(finished_project)
+    top_100_hits = pd.read_hdf(
+        hdf_name,
+        key="top_100_hits_additional_data",
+        columns=digger_hit.top_hit_columns,
+    )
+    memoized, _ = digger_hit.memoized_top_hits(hdf_name, top_100_hits, thresholds)
+
+    # IDs that all have a record count, their top hits are all memoized
+    counted = top_100_hits.loc[
+        top_100_hits["ID"].isin(memoized.loc[memoized["records"].notna(), "ID"])
+    ]
+    computed = digger_hit.select_top_hits(
+        digger_hit.clean_hits(counted.copy(), hdf_name),
+        thresholds,
+        digger_hit.load_threshold_inputs(hdf_name),
+    )
+
+    pd.testing.assert_frame_equal(
+        digger_hit.memoized_top_hits(hdf_name, counted, thresholds)[0], computed
+    )
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+from boldigger2 import id_engine_coi
+from conftest import generate_queries, project_file, thresholds, write_fasta
+
+identification_requests = "/index.php/IDS_IdentificationRequest"
+
+
+class Killed(BaseException):
+    pass
+
+
+# function to stop a run right after the first download links were saved
+def kill(*args, **kwargs):
+    raise Killed
+
+
+# function to identify a fasta file against the mock and return its ordered hits
+def identify(fasta_path):
+    id_engine_coi.main(
+        fasta_path,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["none"],
+        interactive=False,
+    )
+
+    return pd.read_hdf(project_file(fasta_path), key="top_100_hits_sorted").drop(
+        columns="request_date"
+    )
+
+
+@pytest.fixture
+def killed_project(tmp_path, references, mock_bold, monkeypatch):
+    # all sequences are submitted in one request
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 10)
+    mock_bold.config["hits_per_page"] = 20
+    for name in ["killed", "reliable"]:
+        tmp_path.joinpath(name).mkdir()
+        write_fasta(
+            tmp_path.joinpath(name, "queries.fasta"),
+            generate_queries(references[0], 8),
+        )
+
+    with monkeypatch.context() as patch:
+        patch.setattr(id_engine_coi, "as_session", kill)
+        with pytest.raises(Killed):
+            identify(tmp_path.joinpath("killed", "queries.fasta"))
+
+    return tmp_path.joinpath("killed", "queries.fasta")
+
+
+# function to return the number of identification requests of a run and its ordered hits
+def counted_identify(fasta_path, mock_bold):
+    submitted = mock_bold.request_counts[identification_requests]
+    top_100_hits = identify(fasta_path)
+
+    return mock_bold.request_counts[identification_requests] - submitted, top_100_hits
+
+
+def test_stored_links_are_downloaded_after_a_restart(killed_project, mock_bold):
+    links = pd.read_hdf(project_file(killed_project), key="download_links")
+
+    assert mock_bold.request_counts[identification_requests] == 1
+    assert set(links["id"]) == set(id_engine_coi.read_fasta(killed_project)[0])
+
+    reliable_requests, reliable_hits = counted_identify(
+        killed_project.parents[1].joinpath("reliable", "queries.fasta"), mock_bold
+    )
+    requests, top_100_hits = counted_identify(killed_project, mock_bold)
+
+    # the sequences are not submitted to the species database again
+    assert requests == reliable_requests - 1
+    pd.testing.assert_frame_equal(top_100_hits, reliable_hits)
+
+
+def test_expired_links_are_submitted_again(killed_project, mock_bold, monkeypatch):
+    monkeypatch.setattr(id_engine_coi, "download_link_max_age", 0)
+
+    reliable_requests, reliable_hits = counted_identify(
+        killed_project.parents[1].joinpath("reliable", "queries.fasta"), mock_bold
+    )
+    requests, top_100_hits = counted_identify(killed_project, mock_bold)
+
+    assert requests == reliable_requests
+    pd.testing.assert_frame_equal(top_100_hits, reliable_hits)
@@ -0,0 +1,51 @@
+import pandas as pd
+from openpyxl import load_workbook
+from boldigger2 import additional_data_download, export
+from conftest import project_file
+
+
+# function to list the exported files of a project
+def exported_files(fasta_path):
+    return sorted(
+        path.name
+        for path in fasta_path.parent.iterdir()
+        if path.suffix in [".xlsx", ".snappy", ".csv"]
+    )
+
+
+# function to replace all missing values of a table with None
+def without_missing_values(dataframe):
+    return dataframe.astype(object).where(dataframe.notna(), None)
+
+
+def test_top_100_hits_are_only_saved_to_parquet_on_request(finished_project):
+    hdf_name = project_file(finished_project)
+    top_100_hits = pd.read_hdf(hdf_name, key="top_100_hits_additional_data")
+    exported = exported_files(finished_project)
+
+    # the default formats save the top 100 hits to excel only
+    additional_data_download.excel_converter(hdf_name, export.default_output_formats)
+
+    assert sorted(set(exported_files(finished_project)) - set(exported)) == [
+        "queries_top_100_hits_part_0.xlsx"
+    ]
+
+    workbook = load_workbook(
+        finished_project.with_name("queries_top_100_hits_part_0.xlsx"), read_only=True
+    )
+    assert len(list(workbook.active.iter_rows())) == len(top_100_hits.index) + 1
+
+    additional_data_download.excel_converter(hdf_name, ["top_100_parquet", "csv"])
+
+    # missing text values are read back as None
+    pd.testing.assert_frame_equal(
+        without_missing_values(
+            pd.read_parquet(
+                finished_project.with_name("queries_top_100_hits.parquet.snappy")
+            )
+        ),
+        without_missing_values(top_100_hits.reset_index(drop=True)),
+    )
+    assert len(
+        pd.read_csv(finished_project.with_name("queries_top_100_hits.csv")).index
+    ) == len(top_100_hits.index)
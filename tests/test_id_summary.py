@@ -0,0 +1,63 @@
+import pandas as pd
+from boldigger2 import digger_hit, id_summary, journal
+from conftest import project_file, thresholds
+
+threshold_sets = [thresholds, [99, 97, 95, 90, 50], [100, 99, 98, 97, 96]]
+
+
+def test_thresholds_from_the_summary_match_the_hits(finished_project):
+    hdf_name = project_file(finished_project)
+    top_100_hits = digger_hit.read_clean_data(
+        hdf_name, columns=digger_hit.top_hit_columns
+    )
+    threshold_inputs = digger_hit.load_threshold_inputs(hdf_name)
+
+    assert set(threshold_inputs) == set(top_100_hits["ID"])
+
+    for id, hits_for_id in top_100_hits.groupby("ID", sort=False):
+        hits_for_id = hits_for_id.reset_index(drop=True)
+        for set_thresholds in threshold_sets:
+            assert digger_hit.get_threshold(
+                hits_for_id, set_thresholds, threshold_inputs[id]
+            ) == digger_hit.get_threshold(hits_for_id, set_thresholds)
+
+
+def test_missing_summaries_are_backfilled_from_the_hits(finished_project):
+    hdf_name = project_file(finished_project)
+    summary = id_summary.load(hdf_name)
+
+    journal.discard(hdf_name, id_summary.summary_key)
+    backfilled = id_summary.load(hdf_name)
+
+    sort = ["ID", "database"]
+    pd.testing.assert_frame_equal(
+        backfilled.sort_values(sort).reset_index(drop=True),
+        summary.sort_values(sort).reset_index(drop=True),
+    )
+    # the backfilled summary is saved, it is only computed once
+    assert journal.load_state(hdf_name)["nrows"][id_summary.summary_key] == len(summary)
+
+
+def test_summary_of_hits_without_matches():
+    columns = ["ID", "database", "Species", "Similarity", "Process_ID", "request_date"]
+    hits = pd.DataFrame(
+        [
+            ["OTU_1", "species", "Apis mellifera", 99.5, "A-1", "2024-01-01 10:00:00"],
+            ["OTU_1", "species", "Apis sp. 1", 99.8, "A-2", "2024-01-01 10:00:00"],
+            ["OTU_1", "species", "Apis cerana", 100.0, "A-3", "2024-01-02 10:00:00"],
+            ["OTU_2", "species", "NoMatch", 0.0, "", "2024-01-01 10:00:00"],
+            ["OTU_3", "all_records", "BrokenRecord", 0.0, "", "2024-01-01 10:00:00"],
+        ],
+        columns=columns,
+    )
+
+    summary = id_summary.summarize(hits).set_index("ID")
+
+    # only the first response counts, names with punctuation or digits are no valid species
+    assert summary.loc["OTU_1", "hits"] == 2
+    assert summary.loc["OTU_1", "max_similarity"] == 99.8
+    assert summary.loc["OTU_1", "valid_species_similarity"] == 99.5
+    assert summary.loc["OTU_1", "process_ids"] == 2
+    assert summary["status_class"].tolist() == ["Hits", "NoMatch", "BrokenRecord"]
+    assert id_summary.valid_species_ids(summary.reset_index(), [99.5]) == {"OTU_1"}
+    assert id_summary.valid_species_ids(summary.reset_index(), [99.6]) == set()
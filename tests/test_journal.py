@@ -0,0 +1,109 @@
+import os
+import pandas as pd
+import pytest
+from boldigger2 import digger_hit, id_engine_coi, journal
+from boldigger2.exceptions import ProjectError
+from conftest import project_file, thresholds
+
+
+# function to read all journaled tables of a project storage
+def journaled_tables(hdf_name):
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        return {
+            key: hdf_input.select(key)
+            for key in journal.journaled_keys
+            if "/{}".format(key) in hdf_input.keys()
+        }
+
+
+def test_recover_removes_the_rows_of_an_interrupted_append(
+    finished_project, reference_library
+):
+    hdf_name = project_file(finished_project)
+    tables = journaled_tables(hdf_name)
+    result = pd.read_parquet(
+        finished_project.with_name("queries_identification_result.parquet.snappy")
+    )
+
+    # a run that was killed after appending rows, but before their checkpoint
+    with pd.HDFStore(hdf_name, mode="a") as hdf_output:
+        for key in ["top_100_hits_unsorted", digger_hit.top_hit_memo_key]:
+            hdf_output.append(key, tables[key].iloc[:7], format="t", index=False)
+
+    journal.recover(hdf_name)
+
+    for key, table in journaled_tables(hdf_name).items():
+        pd.testing.assert_frame_equal(table, tables[key])
+
+    # the next run continues from the checkpoint and gets the same result
+    id_engine_coi.main(
+        finished_project,
+        thresholds=thresholds,
+        output_formats=["parquet"],
+        interactive=False,
+        reference_library=reference_library,
+    )
+
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(
+            finished_project.with_name("queries_identification_result.parquet.snappy")
+        ),
+        result,
+    )
+
+
+def test_interrupted_discard_is_finished_by_recover(finished_project):
+    hdf_name = project_file(finished_project)
+
+    # the checkpoint of the removal was written, the table was not removed yet
+    journal.record(hdf_name, "checkpoint", key="top_100_hits_sorted", nrows=0)
+    journal.recover(hdf_name)
+
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        assert "/top_100_hits_sorted" not in hdf_input.keys()
+
+
+def test_torn_last_line_is_ignored_and_cut_off(finished_project):
+    hdf_name = project_file(finished_project)
+    state = {key: value.copy() for key, value in journal.load_state(hdf_name).items()}
+
+    with open(journal.journal_path(hdf_name), "a") as journal_file:
+        journal_file.write('{"stage": "checkpoint", "key": "id_summ')
+
+    assert journal.load_state(hdf_name) == state
+
+    # new entries start on a fresh line after recover
+    journal.recover(hdf_name)
+    journal.record(hdf_name, "parsed", ids=["OTU_X"], database="species")
+
+    assert "OTU_X" in journal.ids_in_stage(
+        journal.load_state(hdf_name), "parsed", "species"
+    )
+    assert journal.load_state(hdf_name)["nrows"] == state["nrows"]
+
+
+def test_replaced_journal_is_replayed_from_the_start(finished_project):
+    hdf_name = project_file(finished_project)
+    journal.load_state(hdf_name)
+
+    # a journal that was deleted is bootstrapped from the tables in the storage again
+    os.remove(journal.journal_path(hdf_name))
+    state = journal.load_state(hdf_name)
+
+    with pd.HDFStore(hdf_name, mode="r") as hdf_input:
+        assert state["nrows"] == {
+            key: hdf_input.get_storer(key).nrows
+            for key in journal.journaled_keys
+            if "/{}".format(key) in hdf_input.keys()
+        }
+
+
+def test_damaged_storage_is_reported(finished_project):
+    hdf_name = project_file(finished_project)
+
+    # a run killed while hdf5 wrote the structure of the file
+    with open(hdf_name, "rb+") as hdf_file:
+        hdf_file.truncate(os.path.getsize(hdf_name) // 2)
+
+    with pytest.raises(ProjectError, match="is damaged"):
+        journal.recover(hdf_name)
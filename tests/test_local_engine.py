@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from boldigger2 import in_memory, local_engine
+from boldigger2.exceptions import ReferenceLibraryError
+
+
+# function to search a sequence, returns the hits as process ids and similarities
+def search(reference_library, sequence, species_only=False):
+    library = local_engine.open_library(reference_library)
+    records = pd.read_parquet(reference_library.joinpath("records.parquet"))
+    references, similarities = local_engine.search_sequence(
+        library, sequence, species_only
+    )
+
+    return list(records["processid"].iloc[references]), list(similarities)
+
+
+def test_references_are_found_exactly(reference_library, references):
+    sequences, metadata = references
+
+    for processid in ["REF0000-20", "REF0040-20", "REF0071-20"]:
+        hits, similarities = search(reference_library, sequences[processid][20:480])
+
+        assert hits[0] == processid
+        assert similarities[0] == 100.0
+        # the references of the same species follow before the other species of the genus
+        species = metadata.set_index("processid").loc[hits[:3], "species"]
+        assert species.nunique() == 1
+        assert similarities == sorted(similarities, reverse=True)
+
+
+def test_mismatches_and_indels_are_scored(reference_library, references):
+    sequence = references[0]["REF0013-20"][20:480]
+
+    # 9 mismatches in 460 bases
+    mismatches = list(sequence)
+    for position in range(10, 460, 50):
+        mismatches[position] = "A" if mismatches[position] != "A" else "C"
+    hits, similarities = search(reference_library, "".join(mismatches))
+
+    assert hits[0] == "REF0013-20"
+    assert similarities[0] == np.round((460 - 9) / 460 * 100, 2)
+
+    # a deletion of 3 bases is bridged by scoring both sides on their own diagonal
+    hits, similarities = search(reference_library, sequence[:200] + sequence[203:])
+
+    assert hits[0] == "REF0013-20"
+    assert similarities[0] >= 99
+
+
+def test_species_database_only_returns_named_species(reference_library, references):
+    sequences, metadata = references
+    unnamed = metadata.loc[metadata["species"] == "", "processid"].iloc[0]
+
+    hits, _ = search(reference_library, sequences[unnamed], species_only=False)
+    assert hits[0] == unnamed
+
+    hits, _ = search(reference_library, sequences[unnamed], species_only=True)
+    assert hits
+    assert not set(hits) & set(metadata.loc[metadata["species"] == "", "processid"])
+
+
+def test_search_writes_hits_and_no_matches(reference_library, references):
+    sequences = references[0]
+    rng = np.random.default_rng(2)
+    fasta_dict = {
+        "OTU_1": SeqRecord(Seq(sequences["REF0005-20"])),
+        "OTU_2": SeqRecord(Seq("".join(rng.choice(list("ACGT"), 450)))),
+    }
+    project = in_memory.Project()
+
+    local_engine.search(reference_library, fasta_dict, project, "all_records", 1)
+    hits = project.top_100_hits()
+
+    first_hit = hits.loc[hits["ID"] == "OTU_1"].iloc[0]
+    assert (first_hit["Process_ID"], first_hit["Similarity"]) == ("REF0005-20", 100.0)
+    assert hits.loc[hits["ID"] == "OTU_2", "Species"].tolist() == ["NoMatch"]
+    assert set(hits["database"]) == {"all_records"}
+
+    # the additional data of every hit is stored once
+    additional_data = project.additional_data_table([])
+    assert sorted(additional_data["processid"]) == sorted(
+        set(hits["Process_ID"]) - {""}
+    )
+    assert set(additional_data["bin_uri"]) <= {
+        "BOLD:AAA{:04d}".format(i) for i in range(24)
+    }
+
+
+def test_invalid_libraries_are_rejected(tmp_path, reference_library):
+    with pytest.raises(ReferenceLibraryError):
+        local_engine.library_info(tmp_path)
+
+    with pytest.raises(ReferenceLibraryError):
+        local_engine.build(
+            reference_library.parent.joinpath("references.fasta"),
+            reference_library.parent.joinpath("metadata.tsv"),
+            tmp_path.joinpath("library"),
+            kmer_size=17,
+        )
@@ -0,0 +1,51 @@
+import time
+import pytest
+from boldigger2 import login, urls
+from boldigger2.exceptions import LoginError
+
+
+def no_prompt(*args):
+    raise AssertionError("the login prompted for input")
+
+
+def test_cached_sessions_are_reused(mock_bold, monkeypatch):
+    monkeypatch.setattr(login.getpass, "getpass", no_prompt)
+
+    session, username, password = login.bold_login("user", "secret")
+    assert login.probe_login(session)
+
+    # the second login reuses the cookies and needs no password
+    session, username, password = login.bold_login("user", "", interactive=False)
+    assert login.probe_login(session)
+    assert password == ""
+    assert mock_bold.request_counts["/index.php/Login"] == 1
+
+
+def test_expired_sessions_without_password_fail_fast(mock_bold, monkeypatch):
+    monkeypatch.setattr(login.getpass, "getpass", no_prompt)
+    session, username, password = login.bold_login("user", "secret")
+    login.bold_login("user", "", interactive=False)
+
+    # the session expires during a run that started with the cached cookies
+    session.cookies.clear()
+
+    with pytest.raises(LoginError):
+        login.ensure_login(session, "user", "", interactive=True)
+
+    # with the password the session is renewed
+    session, username, password = login.ensure_login(session, "user", "secret")
+    assert login.probe_login(session)
+
+
+def test_failing_probes_are_not_retried(mock_bold, monkeypatch):
+    session = login.new_session()
+    # the retry strategy of the session would back off for minutes on the 404 of a wrong url
+    session.mount("http://", session.get_adapter("https://"))
+    monkeypatch.setattr(urls, "v4_url", "{}/missing".format(mock_bold.url))
+
+    start = time.perf_counter()
+    assert not login.probe_login(session)
+    assert time.perf_counter() - start < 5
+    assert (
+        mock_bold.request_counts["/missing/index.php/MAS_Management_UserConsole"] == 1
+    )
@@ -0,0 +1,55 @@
+import json
+import pandas as pd
+from boldigger2 import id_engine_coi
+from conftest import generate_queries, project_file, thresholds, write_fasta
+
+
+def test_metrics_match_the_requests_and_writes_of_a_run(
+    tmp_path, references, mock_bold, monkeypatch
+):
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 4)
+    mock_bold.config["hits_per_page"] = 20
+    fasta_path = tmp_path.joinpath("queries.fasta")
+    write_fasta(fasta_path, generate_queries(references[0], 8))
+
+    id_engine_coi.main(
+        fasta_path,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["parquet"],
+        metrics_textfile=tmp_path.joinpath("boldigger2.prom"),
+        interactive=False,
+    )
+
+    metrics = json.loads(tmp_path.joinpath("queries_metrics.json").read_text())
+
+    # every request the mock answered is recorded once
+    assert {
+        endpoint: values["requests"]
+        for endpoint, values in metrics["endpoints"].items()
+    } == mock_bold.request_counts
+
+    assert {"link_generation", "additional_data", "top_hits", "export"} <= set(
+        metrics["stages"]
+    )
+    assert metrics["hdf_appends"]["top_100_hits_unsorted"]["rows"] == len(
+        pd.read_hdf(project_file(fasta_path), key="top_100_hits_unsorted").index
+    )
+
+    # the textfile holds the final counts, the last bucket of a histogram holds all requests
+    textfile = dict(
+        line.rsplit(" ", 1)
+        for line in tmp_path.joinpath("boldigger2.prom").read_text().splitlines()
+        if not line.startswith("#")
+    )
+    endpoint = "/index.php/IDS_IdentificationRequest/results"
+    label = 'endpoint="{}"'.format(endpoint)
+    histogram = "boldigger2_http_request_duration_seconds"
+
+    assert int(textfile['{}_bucket{{{},le="+Inf"}}'.format(histogram, label)]) == (
+        mock_bold.request_counts[endpoint]
+    )
+    assert int(textfile["{}_count{{{}}}".format(histogram, label)]) == (
+        mock_bold.request_counts[endpoint]
+    )
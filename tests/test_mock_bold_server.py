@@ -0,0 +1,80 @@
+import shutil
+import pandas as pd
+import requests
+from pathlib import Path
+from boldigger2 import id_engine_coi
+from conftest import generate_queries, project_file, thresholds, write_fasta
+
+
+# function to identify a copy of a fasta file against the mock and return its ordered hits
+def identify(fasta_path, directory):
+    directory.mkdir()
+    fasta_path = Path(shutil.copy(fasta_path, directory))
+
+    id_engine_coi.main(
+        fasta_path,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["none"],
+        interactive=False,
+    )
+
+    return pd.read_hdf(project_file(fasta_path), key="top_100_hits_sorted").drop(
+        columns="request_date"
+    )
+
+
+def test_result_pages_only_depend_on_the_sequence(mock_bold):
+    sequences = ">OTU_1\nACGT\n>OTU_2\nACGA\n>OTU_3\nACGT\n"
+
+    def result_pages():
+        response = requests.post(
+            "{}/index.php/IDS_IdentificationRequest".format(mock_bold.url),
+            data={"sequence": sequences, "searchdb": "COX1_SPECIES"},
+        )
+        links = response.text.split('result="')[1:]
+
+        return [requests.get(mock_bold.url + link.split('"')[0]).text for link in links]
+
+    first, second = result_pages(), result_pages()
+
+    assert first == second
+    # the same sequence under a different ID gets a different page, the hits are seeded by both
+    assert len(set(first)) == 3
+
+
+def test_identification_survives_rate_limits_and_short_responses(
+    tmp_path, references, mock_bold, monkeypatch
+):
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 4)
+    mock_bold.config["hits_per_page"] = 20
+    write_fasta(tmp_path.joinpath("queries.fasta"), generate_queries(references[0], 8))
+
+    reliable = identify(
+        tmp_path.joinpath("queries.fasta"), tmp_path.joinpath("reliable")
+    )
+
+    # the first identification request is missing a link, the endpoints allow few requests per second
+    render_ids_response = mock_bold.render_ids_response
+
+    def short_first_response(sequences, searchdb):
+        mock_bold.config["short_links_rate"] = float(not short_responses)
+        short_responses.append(searchdb)
+        return render_ids_response(sequences, searchdb)
+
+    short_responses = []
+    monkeypatch.setattr(mock_bold, "render_ids_response", short_first_response)
+    mock_bold.config["rate_limit"] = 3
+    counts = dict(mock_bold.request_counts)
+
+    unreliable = identify(
+        tmp_path.joinpath("queries.fasta"), tmp_path.joinpath("unreliable")
+    )
+
+    pd.testing.assert_frame_equal(unreliable, reliable)
+    assert len(short_responses) > counts["/index.php/IDS_IdentificationRequest"]
+
+    # rate limited result pages are downloaded again
+    results = "/index.php/IDS_IdentificationRequest/results"
+    assert mock_bold.request_counts[results] - counts[results] > counts[results]
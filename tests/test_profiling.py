@@ -0,0 +1,19 @@
+from boldigger2 import profiling
+
+
+def test_summary_only_covers_the_stages_of_the_current_run(tmp_path):
+    directory = tmp_path.joinpath("profile")
+
+    for stage_name in ["first_run", "second_run"]:
+        profiling.enable(directory)
+        with profiling.stage(stage_name):
+            sum(range(1000))
+        profiling.write_summary()
+
+    profiling.disable()
+
+    summary = directory.joinpath("summary.txt").read_text()
+
+    assert "=== second_run (1 profiles) ===" in summary
+    assert "first_run" not in summary
+    assert not list(directory.glob("first_run_*"))
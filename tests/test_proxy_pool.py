@@ -0,0 +1,97 @@
+import time
+from boldigger2 import proxy_pool
+
+
+# function to return a pool with validated proxies of the given latencies, no candidates are scraped
+def filled_pool(latencies):
+    pool = proxy_pool.ProxyPool(source=lambda: [])
+
+    for address, latency in latencies.items():
+        pool.proxies[address] = proxy_pool.Proxy(address, latency)
+
+    return pool
+
+
+def test_direct_connection_is_preferred_then_the_best_proxy():
+    pool = filled_pool({"http://slow:1": 2.0, "http://fast:1": 0.5})
+
+    assert pool.acquire().direct
+    assert pool.acquire().address == "http://fast:1"
+    assert pool.acquire().address == "http://slow:1"
+
+
+def test_failing_proxies_are_evicted():
+    pool = filled_pool({"http://broken:1": 0.5, "http://timeouts:1": 0.5})
+    pool.direct = None
+
+    broken = pool.proxies["http://broken:1"]
+    pool.release(pool.acquire(), "success", 0.5)
+    pool.release(broken, "broken")
+
+    assert list(pool.proxies) == ["http://timeouts:1"]
+
+    # proxies are evicted after too many failures in a row
+    timeouts = pool.proxies["http://timeouts:1"]
+    for _ in range(proxy_pool.max_consecutive_failures - 1):
+        pool.release(pool.acquire(), "timeout")
+        assert "http://timeouts:1" in pool.proxies
+
+    pool.release(pool.acquire(), "timeout")
+
+    assert timeouts.attempts == proxy_pool.max_consecutive_failures
+    assert not pool.proxies
+
+
+def test_overloaded_connections_cool_down(monkeypatch):
+    monkeypatch.setattr(proxy_pool, "cooldown", 0.3)
+    pool = filled_pool({"http://proxy:1": 0.5})
+
+    # the direct connection is paused, the proxy is used meanwhile
+    pool.release(pool.acquire(), "overload")
+    proxy = pool.acquire()
+
+    assert proxy.address == "http://proxy:1"
+
+    # the direct connection is never evicted, it is paused after failures in a row
+    start = time.monotonic()
+    pool.release(proxy, "overload")
+
+    connection = pool.acquire()
+
+    assert connection.direct
+    assert time.monotonic() - start >= 0.2
+
+    for _ in range(proxy_pool.max_consecutive_failures):
+        pool.release(connection, "timeout")
+        connection = pool.acquire()
+
+    assert pool.direct is not None
+    assert connection.address == "http://proxy:1"
+
+
+def test_refill_validates_candidates_once(monkeypatch):
+    candidates = ["http://good:1", "http://bad:1", "http://good:2"]
+    validated = []
+
+    def validate(self, address):
+        validated.append(address)
+        return 0.1 if "good" in address else None
+
+    monkeypatch.setattr(proxy_pool.ProxyPool, "validate", validate)
+    monkeypatch.setattr(proxy_pool, "refill_wait", 0.05)
+
+    with proxy_pool.ProxyPool(
+        source=lambda: candidates, size=2, use_direct=False
+    ).start("http://validation") as pool:
+        deadline = time.monotonic() + 5
+        while len(pool.proxies) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert sorted(pool.proxies) == ["http://good:1", "http://good:2"]
+
+        # evicted proxies are not validated again
+        pool.release(pool.acquire(), "broken")
+        time.sleep(0.2)
+
+    assert sorted(validated) == sorted(candidates)
+    assert len(pool.proxies) == 1
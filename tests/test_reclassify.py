@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+import requests
+from boldigger2 import digger_hit, journal
+from boldigger2.exceptions import ProjectError
+from conftest import project_file, thresholds
+
+
+# function to read the identification result of a project
+def identification_result(fasta_path):
+    return pd.read_parquet(
+        fasta_path.with_name(
+            "{}_identification_result.parquet.snappy".format(fasta_path.stem)
+        )
+    )
+
+
+def no_network(*args, **kwargs):
+    raise AssertionError("reclassify used the network")
+
+
+def test_reclassify_reproduces_and_replaces_the_result(finished_project, monkeypatch):
+    monkeypatch.setattr(requests.Session, "request", no_network)
+    result = identification_result(finished_project)
+
+    digger_hit.reclassify(
+        project_file(finished_project), thresholds, output_formats=["parquet"]
+    )
+
+    pd.testing.assert_frame_equal(identification_result(finished_project), result)
+
+    # stricter thresholds move some top hits up the taxonomy
+    digger_hit.reclassify(
+        project_file(finished_project), [99, 98, 97, 96, 50], output_formats=["parquet"]
+    )
+    strict = identification_result(finished_project)
+
+    assert strict["ID"].tolist() == result["ID"].tolist()
+    assert (strict["Species"].notna() <= result["Species"].notna()).all()
+    assert strict["Species"].notna().sum() < result["Species"].notna().sum()
+
+
+def test_reclassify_needs_a_finished_project(finished_project):
+    journal.discard(project_file(finished_project), "top_100_hits_additional_data")
+
+    with pytest.raises(ProjectError, match="finish the identification"):
+        digger_hit.reclassify(project_file(finished_project), thresholds)
@@ -0,0 +1,91 @@
+import shutil
+import pandas as pd
+import pytest
+from boldigger2 import id_engine_coi, messages, sharding
+from boldigger2.exceptions import ProjectError
+from boldigger2.id_engine_coi import read_fasta
+from conftest import generate_queries, thresholds, write_fasta
+
+shard_count = 3
+
+
+# the queries of the finished project, every shard identified with the reference library
+@pytest.fixture(scope="module")
+def shard_template(tmp_path_factory, references, reference_library):
+    directory = tmp_path_factory.mktemp("shards")
+    write_fasta(
+        directory.joinpath("queries.fasta"), generate_queries(references[0], 40)
+    )
+
+    messages.disable()
+    for shard_index in range(1, shard_count + 1):
+        id_engine_coi.main(
+            directory.joinpath("queries.fasta"),
+            thresholds=thresholds,
+            output_formats=["none"],
+            interactive=False,
+            reference_library=reference_library,
+            shard=(shard_index, shard_count),
+        )
+
+    return directory
+
+
+@pytest.fixture
+def queries(tmp_path, shard_template):
+    shutil.copytree(shard_template, tmp_path, dirs_exist_ok=True)
+
+    return tmp_path.joinpath("queries.fasta")
+
+
+def test_every_id_lands_in_one_shard(queries):
+    ids = list(read_fasta(queries)[0])
+    shard_ids = [
+        list(
+            read_fasta(
+                sharding.write_shard(queries, shard_index, shard_count, read_fasta)
+            )[0]
+        )
+        for shard_index in range(1, shard_count + 1)
+    ]
+
+    assert sorted(id for ids_of_shard in shard_ids for id in ids_of_shard) == sorted(
+        ids
+    )
+    assert all(ids_of_shard for ids_of_shard in shard_ids)
+
+    # the shards keep the order of the fasta file
+    for ids_of_shard in shard_ids:
+        assert ids_of_shard == [id for id in ids if id in ids_of_shard]
+
+
+def test_merge_matches_the_unsharded_identification(queries, project_template):
+    sharding.merge(
+        queries, read_fasta, thresholds=thresholds, output_formats=["parquet"]
+    )
+    top_hits = pd.read_parquet(
+        queries.with_name("queries_identification_result.parquet.snappy")
+    )
+
+    assert top_hits["ID"].tolist() == list(read_fasta(queries)[0])
+    pd.testing.assert_frame_equal(
+        top_hits,
+        pd.read_parquet(
+            project_template.joinpath("queries_identification_result.parquet.snappy")
+        ),
+    )
+
+    # the specimen data of process ids that are hit from several shards is stored once
+    hdf_name = queries.with_name("queries_top_100_hits.h5.lz")
+    process_ids = pd.read_hdf(hdf_name, key="additional_data")["processid"]
+    assert process_ids.is_unique
+    assert set(process_ids) == set(
+        pd.read_hdf(hdf_name, key="top_100_hits_sorted")["Process_ID"]
+    ) - {""}
+
+
+def test_incomplete_shards_are_not_merged(queries):
+    queries.with_name("queries_shard_2_of_3_top_100_hits.h5.lz").unlink()
+
+    with pytest.raises(ProjectError, match="Shards 2 of 3 are missing."):
+        sharding.merge(queries, read_fasta, thresholds=thresholds)
@@ -0,0 +1,54 @@
+import subprocess, sys, time
+import pytest
+
+# maximum number of seconds the command line interface may need to start
+# python itself starts in about 0.05 s, importing the identification engine takes > 1.5 s
+startup_budget = 0.5
+
+# dependencies that must only be imported when the identification engine runs
+heavy_modules = [
+    "pandas",
+    "numpy",
+    "Bio",
+    "bs4",
+    "requests_html",
+    "pyppeteer",
+    "tqdm",
+    "joblib",
+]
+
+
+# function to return the fastest of several runs to reduce noise
+def fastest_run(arguments, runs=5):
+    run_times = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "boldigger2"] + arguments,
+            capture_output=True,
+            check=False,
+        )
+        run_times.append(time.perf_counter() - start)
+
+    return min(run_times)
+
+
+def test_no_heavy_imports():
+    loaded_modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, boldigger2.__main__; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    assert not [module for module in heavy_modules if module in loaded_modules]
+
+
+@pytest.mark.parametrize("arguments", [["--version"], [], ["identify", "-h"]])
+def test_startup_time(arguments):
+    assert fastest_run(arguments) < startup_budget
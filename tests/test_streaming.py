@@ -0,0 +1,58 @@
+import pandas as pd
+from boldigger2 import digger_hit, id_engine_coi, streaming
+from conftest import generate_queries, thresholds, write_fasta
+
+
+def test_online_results_match_the_final_result(
+    tmp_path, references, mock_bold, monkeypatch
+):
+    # the sequences are submitted in several requests, every request completes some IDs
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 4)
+    monkeypatch.setattr(id_engine_coi, "max_query_size", 4)
+    mock_bold.config["hits_per_page"] = 20
+    fasta_path = tmp_path.joinpath("queries.fasta")
+    write_fasta(fasta_path, generate_queries(references[0], 16))
+
+    select_top_hits = digger_hit.select_top_hits
+    selected_ids = []
+
+    def record_ids(top_100_hits, *args, **kwargs):
+        selected_ids.extend(top_100_hits["ID"].unique())
+        return select_top_hits(top_100_hits, *args, **kwargs)
+
+    monkeypatch.setattr(digger_hit, "select_top_hits", record_ids)
+
+    top_hits = id_engine_coi.main(
+        fasta_path,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["parquet"],
+        interactive=False,
+        online=True,
+    )
+
+    directory = streaming.online_result_directory(tmp_path, "queries")
+    online = pd.read_parquet(directory)
+
+    # the top hits are emitted in several parts, every ID once
+    assert len(list(directory.iterdir())) > 1
+    assert sorted(online["ID"]) == sorted(top_hits["ID"])
+
+    # the final selection reuses the top hits of the online results
+    assert sorted(selected_ids) == sorted(top_hits["ID"])
+
+    final = pd.read_parquet(
+        tmp_path.joinpath("queries_identification_result.parquet.snappy")
+    )
+    pd.testing.assert_frame_equal(
+        digger_hit.fixed_dtypes(online.set_index("ID").loc[final["ID"]].reset_index()),
+        digger_hit.fixed_dtypes(final),
+    )
+    pd.testing.assert_frame_equal(
+        streaming.read_final_top_hits(tmp_path.joinpath("queries_top_100_hits.h5.lz"))
+        .set_index("ID")
+        .loc[final["ID"]]
+        .reset_index(),
+        digger_hit.fixed_dtypes(final),
+    )
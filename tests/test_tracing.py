@@ -0,0 +1,59 @@
+import json
+import pandas as pd
+from boldigger2 import id_engine_coi, tracing
+from conftest import generate_queries, project_file, thresholds, write_fasta
+
+
+def test_trace_covers_every_download_of_a_run(
+    tmp_path, references, mock_bold, monkeypatch
+):
+    monkeypatch.setattr(id_engine_coi, "min_query_size", 4)
+    mock_bold.config["hits_per_page"] = 20
+    fasta_path = tmp_path.joinpath("queries.fasta")
+    write_fasta(fasta_path, generate_queries(references[0], 8))
+
+    id_engine_coi.main(
+        fasta_path,
+        username="user",
+        password="secret",
+        thresholds=thresholds,
+        output_formats=["none"],
+        trace=True,
+        interactive=False,
+    )
+    tracing.disable()
+
+    events = json.loads(tmp_path.joinpath("queries_trace.json").read_text())[
+        "traceEvents"
+    ]
+    spans = [event for event in events if event["ph"] == "X"]
+
+    # every thread of an event is named for the viewer
+    named = {(event["pid"], event["tid"]) for event in events if event["ph"] == "M"}
+    assert {(event["pid"], event["tid"]) for event in spans} <= named
+    assert all(event["ts"] >= 0 and event["dur"] >= 0 for event in spans)
+
+    # one download span per result page the mock served
+    downloads = [event for event in spans if event["name"] == "GET result page"]
+    downloaded = pd.read_hdf(project_file(fasta_path), key="top_100_hits_unsorted")
+
+    assert (
+        len(downloads)
+        == mock_bold.request_counts["/index.php/IDS_IdentificationRequest/results"]
+    )
+    assert {event["args"]["id"] for event in downloads} == set(downloaded["ID"])
+
+    # the downloads run inside the downloads stage
+    stages = [
+        event
+        for event in spans
+        if event["cat"] == "stage" and event["name"] == "downloads"
+    ]
+    assert all(
+        any(
+            stage["ts"] <= event["ts"]
+            and event["ts"] + event["dur"] <= stage["ts"] + stage["dur"]
+            for stage in stages
+        )
+        for event in downloads
+    )
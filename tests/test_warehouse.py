@@ -0,0 +1,91 @@
+import pandas as pd
+from boldigger2 import digger_hit, journal, warehouse
+from conftest import project_file, thresholds
+
+
+def result_table(fasta_path):
+    return pd.read_parquet(
+        fasta_path.with_name(
+            "{}_identification_result.parquet.snappy".format(fasta_path.stem)
+        )
+    )
+
+
+def test_lookups_return_the_registered_top_hits(finished_project, tmp_path):
+    warehouse_path = tmp_path.joinpath("warehouse")
+    warehouse.register([finished_project.parent], warehouse_path, thresholds)
+    result = result_table(finished_project)
+
+    ids = warehouse.query(warehouse_path, ids=["OTU_2", "OTU_4"]).to_pandas()
+    assert sorted(ids["ID"]) == ["OTU_2", "OTU_4"]
+
+    genus = result.loc[result["selected_level"] == "Genus", "Genus"].iloc[0]
+    taxa = warehouse.query(warehouse_path, taxa=[genus]).to_pandas()
+    assert set(taxa["ID"]) == set(result.loc[result["Genus"] == genus, "ID"])
+
+    bin = result["BIN"].dropna().loc[lambda bins: bins != ""].iloc[0].split(";")[0]
+    bins = warehouse.query(warehouse_path, bins=[bin]).to_pandas()
+    assert set(bins["ID"]) == set(
+        result.loc[
+            result["BIN"].fillna("").str.split(";").map(lambda b: bin in b), "ID"
+        ]
+    )
+
+    assert warehouse.query(warehouse_path).num_rows == len(result)
+
+
+def test_unchanged_projects_are_skipped(finished_project, tmp_path, monkeypatch):
+    warehouse_path = tmp_path.joinpath("warehouse")
+
+    # without an exported result and memo the top hits are selected and memoized in the project storage again
+    finished_project.with_name(
+        "{}_identification_result.parquet.snappy".format(finished_project.stem)
+    ).unlink()
+    journal.record(
+        project_file(finished_project),
+        "checkpoint",
+        key=digger_hit.top_hit_memo_key,
+        nrows=0,
+    )
+    source_modified = project_file(finished_project).stat().st_mtime
+    warehouse.register([finished_project.parent], warehouse_path, thresholds)
+    catalog = warehouse.load_catalog(warehouse_path).to_pandas()
+
+    assert catalog["rows"].tolist() == [40]
+    assert catalog["source_modified"].iloc[0] > source_modified
+    assert catalog["source_modified"].iloc[0] == (
+        project_file(finished_project).stat().st_mtime
+    )
+
+    def fail(*args):
+        raise AssertionError("an unchanged project was registered again")
+
+    monkeypatch.setattr(warehouse, "project_top_hits", fail)
+    warehouse.register([finished_project.parent], warehouse_path, thresholds)
+
+    assert warehouse.load_catalog(warehouse_path).to_pandas().equals(catalog)
+
+
+def test_failing_projects_are_skipped(finished_project, tmp_path, monkeypatch):
+    warehouse_path = tmp_path.joinpath("warehouse")
+    broken = tmp_path.joinpath("broken")
+    broken.mkdir()
+    for file in finished_project.parent.glob("queries*"):
+        if file.is_file():
+            broken.joinpath(file.name).write_bytes(file.read_bytes())
+
+    registered_project = warehouse.project_key(project_file(finished_project))[1]
+    project_top_hits = warehouse.project_top_hits
+
+    def fail_broken(project_file, fasta_name, thresholds):
+        if project_file.parent == broken:
+            raise ValueError("broken project")
+        return project_top_hits(project_file, fasta_name, thresholds)
+
+    monkeypatch.setattr(warehouse, "project_top_hits", fail_broken)
+    warehouse.register(
+        [broken, project_file(finished_project)], warehouse_path, thresholds
+    )
+
+    catalog = warehouse.load_catalog(warehouse_path).to_pandas()
+    assert catalog["project"].tolist() == [registered_project]